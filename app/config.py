@@ -1,5 +1,6 @@
 # fastapi_project/app/config.py
 
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -7,6 +8,75 @@ class Settings(BaseSettings):
     DEBUG: bool = True
     GOOGLE_GENERATIVE_AI_API_KEY: str
 
+    # Cache kết quả DOCX -> HTML theo SHA-256 nội dung file
+    CONVERSION_CACHE_ENABLED: bool = True
+    CONVERSION_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # Giới hạn tầng bộ nhớ (byte)
+    CONVERSION_CACHE_DIR: Optional[str] = None  # Thư mục tầng đĩa, None => chỉ cache trong bộ nhớ
+
+    # Cache fragment HTML theo block cho chuyển đổi tăng dần (incremental=True)
+    FRAGMENT_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    # Tầng đĩa dùng chung cho mọi process của process pool (mỗi worker chỉ có tầng bộ nhớ riêng),
+    # None => chỉ cache trong bộ nhớ của từng process
+    FRAGMENT_CACHE_DIR: Optional[str] = "fragment_cache"
+
+    # Chế độ id của placeholder "...": "random" (uuid4) hoặc "stable" (xác định theo cấu trúc tài liệu)
+    PLACEHOLDER_ID_MODE: str = "random"
+
+    # Chế độ style của HTML: "inline" (style="..." trên từng thẻ) hoặc "classes" (class dùng chung trong <style>)
+    HTML_STYLE_MODE: str = "inline"
+
+    # Chế độ giới hạn bộ nhớ cho tài liệu lớn (bounded=True): engine lxml + HtmlWriter,
+    # kiểm tra kích thước trước khi đọc, vượt giới hạn => 413 thay vì worker bị OOM kill
+    DOCX_BOUNDED_MODE: bool = False  # Giá trị mặc định của tham số bounded
+    DOCX_MAX_UPLOAD_BYTES: int = 50 * 1024 * 1024  # File tải lên (.docx/.doc)
+    DOCX_MAX_PART_BYTES: int = 64 * 1024 * 1024  # Mỗi part XML sau giải nén (document.xml, styles.xml...)
+    DOCX_MAX_MEDIA_BYTES: int = 100 * 1024 * 1024  # Tổng ảnh được document.xml tham chiếu
+    DOCX_MAX_COMPRESSION_RATIO: float = 100  # Giải nén / nén của một part (chặn zip bomb)
+
+    # Pool LibreOffice chuyển .doc -> .docx
+    LIBREOFFICE_PATH: str = "soffice"
+    LIBREOFFICE_POOL_SIZE: int = 2
+    LIBREOFFICE_JOB_TIMEOUT: float = 120  # Giây cho mỗi file, quá hạn => kill và khởi động lại worker
+    LIBREOFFICE_QUEUE_TIMEOUT: float = 300  # Giây chờ tối đa để có worker rảnh
+    LIBREOFFICE_HEALTH_INTERVAL: float = 30  # Giây giữa hai lần kiểm tra worker rảnh, 0 => tắt
+
+    # Kho ảnh tách khỏi HTML (chế độ images="store")
+    IMAGE_STORE_DIR: str = "image_store"
+    IMAGE_URL_PREFIX: str = "/items/images"
+
+    # Batch DOCX -> HTML
+    BATCH_MAX_FILES: int = 500
+    BATCH_CONCURRENCY: int = 4  # Số file chuyển đổi đồng thời trong một batch
+
+    # Executor cho endpoint async (xem app/helpers/executors.py)
+    EXECUTOR_CPU_MODE: str = "process"  # "process" hoặc "thread"
+    EXECUTOR_CPU_START_METHOD: str = "spawn"
+    EXECUTOR_CPU_WORKERS: int = 2
+    EXECUTOR_CPU_MAX_PENDING: int = 16  # Số job chạy + chờ tối đa, vượt quá => 503
+    EXECUTOR_IO_WORKERS: int = 16
+    EXECUTOR_IO_MAX_PENDING: int = 64
+
+    # Client Gemini bất đồng bộ (app/helpers/llm_client.py)
+    GEMINI_TIMEOUT: float = 120  # Deadline (giây) cho mỗi lời gọi, quá hạn => huỷ
+    GEMINI_MAX_CONCURRENCY: int = 64  # Số lời gọi đồng thời tối đa trong một process
+
+    # Cache prompt -> response của Gemini (SQLite), khoá = model + prompt đã chuẩn hoá
+    PROMPT_CACHE_ENABLED: bool = True
+    PROMPT_CACHE_PATH: str = "prompt_cache/prompt_cache.sqlite3"
+    PROMPT_CACHE_TTL: float = 7 * 24 * 3600  # Giây
+    PROMPT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # Gọi Gemini cho các chunk HTML (HtmlToJsonService)
+    GEMINI_CHUNK_MAX_TOKENS: int = 7000  # Kích thước tối đa một chunk HTML (token ước lượng)
+    GEMINI_MINIFY_HTML: bool = True  # Chỉ gửi text, cấu trúc và id placeholder (bỏ CSS, style...)
+    FIELD_RULES_ENABLED: bool = True  # Gán nhãn placeholder theo mẫu câu quen thuộc trước khi gọi Gemini
+    GEMINI_CHUNK_CONCURRENCY: int = 4  # Số chunk gọi API đồng thời
+    GEMINI_CHUNK_RETRIES: int = 2  # Số lần thử lại riêng cho một chunk lỗi
+    GEMINI_RETRY_BACKOFF: float = 1.0  # Giây chờ trước lần thử lại đầu tiên, nhân đôi sau mỗi lần
+
+    # Header Server-Timing (thời gian từng giai đoạn) trên mọi response
+    SERVER_TIMING_ENABLED: bool = True
+
     class Config:
         env_file = ".env"  # Đường dẫn tới tệp .env chứa các biến môi trường
 
@@ -1,15 +1,20 @@
 # fastapi_project/app/controllers/item_controller.py
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import Response
+from fastapi.responses import Response, FileResponse, StreamingResponse
 from app.models.json_response import JSONResponse
-from typing import List, Dict
+from typing import List, Dict, Optional
 from app.services.item_service import ItemService
 from app.services.html_to_json_service import HtmlToJsonService
 from app.services.json_to_html_input import JsonConverterService
+from app.helpers.executors import run_cpu, run_io, ExecutorSaturated
+from app.helpers.placeholder_ids import ID_MODES
+from app.helpers.style_classes import STYLE_MODES
+from app.helpers.docx_limits import DocumentTooLarge
+from app.config import settings
 import logging
 import json
-import re
+import zipfile
 
 router = APIRouter()
 service = ItemService()
@@ -18,36 +23,175 @@ json_service = JsonConverterService()
 
 logger = logging.getLogger(__name__)
 
+async def _prepend(first_chunk, chunks):
+    yield first_chunk
+    async for chunk in chunks:
+        yield chunk
+
 @router.post("/convert-docx-to-html")
-async def convert_docx_to_html(file: UploadFile = File(...)) -> Response:
+async def convert_docx_to_html(
+    file: UploadFile = File(...),
+    streaming: bool = Form(False),
+    output: str = Form("soup"),
+    compact: bool = Form(False),
+    images: str = Form("inline"),
+    incremental: bool = Form(False),
+    stream_response: bool = Form(False),
+    with_index: bool = Form(False),
+    ids: str = Form(settings.PLACEHOLDER_ID_MODE),
+    bounded: bool = Form(settings.DOCX_BOUNDED_MODE),
+    styles: str = Form(settings.HTML_STYLE_MODE),
+    ) -> Response:
+    """
+    with_index=True => trả về JSON {"html", "placeholders"}: HTML kèm chỉ mục các span dấu chấm
+    (id, block, toạ độ ô bảng, nhãn xung quanh). Không áp dụng khi stream_response=True.
+    ids="stable" => id placeholder xác định, cùng file luôn cho cùng HTML.
+    bounded=True => chế độ giới hạn bộ nhớ cho tài liệu lớn (engine lxml, output "string"),
+    vượt giới hạn DOCX_MAX_* => 413.
+    styles="classes" => style lặp lại được gom thành class trong một khối <style> (HTML nhỏ hơn).
+    incremental=True => chỉ render lại các block đã đổi, cần output="string" (hoặc stream_response/bounded).
+    """
     if not (file.filename.endswith(".docx") or file.filename.endswith(".doc")):
         raise HTTPException(status_code=400, detail="File phải có định dạng .docx hoặc .doc")
+    if output not in ("soup", "string"):
+        raise HTTPException(status_code=400, detail="output phải là 'soup' hoặc 'string'")
+    if images not in ("inline", "store"):
+        raise HTTPException(status_code=400, detail="images phải là 'inline' hoặc 'store'")
+    if ids not in ID_MODES:
+        raise HTTPException(status_code=400, detail="ids phải là 'random' hoặc 'stable'")
+    if styles not in STYLE_MODES:
+        raise HTTPException(status_code=400, detail="styles phải là 'inline' hoặc 'classes'")
+    if incremental and output == "soup" and not (stream_response or bounded):
+        raise HTTPException(status_code=400, detail="incremental chỉ dùng được với output='string'")
     try:
         file_bytes = await file.read()
         file_extension = ".docx" if file.filename.endswith(".docx") else ".doc"
-        html_output = service.convert_docx_to_html(file_bytes, file_extension)
+        if stream_response:
+            # Gửi <head> rồi từng block ngay khi chuyển đổi xong (output luôn là "string")
+            chunks = service.stream_docx_to_html(
+                file_bytes, file_extension, streaming=streaming, compact=compact, images=images,
+                incremental=incremental, ids=ids, bounded=bounded, styles=styles,
+            )
+            # Lấy phần đầu trước khi trả response để lỗi/quá tải vẫn trả đúng mã lỗi
+            first_chunk = await chunks.__anext__()
+            return StreamingResponse(_prepend(first_chunk, chunks), media_type="text/html; charset=utf-8")
+
+        result = await service.convert_docx_to_html_async(
+            file_bytes, file_extension, streaming=streaming, output=output, compact=compact, images=images,
+            incremental=incremental, with_index=True, ids=ids, bounded=bounded, styles=styles,
+        )
+        html_output = result["html"]
+        placeholders = result["placeholders"]
+        if with_index:
+            return Response(content=json.dumps(result, ensure_ascii=False), media_type="application/json")
         print(f"Length HTML Output:\n#####################\n {len(html_output)}")
         if len(html_output) > 50000:
             return Response(content=html_output, media_type="text/plain")
 
         # print(f"HTML Output:\n#####################\n {html_output}")
                 
-        pattern = r"<span[^>]*>\s*\.{3,}\s*</span>"
-        matches = re.findall(pattern, html_output)
-        
+        # Số span dấu chấm lấy từ chỉ mục placeholder, không cần quét lại HTML bằng regex
         # Nếu số lượng các thẻ span thỏa mãn điều kiện > 5, trả về luôn html_output gốc
-        print(f"Length Matches:\n#####################\n {len(matches)}")
-        if len(matches) > 5:
+        print(f"Length Matches:\n#####################\n {len(placeholders)}")
+        if len(placeholders) > 5:
             return Response(content=html_output, media_type="text/plain")
         # print(f"HTML Output:\n#####################\n {html_output}")
         # html_finally = html_to_json_service.html_ai_processing(html_output)
         # html_finally = html_to_json_service.html_ai_processing(html_output)
         # html_finallyx = html_to_json_service.flatten_id_spans(html_finally)
         return Response(content=html_output, media_type="text/plain")
+    except (ExecutorSaturated, DocumentTooLarge):
+        raise
     except Exception as e:
         logger.error(f"Error in convert_docx_to_html: {e}")
         raise HTTPException(status_code=500, detail="Có lỗi xảy ra khi chuyển đổi tệp.")
 
+@router.post("/convert-docx-batch")
+async def convert_docx_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    streaming: bool = Form(False),
+    output: str = Form("soup"),
+    compact: bool = Form(False),
+    images: str = Form("inline"),
+    incremental: bool = Form(False),
+    with_index: bool = Form(False),
+    ids: str = Form(settings.PLACEHOLDER_ID_MODE),
+    bounded: bool = Form(settings.DOCX_BOUNDED_MODE),
+    styles: str = Form(settings.HTML_STYLE_MODE),
+    ):
+    """
+    Chuyển nhiều file .docx/.doc trong một request: gửi danh sách `files` và/hoặc một file
+    zip `archive`. Kết quả trả về dạng NDJSON, mỗi dòng một file ngay khi file đó xong,
+    dòng cuối là tổng kết {"summary": true, ...}.
+    with_index=True => mỗi dòng kèm "placeholders" (chỉ mục span dấu chấm).
+    bounded=True => file vượt giới hạn DOCX_MAX_* có status "error", các file khác vẫn chạy.
+    """
+    if output not in ("soup", "string"):
+        raise HTTPException(status_code=400, detail="output phải là 'soup' hoặc 'string'")
+    if images not in ("inline", "store"):
+        raise HTTPException(status_code=400, detail="images phải là 'inline' hoặc 'store'")
+    if ids not in ID_MODES:
+        raise HTTPException(status_code=400, detail="ids phải là 'random' hoặc 'stable'")
+    if styles not in STYLE_MODES:
+        raise HTTPException(status_code=400, detail="styles phải là 'inline' hoặc 'classes'")
+    if incremental and output == "soup" and not bounded:
+        raise HTTPException(status_code=400, detail="incremental chỉ dùng được với output='string'")
+
+    items = []
+    for upload in files or []:
+        items.append((upload.filename, await upload.read()))
+    if archive is not None:
+        try:
+            items.extend(service.extract_batch_archive(await archive.read()))
+        except (zipfile.BadZipFile, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"File zip không hợp lệ: {e}")
+    if not items:
+        raise HTTPException(status_code=400, detail="Không có file .docx hoặc .doc nào")
+    if len(items) > settings.BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Tối đa {settings.BATCH_MAX_FILES} file mỗi batch")
+
+    async def ndjson_lines():
+        succeeded = 0
+        async for result in service.convert_batch(
+            items, streaming=streaming, output=output, compact=compact, images=images, incremental=incremental,
+            with_index=with_index, ids=ids, bounded=bounded, styles=styles,
+        ):
+            if result["status"] == "ok":
+                succeeded += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        summary = {"summary": True, "total": len(items), "succeeded": succeeded, "failed": len(items) - succeeded}
+        yield json.dumps(summary, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@router.get("/images/{image_id}")
+async def get_image(image_id: str):
+    image = service.get_image(image_id)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy ảnh")
+    path, media_type = image
+    # id ảnh là hash nội dung => nội dung không bao giờ đổi, cache vĩnh viễn
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{image_id}"'},
+    )
+
+@router.get("/conversion-cache/stats")
+async def get_conversion_cache_stats() -> Dict:
+    return service.get_cache_stats()
+
+@router.get("/prompt-cache/stats")
+async def get_prompt_cache_stats() -> Dict:
+    # SUM(size) trên SQLite (đọc đĩa, chờ lock) => không chạy trên event loop
+    return await run_io(html_to_json_service.get_prompt_cache_stats)
+
+@router.get("/libreoffice/status")
+async def get_libreoffice_status() -> Dict:
+    # health_check có thể khởi động lại soffice (tới startup timeout) => không chạy trên event loop
+    return await run_io(service.get_libreoffice_status)
+
 @router.post("/convert-html-to-json", response_model=JSONResponse)
 async def convert_html_to_json(html_file: UploadFile = File(...)):
     if not html_file.filename.endswith(".html"):
@@ -58,11 +202,13 @@ async def convert_html_to_json(html_file: UploadFile = File(...)):
         html_str = html_content.decode('utf-8')
         if len(html_str) > 50000:
             raise HTTPException(status_code=500, detail="HTML content is too large")
-        json_output = html_to_json_service.convert_html_to_json(html_str)
+        json_output = await html_to_json_service.convert_html_to_json(html_str)
         if json_output is None:
             raise HTTPException(status_code=500, detail="Failed to convert HTML to JSON")
         content_str = json.dumps(json_output, ensure_ascii=False)
         return Response(content=content_str, media_type="text/plain")
+    except ExecutorSaturated:
+        raise
     except Exception as e:
         logger.error(f"Error in convert_html_to_json: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -78,8 +224,10 @@ async def convert_json_to_html_input(
         json_content = await file.read()
         json_str = json_content.decode('utf-8')
         print(f"JSON Content: {json_str}")
-        html_output = json_service.convert_json_to_html(title, json_str)
+        html_output = await run_cpu(json_service.convert_json_to_html, title, json_str)
         return Response(content=html_output, media_type="text/html")
+    except ExecutorSaturated:
+        raise
     except Exception as e:
         logger.error(f"Error in convert_json_to_html_input: {e}")
         raise HTTPException(status_code=500, detail="Có lỗi xảy ra khi chuyển đổi tệp.")
\ No newline at end of file
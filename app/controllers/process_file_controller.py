@@ -5,6 +5,7 @@ from fastapi.responses import Response
 from app.models.json_response import JSONResponse
 from typing import List, Dict
 from app.services.process_file_service import ProcessFileService
+from app.helpers.executors import ExecutorSaturated
 import logging
 import json
 import re
@@ -28,13 +29,15 @@ async def process_file_endpoint(
     """
     try:
         file_bytes = await file.read()
-        result = service._process_single_file(
+        result = await service._process_single_file(
             file_bytes,
             spelling_grammar,
             content_suggestion,
             selected_model,
         )
         return {"filename": file.filename, "comments": result}
+    except ExecutorSaturated:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -51,11 +54,13 @@ async def process_question_endpoint(
     """
     try:
         file_bytes = await file.read()
-        answer = service.process_question_logic(
+        answer = await service.process_question_logic(
             file_bytes,
             question,
             selected_model,
         )
         return {"filename": file.filename, "question": question, "answer": answer}
+    except ExecutorSaturated:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,134 @@
+# helpers/conversion_cache.py
+
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ConversionCache:
+    """
+    Cache kết quả chuyển đổi theo nội dung file (content-addressed).
+
+    Khoá = SHA-256(version + biến thể + bytes của file), nên cùng một file mẫu
+    được tải lên nhiều lần chỉ phải chuyển đổi một lần.
+
+    - Tầng bộ nhớ: LRU, giới hạn theo tổng số byte của các giá trị (max_bytes).
+    - Tầng đĩa (tuỳ chọn, disk_dir): mỗi khoá một file, còn lại sau khi khởi động lại.
+      Hit ở tầng đĩa được nạp lại vào tầng bộ nhớ.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_dir: str = None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()  # key -> bytes (HTML đã encode UTF-8)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_bytes: bytes, version: str, *variant) -> str:
+        """Khoá cache: SHA-256 của version, các tham số biến thể (engine, output...) và nội dung file."""
+        digest = hashlib.sha256()
+        digest.update(version.encode('utf-8'))
+        for part in variant:
+            digest.update(b'\0')
+            digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(file_bytes)
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.html")
+
+    def get(self, key: str):
+        """Trả về HTML đã cache hoặc None."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return data.decode('utf-8')
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = None
+            except OSError as e:
+                logger.error(f"An error occurred reading conversion cache: {e}")
+                data = None
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._put_memory(key, data)
+                return data.decode('utf-8')
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        data = value.encode('utf-8')
+        with self._lock:
+            self._put_memory(key, data)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Ghi ra file tạm rồi đổi tên để không bao giờ đọc phải file ghi dở
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.error(f"An error occurred writing conversion cache: {e}")
+
+    def _put_memory(self, key: str, data: bytes):
+        # Gọi khi đã giữ self._lock
+        if len(data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        """Xoá tầng bộ nhớ (tầng đĩa giữ nguyên)."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hits": hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": hits / total if total else 0.0,
+                "disk_dir": self.disk_dir,
+            }
@@ -0,0 +1,73 @@
+# helpers/docx_limits.py
+
+import zipfile
+
+from app.config import settings
+
+
+class DocumentTooLarge(Exception):
+    """Tài liệu vượt giới hạn của chế độ giới hạn bộ nhớ => 413 (xem handler trong main.py)."""
+
+    def __init__(self, part: str, size: int, limit: int):
+        # args giữ đủ tham số => pickle được khi ném từ process pool
+        super().__init__(part, size, limit)
+        self.part = part
+        self.size = size
+        self.limit = limit
+
+    def __str__(self):
+        return f"{self.part} is too large ({self.size} bytes, limit {self.limit} bytes)"
+
+
+class DocxLimits:
+    """
+    Giới hạn kích thước cho chế độ giới hạn bộ nhớ (bounded=True).
+    Kích thước giải nén lấy từ central directory của zip (ZipInfo.file_size): zipfile
+    không bao giờ giải nén quá file_size đã khai báo, nên kiểm tra trước khi đọc là đủ,
+    không cần giải nén thử.
+    """
+
+    def __init__(self, max_upload_bytes: int, max_part_bytes: int, max_media_bytes: int,
+                 max_compression_ratio: float):
+        self.max_upload_bytes = max_upload_bytes
+        self.max_part_bytes = max_part_bytes
+        self.max_media_bytes = max_media_bytes
+        self.max_compression_ratio = max_compression_ratio
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_upload_bytes=settings.DOCX_MAX_UPLOAD_BYTES,
+            max_part_bytes=settings.DOCX_MAX_PART_BYTES,
+            max_media_bytes=settings.DOCX_MAX_MEDIA_BYTES,
+            max_compression_ratio=settings.DOCX_MAX_COMPRESSION_RATIO,
+        )
+
+    def check_upload(self, size: int):
+        if size > self.max_upload_bytes:
+            raise DocumentTooLarge("upload", size, self.max_upload_bytes)
+
+    def check_part(self, package: zipfile.ZipFile, name: str):
+        """Part XML sẽ được đọc: kích thước giải nén và tỉ lệ nén (zip bomb) trong giới hạn."""
+        try:
+            info = package.getinfo(name)
+        except KeyError:
+            return
+        if info.file_size > self.max_part_bytes:
+            raise DocumentTooLarge(name, info.file_size, self.max_part_bytes)
+        # Part nhỏ nén rất tốt là bình thường => chỉ xét tỉ lệ với part từ 1 MB
+        if (info.file_size > 1024 * 1024
+                and info.file_size > self.max_compression_ratio * max(info.compress_size, 1)):
+            raise DocumentTooLarge(f"{name} (compression ratio)", info.file_size,
+                                   int(self.max_compression_ratio * info.compress_size))
+
+    def check_media(self, package: zipfile.ZipFile, names):
+        """Tổng kích thước các ảnh thực sự được tham chiếu (mỗi file tính một lần)."""
+        total = 0
+        for name in set(names):
+            try:
+                total += package.getinfo(name).file_size
+            except KeyError:
+                continue
+            if total > self.max_media_bytes:
+                raise DocumentTooLarge("media", total, self.max_media_bytes)
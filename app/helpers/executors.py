@@ -0,0 +1,129 @@
+# helpers/executors.py
+
+import asyncio
+import logging
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.config import settings
+from app.helpers.server_timing import current_timings, call_with_timings
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturated(Exception):
+    """Hàng đợi của executor đã đầy => trả về 503 cho client (xem handler trong main.py)."""
+
+    def __init__(self, name: str, max_pending: int):
+        super().__init__(f"{name} executor is saturated ({max_pending} pending jobs)")
+        self.name = name
+        self.max_pending = max_pending
+
+
+class BoundedExecutor:
+    """
+    Bọc một concurrent.futures.Executor để gọi từ endpoint async mà không chặn event loop.
+    Giới hạn số job đang chạy + đang chờ (max_pending); vượt quá thì từ chối ngay
+    bằng ExecutorSaturated thay vì xếp hàng vô hạn.
+    """
+
+    def __init__(self, name: str, factory, max_pending: int):
+        self.name = name
+        self.max_pending = max_pending
+        self._factory = factory
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0  # Job chạy xong không lỗi
+        self.failed = 0  # Job ném exception hoặc bị huỷ
+        self.rejected = 0
+
+    @property
+    def executor(self):
+        # Tạo executor khi có job đầu tiên (tránh sinh process khi chỉ import module)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._factory()
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorSaturated(self.name, self.max_pending)
+            self.pending += 1
+        succeeded = False
+        try:
+            loop = asyncio.get_running_loop()
+            timings = current_timings()
+            if timings is None:
+                result = await loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+            else:
+                # Request đang đo Server-Timing => lấy lại thời gian các giai đoạn chạy trong executor
+                result, stages = await loop.run_in_executor(
+                    self.executor, partial(call_with_timings, fn, *args, **kwargs)
+                )
+                timings.merge(stages)
+            succeeded = True
+            return result
+        finally:
+            with self._lock:
+                self.pending -= 1
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _make_cpu_executor():
+    if settings.EXECUTOR_CPU_MODE == "thread":
+        return ThreadPoolExecutor(max_workers=settings.EXECUTOR_CPU_WORKERS, thread_name_prefix="cpu")
+    # spawn: tiến trình con không thừa hưởng thread/lock của event loop như fork
+    return ProcessPoolExecutor(
+        max_workers=settings.EXECUTOR_CPU_WORKERS,
+        mp_context=multiprocessing.get_context(settings.EXECUTOR_CPU_START_METHOD),
+    )
+
+
+def _make_io_executor():
+    return ThreadPoolExecutor(max_workers=settings.EXECUTOR_IO_WORKERS, thread_name_prefix="io")
+
+
+# Việc nặng CPU (DOCX -> HTML...): process pool, hàm và tham số phải pickle được
+cpu_executor = BoundedExecutor("cpu", _make_cpu_executor, settings.EXECUTOR_CPU_MAX_PENDING)
+# Việc chặn I/O (LibreOffice, gọi LLM, model giữ state trong process): thread pool
+io_executor = BoundedExecutor("io", _make_io_executor, settings.EXECUTOR_IO_MAX_PENDING)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    return await cpu_executor.run(fn, *args, **kwargs)
+
+
+async def run_io(fn, *args, **kwargs):
+    return await io_executor.run(fn, *args, **kwargs)
+
+
+def executor_stats() -> dict:
+    return {"cpu": cpu_executor.stats(), "io": io_executor.stats()}
+
+
+def shutdown_executors():
+    cpu_executor.shutdown()
+    io_executor.shutdown()
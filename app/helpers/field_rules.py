@@ -0,0 +1,380 @@
+# helpers/field_rules.py
+
+import re
+import logging
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import PreformattedString
+
+from app.helpers.html_chunk_splitter import tag_shell
+
+logger = logging.getLogger(__name__)
+
+# Phần tử chứa một "dòng" nội dung: nhãn của placeholder chỉ tìm trong phần tử này
+BLOCK_TAGS = frozenset(("p", "li", "td", "th", "div", "caption", "h1", "h2", "h3", "h4", "h5", "h6", "body"))
+
+CHECKBOX_GLYPHS = "☐☑☒□■▢"
+RADIO_GLYPHS = "○◯●◉"
+# Một lựa chọn: ký hiệu ô chọn + chữ đến ký hiệu tiếp theo
+_OPTION_PATTERN = re.compile(rf'([{CHECKBOX_GLYPHS}{RADIO_GLYPHS}])\s*([^{CHECKBOX_GLYPHS}{RADIO_GLYPHS}:;,/]+)')
+
+# Đầu nhãn kiểu "1.", "a)", "-", "+", "•"
+_LIST_MARKER_PATTERN = re.compile(r'^(?:[-+•*]|\(?\d+(?:\.\d+)*[.)]|\(?[a-zđ][.)])\s*', re.IGNORECASE)
+_FILLER_PATTERN = re.compile(r'[\s.…_]+')
+# Dấu chấm/gạch chân dẫn (dot leader) trong nhãn: "Họ và tên ......", "Ngày sinh ___"
+_LEADER_PATTERN = re.compile(r'\.{2,}|[…_]+')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_LETTER_PATTERN = re.compile(r'[^\W\d_]')
+
+MAX_LABEL_LENGTH = 100
+
+
+def _clean(text):
+    return _WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def _clean_label(text):
+    """Nhãn dùng làm tên trường: bỏ dot leader và dấu chấm/phẩy thừa ở hai đầu."""
+    return _clean(_LEADER_PATTERN.sub(' ', text)).strip(' ,.')
+
+
+def _is_placeholder(node):
+    return isinstance(node, Tag) and node.name == "span" and node.get("id") is not None
+
+
+def _is_date_label(label):
+    lowered = label.lower()
+    return lowered.startswith("ngày") or lowered.endswith("ngày") or "ngày tháng năm" in lowered.replace(',', '')
+
+
+def _field(field_id, label, field_type="text-input", options=None):
+    field = {"id": field_id, "value": "", "label": label, "type": field_type}
+    if options:
+        field["options"] = options
+    return field
+
+
+class FieldRuleExtractor:
+    """
+    Trích xuất trường dữ liệu (cùng định dạng JSON với kết quả Gemini của HtmlToJsonService)
+    bằng luật cố định cho các mẫu câu hay gặp trong biểu mẫu tiếng Việt, không gọi API:
+    - "..., ngày ... tháng ... năm ..." => "Địa chỉ" (text-input), "Ngày", "Tháng", "Năm" (date-picker)
+    - "Nhãn: ..." trên cùng dòng => nhãn là chữ trước dấu hai chấm ("Họ và tên: ...", "Địa chỉ: ...")
+    - Lựa chọn có ký hiệu ô chọn (☐ Nam ☐ Nữ) cạnh placeholder => check-box / radio-box có options
+    - Ô bảng chỉ chứa placeholder => nhãn từ hàng tiêu đề (và ô đầu hàng), gom thành trường "table"
+    Placeholder không khớp luật nào (không chắc chắn) nằm trong unresolved, dùng unresolved_html()
+    để lấy phần HTML tối thiểu chứa chúng gửi cho LLM.
+    """
+
+    def __init__(self, html: str):
+        self.soup = BeautifulSoup(html, "html.parser")
+        # Chỉ xét placeholder "lá": span có id lồng nhau (kết quả html_ai_processing) để LLM xử lý
+        spans = self.soup.find_all("span", id=True)
+        self.placeholders = [span for span in spans if span.find("span", id=True) is None]
+        self.nested = [span for span in spans if span.find("span", id=True) is not None]
+        self.position = {span["id"]: index for index, span in enumerate(spans)}
+        self.unresolved = list(self.nested)
+        self.resolved_ids = set()
+
+    def extract(self):
+        """Danh sách trường trích xuất được (theo thứ tự tài liệu); placeholder còn lại vào self.unresolved."""
+        fields = {}  # id placeholder đầu tiên -> field
+        tables = {}  # id(table) -> (table, [(span, cell)])
+
+        lines = {}
+        for span in self.placeholders:
+            block = span.find_parent(BLOCK_TAGS)
+            if block is not None and id(block) not in lines:
+                lines.update(self._split_lines(block))
+
+        for span in self.placeholders:
+            line = lines.get(id(span))
+            cell = span.find_parent(("td", "th"))
+            if line is None:
+                self.unresolved.append(span)
+                continue
+            before, after, date_label = line
+
+            if date_label:
+                field = _field(span["id"], *date_label)
+            else:
+                field = self._label_field(span, before, after)
+            if field is not None:
+                fields[span["id"]] = field
+            elif cell is not None and self._only_placeholder(cell, span):
+                table = cell.find_parent("table")
+                tables.setdefault(id(table), (table, []))[1].append((span, cell))
+            else:
+                self.unresolved.append(span)
+
+        for table, cells in tables.values():
+            field = self._table_field(table, cells)
+            if field is None:
+                self.unresolved.extend(span for span, _ in cells)
+            else:
+                fields[cells[0][0]["id"]] = field
+
+        self.unresolved.sort(key=lambda span: self.position[span["id"]])
+        self.resolved_ids = set(self.position) - {span["id"] for span in self.unresolved}
+        return [fields[key] for key in sorted(fields, key=self.position.__getitem__)]
+
+    # ------------------------------------------------------------------
+    # Chia dòng
+    # ------------------------------------------------------------------
+    def _split_lines(self, block):
+        """
+        {id(span): (chữ trước, chữ sau, (nhãn, loại) ngày/tháng/năm)} cho các placeholder của block;
+        chữ trước/sau tính tới placeholder kề bên hoặc đầu/cuối dòng (<br>).
+        """
+        lines = [[]]
+        for node in self._block_items(block):
+            if isinstance(node, str) and node == "\n":
+                lines.append([])
+            else:
+                lines[-1].append(node)
+
+        result = {}
+        for items in lines:
+            # texts[i]: chữ trước placeholder i, texts[-1]: chữ sau placeholder cuối
+            placeholders, texts, current = [], [], []
+            for item in items:
+                if _is_placeholder(item):
+                    placeholders.append(item)
+                    texts.append(_clean(''.join(current)))
+                    current = []
+                else:
+                    current.append(item)
+            texts.append(_clean(''.join(current)))
+
+            date_labels = self._date_labels(texts)
+            for index, span in enumerate(placeholders):
+                result[id(span)] = (texts[index], texts[index + 1], date_labels.get(index))
+        return result
+
+    @staticmethod
+    def _date_labels(texts):
+        """
+        {vị trí placeholder: (nhãn, loại trường)} cho mẫu "ngày ... tháng ... năm ..." trong một dòng
+        (date-picker), kèm placeholder địa danh "..., ngày" ngay trước (text-input).
+        """
+        words = [text.lower().rstrip(':').strip() for text in texts]
+        labels = {}
+        for k in range(len(words) - 3):
+            if (re.search(r'(?<!\w)ngày$', words[k])
+                    and words[k + 1] == "tháng" and words[k + 2] == "năm"):
+                labels.update({
+                    k: ("Ngày", "date-picker"), k + 1: ("Tháng", "date-picker"), k + 2: ("Năm", "date-picker"),
+                })
+                if k >= 1 and words[k] in (", ngày", ",ngày"):
+                    labels[k - 1] = ("Địa chỉ", "text-input")
+        return labels
+
+    def _block_items(self, node):
+        """Text, '\\n' (<br>) và placeholder thuộc trực tiếp block (không tính block con)."""
+        for child in node.children:
+            if isinstance(child, PreformattedString):  # Comment, Doctype...
+                continue
+            if isinstance(child, NavigableString):
+                yield str(child)
+            elif not isinstance(child, Tag):
+                continue
+            elif _is_placeholder(child):
+                # Placeholder lồng nhau được coi là một placeholder duy nhất
+                yield child if child.find("span", id=True) is None else child.find_all("span", id=True)[-1]
+            elif child.name == "br":
+                yield "\n"
+            elif child.name in BLOCK_TAGS or child.name in ("table", "ul", "ol"):
+                yield "\n"
+            else:
+                yield from self._block_items(child)
+
+    # ------------------------------------------------------------------
+    # Luật
+    # ------------------------------------------------------------------
+    def _label_field(self, span, before, after):
+        """"Nhãn: ..." và lựa chọn có ký hiệu ô chọn."""
+        if ':' not in before:
+            return None
+        label, _, tail = before.rpartition(':')
+        # Giữa dấu hai chấm và placeholder chỉ được có các lựa chọn (☐ ...), nếu không thì
+        # chữ trước dấu hai chấm chưa chắc là nhãn của placeholder này
+        options, glyphs = self._options(tail)
+        if tail and not options:
+            return None
+        if not options and ':' not in after:
+            # "Giới tính: ... ☐ Nam ☐ Nữ" (lựa chọn của nhãn khác thì đã có dấu hai chấm riêng)
+            options, glyphs = self._options(after)
+
+        # Nhãn là phần sau dấu câu kết thúc câu trước ("... . Địa chỉ:"), dot leader không phải dấu câu
+        label = re.split(r'[;!?]|\.\s', _LEADER_PATTERN.sub(' ', label))[-1]
+        label = _clean_label(_LIST_MARKER_PATTERN.sub('', _clean(label)))
+        if not label or len(label) > MAX_LABEL_LENGTH or not _LETTER_PATTERN.search(label):
+            return None
+        if any(glyph in label for glyph in CHECKBOX_GLYPHS + RADIO_GLYPHS):
+            return None
+
+        if options:
+            field_type = "radio-box" if glyphs <= set(RADIO_GLYPHS) else "check-box"
+            return _field(span["id"], label, field_type, options)
+        if _is_date_label(label):
+            return _field(span["id"], label, "date-picker")
+        return _field(span["id"], label)
+
+    @staticmethod
+    def _options(text):
+        """Các lựa chọn dạng "☐ Nam ☐ Nữ" trong text (cần ít nhất 2) và tập ký hiệu đã dùng."""
+        matches = _OPTION_PATTERN.findall(text)
+        options = [_clean(option) for _, option in matches if _clean(option)]
+        if len(options) < 2:
+            return [], set()
+        return options, {glyph for glyph, _ in matches}
+
+    @staticmethod
+    def _only_placeholder(cell, span):
+        """Ô bảng chỉ có một placeholder, ngoài ra không có chữ."""
+        if len(cell.find_all("span", id=True)) != 1:
+            return False
+        text = ''.join(
+            str(node) for node in cell.find_all(string=True) if span not in node.parents
+        )
+        return not _FILLER_PATTERN.sub('', text)
+
+    def _table_field(self, table, cells):
+        """Gom các ô chỉ chứa placeholder của một bảng thành trường "table", nhãn từ hàng tiêu đề."""
+        rows = [row for row in table.find_all("tr") if row.find_parent("table") is table]
+        if not rows:
+            return None
+        header = self._grid(rows[0])
+        fields = []
+        for span, cell in cells:
+            row = cell.find_parent("tr")
+            if row is rows[0]:
+                return None
+            grid = self._grid(row)
+            column = next((col for col, item in grid.items() if item is cell), None)
+            header_cell = header.get(column)
+            header_text = _clean_label(header_cell.get_text()) if header_cell is not None else ''
+            if not header_text or header_cell.find("span", id=True) is not None:
+                return None
+            label = header_text
+            first = grid.get(0)
+            if first is not None and first is not cell and first.find("span", id=True) is None:
+                row_text = _clean_label(first.get_text())
+                # Ô đầu hàng chỉ là số thứ tự thì không dùng làm nhãn
+                if _LETTER_PATTERN.search(row_text) and row_text != header_text:
+                    label = f"{row_text} - {header_text}"
+            fields.append(_field(span["id"], label, "date-picker" if _is_date_label(header_text) else "text-input"))
+
+        return {
+            "id": f"table-{cells[0][0]['id']}",
+            "value": "",
+            "label": self._table_label(table),
+            "type": "table",
+            "fields": fields,
+        }
+
+    @staticmethod
+    def _grid(row):
+        """{chỉ số cột: ô} của một hàng (tính colspan)."""
+        grid, column = {}, 0
+        for cell in row.find_all(("td", "th"), recursive=False):
+            try:
+                span = max(int(cell.get("colspan", 1)), 1)
+            except ValueError:
+                span = 1
+            for offset in range(span):
+                grid[column + offset] = cell
+            column += span
+        return grid
+
+    @staticmethod
+    def _table_label(table):
+        caption = table.find("caption")
+        if caption is not None and _clean_label(caption.get_text()):
+            return _clean_label(caption.get_text())
+        previous = table.find_previous_sibling(lambda tag: tag.name in BLOCK_TAGS and _clean_label(tag.get_text()))
+        if previous is not None:
+            text = _clean_label(previous.get_text()).rstrip(':')
+            if len(text) <= MAX_LABEL_LENGTH:
+                return text
+        return "Bảng"
+
+    # ------------------------------------------------------------------
+    # HTML cho LLM
+    # ------------------------------------------------------------------
+    def unresolved_html(self):
+        """
+        HTML tối thiểu cho các placeholder chưa xác định được, theo thứ tự tài liệu:
+        - ngoài bảng: block chứa placeholder cùng block liền trước làm ngữ cảnh
+        - trong bảng: hàng chứa placeholder cùng hàng đầu tiên (tiêu đề), bọc trong thẻ table gốc
+        """
+        order = {id(node): index for index, node in enumerate(self.soup.descendants)}
+        selected = []  # (vị trí, phần tử)
+        tables = {}  # id(table) -> (table, [hàng])
+
+        def select(node):
+            if node is not None and all(node is not other for _, other in selected):
+                selected.append((order[id(node)], node))
+
+        for span in self.unresolved:
+            row = span.find_parent("tr")
+            if row is not None:
+                table, rows = tables.setdefault(id(row.find_parent("table")), (row.find_parent("table"), []))
+                if all(row is not other for other in rows):
+                    rows.append(row)
+                continue
+            block = span.find_parent(BLOCK_TAGS)
+            if block is None or block.name == "body":
+                block = span
+            select(self._context(block))
+            select(block)
+
+        parts = []
+        for table, rows in tables.values():
+            first = table.find("tr")
+            if first is not None and all(first is not row for row in rows):
+                rows.append(first)
+            rows.sort(key=lambda row: order[id(row)])
+            opening, closing = tag_shell(table)
+            select(self._context(table))
+            parts.append((order[id(table)], opening + ''.join(str(row) for row in rows) + closing))
+
+        # Bỏ phần tử nằm trong phần tử khác đã chọn
+        nodes = [node for _, node in selected]
+        parts.extend(
+            (position, str(node)) for position, node in selected
+            if not any(parent is other for parent in node.parents for other in nodes)
+        )
+        parts.sort(key=lambda part: part[0])
+        return "<html><body>{}</body></html>".format(''.join(html for _, html in parts))
+
+    @staticmethod
+    def _context(element):
+        """Block liền trước (có chữ) của element, làm ngữ cảnh cho LLM."""
+        previous = element.find_previous_sibling(True)
+        if previous is not None and previous.name in BLOCK_TAGS and _clean(previous.get_text()):
+            return previous
+        return None
+
+    def drop_resolved(self, fields):
+        """Bỏ khỏi kết quả LLM các trường đã được luật xác định (LLM thấy chúng trong phần ngữ cảnh)."""
+        kept = []
+        for field in fields:
+            if not isinstance(field, dict):
+                continue
+            if field.get("id") in self.resolved_ids:
+                continue
+            if isinstance(field.get("fields"), list):
+                field["fields"] = [
+                    sub for sub in field["fields"] if not (isinstance(sub, dict) and sub.get("id") in self.resolved_ids)
+                ]
+                if not field["fields"]:
+                    continue
+            kept.append(field)
+        return kept
+
+    def sort_key(self, field):
+        """Vị trí trong tài liệu của một trường (theo id của nó hoặc trường con đầu tiên)."""
+        ids = [field.get("id")] + [
+            sub.get("id") for sub in field.get("fields") or [] if isinstance(sub, dict)
+        ]
+        return min((self.position[i] for i in ids if i in self.position), default=len(self.position))
@@ -1,37 +1,69 @@
+import math
+import re
 from bs4 import BeautifulSoup, NavigableString, Tag
-from typing import List
+from typing import Callable, List
+
+# Phần tử con của <table> được lặp lại ở mọi phần khi chia nhỏ bảng (giữ độ rộng cột, tiêu đề)
+TABLE_CONTEXT_TAGS = ("caption", "colgroup", "col", "thead")
+
+# Điểm cắt an toàn trong một đoạn văn bản dài: ngay sau khoảng trắng
+_TEXT_BREAK_PATTERN = re.compile(r'\S+\s*|\s+')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Ước lượng số token của một chuỗi (không cần tokenizer của model):
+    ký tự ASCII (thẻ, thuộc tính, tiếng Anh) ~4 ký tự/token, ký tự ngoài ASCII
+    (chữ tiếng Việt có dấu...) tốn thêm ~0.5 token/ký tự.
+    """
+    non_ascii = len(text) - len(text.encode('ascii', 'ignore'))
+    return math.ceil(len(text) / 4 + non_ascii / 2)
+
 
 def wrap_in_tag(content: str, tag: str, attrs: dict) -> str:
     """Tạo chuỗi HTML với tag và các thuộc tính đã cho."""
     if attrs:
-        attr_str = " ".join(f'{key}="{value}"' for key, value in attrs.items())
+        # class (và các thuộc tính nhiều giá trị khác) được bs4 lưu dạng list
+        attr_str = " ".join(
+            f'{key}="{" ".join(value) if isinstance(value, list) else value}"'
+            for key, value in attrs.items()
+        )
         return f"<{tag} {attr_str}>{content}</{tag}>"
     else:
         return f"<{tag}>{content}</{tag}>"
 
+
+def tag_shell(tag_element: Tag):
+    """(thẻ mở, thẻ đóng) của một Tag, thuộc tính được escape giống str(tag)."""
+    shell = BeautifulSoup("", "html.parser").new_tag(tag_element.name, attrs=tag_element.attrs)
+    closing = f"</{tag_element.name}>"
+    return str(shell)[:-len(closing)], closing
+
+
 class HtmlChunkSplitter:
-    def __init__(self, max_length: int = 3000):
+    """
+    Chia HTML thành các chunk không vượt quá max_length, chỉ cắt ở ranh giới phần tử
+    (hoặc giữa các từ với văn bản quá dài) nên mọi chunk đều là HTML hợp lệ.
+    measure: hàm đo kích thước một chuỗi HTML, mặc định len (ký tự); dùng estimate_tokens
+    để max_length tính theo token.
+    """
+
+    def __init__(self, max_length: int = 3000, measure: Callable[[str], int] = len):
         self.max_length = max_length
+        self.measure = measure
 
-    def split_sibling_elements(self, siblings, max_length: int = None, parent_tag: str = "div") -> List[str]:
+    def pack_siblings(self, siblings, max_length: int = None) -> List[str]:
         """
-        Chia danh sách các phần tử con (sibling) thành các nhóm sao cho tổng độ dài của mỗi nhóm
-        không vượt quá max_length. Mỗi nhóm sẽ được bao bọc trong thẻ (parent_tag) để giữ lại context.
-
-        Nếu một sibling (với kiểu Tag) có chuỗi HTML vượt quá giới hạn, ta sẽ đệ quy chia nhỏ theo
-        các thẻ con của nó.
-
-        Args:
-            siblings: Danh sách các phần tử (Tag hoặc NavigableString)
-            max_length (int, optional): Giới hạn độ dài; nếu không truyền, dùng self.max_length.
-            parent_tag (str, optional): Thẻ dùng để bao bọc mỗi nhóm. Mặc định là "div".
-        Returns:
-            List[str]: Danh sách các chuỗi HTML.
+        Gom các phần tử con (sibling) liên tiếp thành các nhóm (chuỗi HTML, không bọc thẻ)
+        sao cho mỗi nhóm không vượt quá max_length.
+        Sibling quá lớn được chia nhỏ đệ quy theo các thẻ con của nó (xem split_tag_by_children),
+        phần cuối cùng được gom tiếp với các sibling sau để chunk đầy nhất có thể.
+        Chỉ phần tử không có con mà tự nó đã vượt giới hạn (vd: ảnh base64) mới tạo chunk lớn hơn max_length.
         """
         if max_length is None:
             max_length = self.max_length
 
-        chunks = []
+        groups = []
         current_group = []
         current_length = 0
 
@@ -40,89 +72,115 @@ class HtmlChunkSplitter:
             if isinstance(sibling, NavigableString) and not sibling.strip():
                 continue
 
-            # Xác định chuỗi của sibling
-            if isinstance(sibling, NavigableString):
-                sibling_str = str(sibling)
-                # Nếu chuỗi quá dài, chia theo ký tự (không thể chia theo tag)
-                if len(sibling_str) > max_length:
-                    # Nếu có dữ liệu đang tích lũy, hoàn thiện nhóm hiện tại
-                    if current_group:
-                        group_html = "".join(current_group)
-                        group_html = f"<{parent_tag}>{group_html}</{parent_tag}>"
-                        chunks.append(group_html)
-                        current_group = []
-                        current_length = 0
-                    # Chia nhỏ văn bản theo ký tự
-                    for i in range(0, len(sibling_str), max_length):
-                        segment = sibling_str[i:i+max_length]
-                        chunk = f"<{parent_tag}>{segment}</{parent_tag}>"
-                        chunks.append(chunk)
-                    continue
-            elif isinstance(sibling, Tag):
-                sibling_str = str(sibling)
-                # Nếu chuỗi của tag vượt quá giới hạn, hãy thử chia theo nội dung con
-                if len(sibling_str) > max_length:
-                    if sibling.contents:
-                        # Sử dụng hàm đệ quy để chia nhỏ tag theo con
-                        split_chunks = self.split_tag_by_children(sibling, max_length)
-                        chunks.extend(split_chunks)
-                        continue
-                    else:
-                        # Nếu tag không có con (hoặc chỉ chứa văn bản), fallback: chia theo ký tự
-                        for i in range(0, len(sibling_str), max_length):
-                            segment = sibling_str[i:i+max_length]
-                            chunks.append(segment)
-                        continue
-            else:
-                # Nếu không thuộc hai loại trên, chuyển về chuỗi
-                sibling_str = str(sibling)
+            # str() của NavigableString là text chưa escape, output_ready() giữ đúng dạng HTML
+            sibling_str = sibling.output_ready() if isinstance(sibling, NavigableString) else str(sibling)
+            sibling_length = self.measure(sibling_str)
+
+            if sibling_length > max_length:
+                if isinstance(sibling, Tag):
+                    pieces = self.split_tag_by_children(sibling, max_length)
+                else:
+                    pieces = self.split_text(sibling_str, max_length)
+                # Các phần đều đã trọn vẹn, phần đầu có thể ghép tiếp vào nhóm đang tích lũy
+                # nếu còn chỗ, phần cuối mở nhóm mới
+                for piece in pieces:
+                    piece_length = self.measure(piece)
+                    if current_group and current_length + piece_length > max_length:
+                        groups.append("".join(current_group))
+                        current_group, current_length = [], 0
+                    current_group.append(piece)
+                    current_length += piece_length
+                continue
 
             # Thêm sibling vào nhóm hiện tại nếu không vượt quá giới hạn
-            if current_length + len(sibling_str) > max_length and current_group:
-                group_html = "".join(current_group)
-                group_html = f"<{parent_tag}>{group_html}</{parent_tag}>"
-                chunks.append(group_html)
+            if current_group and current_length + sibling_length > max_length:
+                groups.append("".join(current_group))
                 current_group = [sibling_str]
-                current_length = len(sibling_str)
+                current_length = sibling_length
             else:
                 current_group.append(sibling_str)
-                current_length += len(sibling_str)
+                current_length += sibling_length
 
         # Nếu còn dữ liệu trong nhóm cuối cùng, thêm vào danh sách
         if current_group:
-            group_html = "".join(current_group)
-            group_html = f"<{parent_tag}>{group_html}</{parent_tag}>"
-            chunks.append(group_html)
+            groups.append("".join(current_group))
 
-        return chunks
+        return groups
+
+    def split_sibling_elements(self, siblings, max_length: int = None, parent_tag: str = "div") -> List[str]:
+        """
+        Chia danh sách các phần tử con (sibling) thành các nhóm sao cho kích thước mỗi nhóm
+        không vượt quá max_length. Mỗi nhóm sẽ được bao bọc trong thẻ (parent_tag) để giữ lại context.
+
+        Args:
+            siblings: Danh sách các phần tử (Tag hoặc NavigableString)
+            max_length (int, optional): Giới hạn kích thước; nếu không truyền, dùng self.max_length.
+            parent_tag (str, optional): Thẻ dùng để bao bọc mỗi nhóm. Mặc định là "div".
+        Returns:
+            List[str]: Danh sách các chuỗi HTML.
+        """
+        return [
+            f"<{parent_tag}>{group}</{parent_tag}>"
+            for group in self.pack_siblings(siblings, max_length)
+        ]
 
     def split_tag_by_children(self, tag_element: Tag, max_length: int) -> List[str]:
         """
         Nếu một Tag có chuỗi HTML vượt quá giới hạn, ta sẽ lấy nội dung con của nó và chia nhỏ theo các con.
         Sau đó, bọc lại mỗi chunk bằng tag cha có các thuộc tính ban đầu.
+        Với <table>, các phần tử caption/colgroup/col/thead được lặp lại ở đầu mỗi phần;
+        <tbody>/<tr> quá lớn được chia tiếp theo cùng cách.
 
         Args:
             tag_element (Tag): Phần tử HTML cần chia nhỏ.
-            max_length (int): Giới hạn độ dài tối đa.
+            max_length (int): Giới hạn kích thước tối đa.
         Returns:
             List[str]: Danh sách các chuỗi HTML được chia nhỏ, mỗi chuỗi được bao bọc trong tag ban đầu.
         """
-        # Lấy danh sách con
+        if not tag_element.contents:
+            # Không có con để chia (vd: <img> base64): giữ nguyên, không cắt giữa thẻ
+            return [str(tag_element)]
+
+        opening, closing = tag_shell(tag_element)
         children = tag_element.contents
-        # Đệ quy chia nhỏ các con
-        child_chunks = self.split_sibling_elements(children, max_length, parent_tag=tag_element.name)
-        # Mỗi chunk hiện tại được tạo ra bởi split_sibling_elements có thể không giữ lại các thuộc tính của tag ban đầu.
-        # Ta tái tạo lại tag với thuộc tính ban đầu.
-        wrapped_chunks = []
-        attrs = tag_element.attrs
-        for chunk in child_chunks:
-            # Lấy nội dung bên trong của chunk (loại bỏ tag bao bọc nếu cần)
-            soup = BeautifulSoup(chunk, "html.parser")
-            found = soup.find(tag_element.name)
-            inner = found.decode_contents() if found else chunk
-            wrapped = wrap_in_tag(inner, tag_element.name, attrs)
-            wrapped_chunks.append(wrapped)
-        return wrapped_chunks
+        context = ""
+        if tag_element.name == "table":
+            context = "".join(
+                str(child) for child in children
+                if isinstance(child, Tag) and child.name in TABLE_CONTEXT_TAGS
+            )
+            children = [
+                child for child in children
+                if not (isinstance(child, Tag) and child.name in TABLE_CONTEXT_TAGS)
+            ]
+
+        # Phần dành cho nội dung con sau khi trừ thẻ bao và context lặp lại
+        budget = max_length - self.measure(opening + context + closing)
+        if budget <= 0:
+            budget = max_length
+            context = ""
+
+        return [
+            f"{opening}{context}{group}{closing}"
+            for group in self.pack_siblings(children, budget)
+        ]
+
+    def split_text(self, text: str, max_length: int) -> List[str]:
+        """Chia đoạn văn bản quá dài ở ranh giới từ (không có thẻ nào bị cắt)."""
+        pieces = []
+        current = []
+        current_length = 0
+        for match in _TEXT_BREAK_PATTERN.finditer(text):
+            word = match.group(0)
+            word_length = self.measure(word)
+            if current and current_length + word_length > max_length:
+                pieces.append("".join(current))
+                current, current_length = [], 0
+            current.append(word)
+            current_length += word_length
+        if current:
+            pieces.append("".join(current))
+        return pieces
 
     def merge_chunks(self, chunks: List[str], max_length: int, parent_tag: str = "div") -> List[str]:
         """
@@ -133,7 +191,7 @@ class HtmlChunkSplitter:
         
         Args:
             chunks (List[str]): Danh sách các chunk HTML ban đầu (mỗi chunk đã được bọc trong parent_tag).
-            max_length (int): Giới hạn độ dài tối đa cho nội dung (theo số ký tự hoặc token tùy trường hợp).
+            max_length (int): Giới hạn độ dài tối đa cho nội dung (theo self.measure: số ký tự hoặc token).
             parent_tag (str): Tên tag dùng để bao bọc các chunk, mặc định là "div".
         
         Returns:
@@ -153,7 +211,7 @@ class HtmlChunkSplitter:
                 inner_html = chunk  # Fallback nếu không tìm thấy tag
 
             # Nếu cộng thêm nội dung mới không vượt quá giới hạn, tiến hành ghép
-            if len(current_content) + len(inner_html) <= max_length:
+            if self.measure(current_content) + self.measure(inner_html) <= max_length:
                 current_content += inner_html
             else:
                 # Đóng gói nội dung đang tích lũy lại thành 1 chunk mới và lưu vào danh sách
@@ -162,7 +220,7 @@ class HtmlChunkSplitter:
                     merged_chunks.append(merged_chunk)
                 # Nếu nội dung mới (inner_html) vượt quá giới hạn riêng lẻ,
                 # ta giữ nguyên chunk đó
-                if len(inner_html) > max_length:
+                if self.measure(inner_html) > max_length:
                     merged_chunks.append(f"<{parent_tag}>{inner_html}</{parent_tag}>")
                     current_content = ""
                 else:
@@ -0,0 +1,245 @@
+# helpers/html_minifier.py
+
+import re
+import logging
+from difflib import SequenceMatcher
+from html import escape
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import PreformattedString
+
+logger = logging.getLogger(__name__)
+
+# Bỏ hẳn (cả nội dung): CSS, metadata, độ rộng cột, ảnh
+DROP_TAGS = frozenset(("head", "style", "script", "meta", "link", "title", "colgroup", "col", "img"))
+# Chỉ mang định dạng: bỏ thẻ, giữ nội dung (span có id là placeholder nên được giữ)
+UNWRAP_TAGS = frozenset((
+    "font", "b", "strong", "i", "em", "u", "s", "strike", "sub", "sup", "small", "big", "a", "tbody",
+))
+# Thuộc tính có nghĩa với việc nhận diện trường dữ liệu, còn lại (style, class, width...) bị bỏ
+KEEP_ATTRS = frozenset(("id", "colspan", "rowspan", "type", "name", "value", "checked", "selected"))
+VOID_TAGS = frozenset(("br", "hr", "input"))
+
+# Dấu chấm/gạch chân dùng làm chỗ trống: được coi là "không có chữ" khi so khớp
+_FILLER_PATTERN = re.compile(r'[\s.…_]+')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_BETWEEN_TAGS_PATTERN = re.compile(r'>\s+<')
+_SPACES_PATTERN = re.compile(r' {2,}')
+
+# Đánh dấu vị trí của một span mới do LLM chèn trong text
+_SENTINEL = '\x00'
+
+
+def _is_placeholder(node):
+    return node.name == "span" and node.get("id") is not None
+
+
+class _Walker:
+    """
+    Duyệt một cây HTML theo cùng quy tắc rút gọn, ghi lại các "container": phần tử được giữ
+    lại có text trực tiếp (sau khi bỏ các thẻ định dạng) như p, td, li..., theo thứ tự tài liệu.
+    known_ids: id placeholder đã có; span có id khác là span mới (chỉ dùng với HTML do LLM trả về).
+    """
+
+    def __init__(self, known_ids=None):
+        self.known_ids = known_ids
+        self.out = []
+        self.kept = []  # Phần tử được giữ (không phải placeholder), theo thứ tự tài liệu
+        self.items = {}  # id(phần tử) -> [NavigableString | Tag span mới] thuộc về phần tử đó
+        self._stack = []
+
+    def walk(self, node):
+        if isinstance(node, NavigableString):
+            if isinstance(node, PreformattedString):  # Comment, Doctype, CDATA...
+                return
+            text = _WHITESPACE_PATTERN.sub(' ', str(node))
+            if text.strip() and self._stack:
+                self.items.setdefault(id(self._stack[-1]), []).append(node)
+            if text:
+                self.out.append(escape(text, quote=False))
+            return
+        if isinstance(node, BeautifulSoup):
+            for child in node.children:
+                self.walk(child)
+            return
+        if not isinstance(node, Tag) or node.name in DROP_TAGS:
+            return
+
+        if self.known_ids is not None and _is_placeholder(node) and node["id"] not in self.known_ids:
+            # Span mới do LLM chèn: một vị trí duy nhất trong text của container
+            if self._stack:
+                self.items.setdefault(id(self._stack[-1]), []).append(node)
+            return
+
+        if node.name in UNWRAP_TAGS or (node.name == "span" and not _is_placeholder(node)):
+            for child in node.children:
+                self.walk(child)
+            return
+
+        attrs = ''.join(
+            f' {key}="{escape(" ".join(value) if isinstance(value, list) else str(value))}"'
+            for key, value in node.attrs.items() if key in KEEP_ATTRS
+        )
+        self.out.append(f'<{node.name}{attrs}>')
+        if node.name in VOID_TAGS:
+            return
+        placeholder = _is_placeholder(node)
+        if not placeholder:
+            self.kept.append(node)
+            self._stack.append(node)
+        for child in node.children:
+            self.walk(child)
+        if not placeholder:
+            self._stack.pop()
+        self.out.append(f'</{node.name}>')
+
+    def html(self):
+        # Text của các run liền nhau có thể cùng mang khoảng trắng => gộp lại lần nữa
+        return _BETWEEN_TAGS_PATTERN.sub('><', _SPACES_PATTERN.sub(' ', ''.join(self.out)))
+
+    def containers(self):
+        return [node for node in self.kept if id(node) in self.items]
+
+
+def _container_key(node, items):
+    """Khoá so khớp container giữa hai cây: tên thẻ + chữ (bỏ khoảng trắng, dấu chấm, placeholder)."""
+    text = ''.join(str(item) for item in items if isinstance(item, NavigableString))
+    return node.name, _FILLER_PATTERN.sub('', text)
+
+
+class HtmlMinifier:
+    """
+    Rút gọn HTML trước khi gửi cho LLM và ánh xạ kết quả ngược lại HTML đầy đủ.
+
+    html: chỉ còn cấu trúc (p, table, tr, td, li...), text, id của placeholder và các thuộc tính
+    có nghĩa (colspan, rowspan, input...); bỏ <head>/CSS, style/class, colgroup, ảnh, thẻ định dạng
+    (span không id, b, i...) và khoảng trắng thừa.
+
+    restore(processed_html): HTML do LLM trả về (dạng rút gọn, có thể chèn thêm
+    <span id="...">...</span>) => HTML gốc đầy đủ định dạng với các span mới được chèn
+    đúng vị trí. Container (p, td...) được ghép cặp theo thứ tự + nội dung chữ, vị trí
+    trong container tìm bằng so khớp chuỗi; phần khác mà LLM sửa (ngoài span mới) bị bỏ qua.
+    restore sửa trực tiếp cây HTML gốc nên chỉ gọi một lần cho mỗi HtmlMinifier.
+    Kết quả trích xuất theo id (convert_html_to_json) không cần restore: id giữ nguyên.
+    """
+
+    def __init__(self, html: str):
+        self.soup = BeautifulSoup(html, "html.parser")
+        walker = _Walker()
+        walker.walk(self.soup)
+        self.html = walker.html()
+        self._containers = walker.containers()
+        self._items = walker.items
+        self._known_ids = {node["id"] for node in self.soup.find_all("span", id=True)}
+
+    def restore(self, processed_html: str) -> str:
+        walker = _Walker(self._known_ids)
+        walker.walk(BeautifulSoup(processed_html, "html.parser"))
+        processed = walker.containers()
+
+        original_keys = [_container_key(node, self._items[id(node)]) for node in self._containers]
+        processed_keys = [_container_key(node, walker.items[id(node)]) for node in processed]
+
+        grafted = missed = 0
+        matcher = SequenceMatcher(None, original_keys, processed_keys, autojunk=False)
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == "equal" or (op == "replace" and i2 - i1 == j2 - j1):
+                pairs = zip(range(i1, i2), range(j1, j2))
+            else:
+                pairs = ()
+                missed += sum(
+                    1 for j in range(j1, j2) for item in walker.items[id(processed[j])] if isinstance(item, Tag)
+                )
+            for i, j in pairs:
+                if op == "replace" and original_keys[i][0] != processed_keys[j][0]:
+                    continue
+                grafted += self._graft(self._containers[i], walker.items[id(processed[j])])
+
+        if missed:
+            logger.warning(f"{missed} new placeholder(s) could not be mapped back onto the original HTML.")
+        logger.debug(f"Restored {grafted} new placeholder(s) onto the original HTML.")
+        return str(self.soup)
+
+    def _graft(self, container, processed_items):
+        """Chèn các span mới của một container (bản LLM) vào container gốc. Trả về số span đã chèn."""
+        spans = [item for item in processed_items if isinstance(item, Tag)]
+        if not spans:
+            return 0
+
+        nodes = list(self._items[id(container)])
+        original_text = ''.join(str(node) for node in nodes)
+        processed_text = ''.join(
+            _SENTINEL if isinstance(item, Tag) else str(item) for item in processed_items
+        )
+
+        # (vị trí, hết đoạn bị thay, span) trong text gốc
+        edits = []
+        k = 0
+        matcher = SequenceMatcher(None, original_text, processed_text, autojunk=False)
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            count = processed_text.count(_SENTINEL, j1, j2)
+            if not count:
+                continue
+            new_spans = spans[k:k + count]
+            k += count
+            if op == "replace" and _FILLER_PATTERN.fullmatch(original_text[i1:i2]):
+                # LLM thay dấu chấm gốc bằng span => span thay chỗ dấu chấm
+                edits.append((i1, i2, new_spans))
+            elif op == "replace":
+                edits.append((i2, i2, new_spans))
+            else:
+                edits.append((i1, i1, new_spans))
+
+        # Áp dụng từ cuối lên để vị trí của các edit trước không đổi
+        for start, end, new_spans in reversed(edits):
+            tags = [self._copy_span(span) for span in new_spans]
+            nodes = self._remove_text(nodes, start, end)
+            self._insert(container, nodes, start, tags)
+        return len(spans)
+
+    def _copy_span(self, span):
+        tag = self.soup.new_tag("span", attrs={"id": span["id"]})
+        tag.string = span.get_text() or "..."
+        return tag
+
+    @staticmethod
+    def _remove_text(nodes, start, end):
+        if start >= end:
+            return nodes
+        result, offset = [], 0
+        for node in nodes:
+            text = str(node)
+            a, b = max(start - offset, 0), min(end - offset, len(text))
+            offset += len(text)
+            if a < b:
+                replacement = NavigableString(text[:a] + text[b:])
+                node.replace_with(replacement)
+                node = replacement
+            result.append(node)
+        return result
+
+    @staticmethod
+    def _insert(container, nodes, position, tags):
+        offset = 0
+        for index, node in enumerate(nodes):
+            text = str(node)
+            if position < offset + len(text) or index == len(nodes) - 1:
+                local = min(max(position - offset, 0), len(text))
+                placeholder = node.find_parent("span", id=True)
+                if placeholder is not None and container in placeholder.parents:
+                    # Không lồng span mới vào placeholder có sẵn
+                    if local > 0:
+                        placeholder.insert_after(*tags)
+                    else:
+                        placeholder.insert_before(*tags)
+                    return
+                before, after = NavigableString(text[:local]), NavigableString(text[local:])
+                node.replace_with(before, *tags, after)
+                nodes[index:index + 1] = [before, after]
+                return
+            offset += len(text)
+        container.extend(tags)
+
+
+def minify_html(html: str) -> str:
+    """HTML rút gọn cho prompt (không cần ánh xạ ngược)."""
+    return HtmlMinifier(html).html
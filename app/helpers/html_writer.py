@@ -0,0 +1,191 @@
+# helpers/html_writer.py
+
+from html import escape
+from bs4 import BeautifulSoup
+
+# Các thẻ rỗng, ghi dạng <br/>
+VOID_TAGS = frozenset(('br', 'col', 'img', 'meta', 'hr', 'input', 'link'))
+
+
+def start_tag(tag, attrs=None, self_closing=False):
+    """Dựng chuỗi thẻ mở <tag a="b"> (hoặc <tag a="b"/>), giá trị thuộc tính được escape."""
+    if attrs:
+        attr_str = ''.join(
+            f' {name}="{escape(str(value), quote=True)}"'
+            for name, value in attrs.items() if value is not None
+        )
+    else:
+        attr_str = ''
+    return f'<{tag}{attr_str}/>' if self_closing else f'<{tag}{attr_str}>'
+
+
+class _StartTag:
+    """Vị trí một thẻ mở trong buffer, để có thể gán thêm thuộc tính sau (vd: style của <body>)."""
+    __slots__ = ('index', 'tag', 'attrs', 'depth')
+
+    def __init__(self, index, tag, attrs, depth):
+        self.index = index
+        self.tag = tag
+        self.attrs = attrs
+        self.depth = depth
+
+
+class HtmlWriter:
+    """
+    Ghi HTML trực tiếp vào một list các chuỗi rồi join một lần ở cuối,
+    không dựng cây BeautifulSoup và không cần prettify().
+
+    pretty=True: mỗi thẻ/đoạn text một dòng, thụt lề 1 khoảng trắng theo độ sâu
+                 (bố cục gần giống prettify()).
+    pretty=False (compact): không thêm khoảng trắng nào.
+
+    flush() lấy ra phần đã ghi để gửi đi ngay (streaming); vị trí trong buffer
+    được tính theo tổng số phần đã ghi, kể cả phần đã flush.
+    """
+
+    def __init__(self, pretty=False, indent=' '):
+        self.pretty = pretty
+        self.indent = indent
+        self._parts = []
+        self._flushed = 0  # Số phần đã flush khỏi _parts
+        self._depth = 0
+
+    def _write(self, s, depth):
+        if self.pretty:
+            self._parts.append(f'{self.indent * depth}{s}\n')
+        else:
+            self._parts.append(s)
+
+    def start(self, tag, attrs=None):
+        handle = _StartTag(self._flushed + len(self._parts), tag, dict(attrs) if attrs else {}, self._depth)
+        self._write(start_tag(tag, handle.attrs), self._depth)
+        self._depth += 1
+        return handle
+
+    def end(self, tag):
+        self._depth -= 1
+        self._write(f'</{tag}>', self._depth)
+
+    def void(self, tag, attrs=None):
+        self._write(start_tag(tag, attrs, self_closing=True), self._depth)
+
+    def text(self, text):
+        """Ghi text thường (sẽ được escape)."""
+        self.escaped_text(escape(text, quote=False))
+
+    def escaped_text(self, text):
+        """Ghi text đã được escape sẵn."""
+        if self.pretty:
+            text = text.strip()
+            if not text:
+                return
+        self._write(text, self._depth)
+
+    def raw(self, html):
+        """Ghi nguyên văn (vd: nội dung CSS trong <style>)."""
+        self._write(html, self._depth)
+
+    def fragment(self, html):
+        """Chèn nguyên văn một đoạn HTML đã ghi trước đó (lấy bằng since())."""
+        self._parts.append(html)
+
+    def is_flushed(self, handle):
+        """Thẻ mở đã được flush (không sửa thuộc tính được nữa)."""
+        return handle.index < self._flushed
+
+    def set_attribute(self, handle, name, value):
+        if self.is_flushed(handle):
+            raise ValueError(f"<{handle.tag}> has already been flushed")
+        handle.attrs[name] = value
+        line = start_tag(handle.tag, handle.attrs)
+        self._parts[handle.index - self._flushed] = f'{self.indent * handle.depth}{line}\n' if self.pretty else line
+
+    def set_text(self, handle, text):
+        """
+        Điền nội dung cho thẻ vừa ghi rỗng (start() rồi end() ngay), vd: <style> chỉ biết
+        nội dung khi đã chuyển đổi xong cả tài liệu. text được ghi nguyên văn.
+        """
+        if self.is_flushed(handle):
+            raise ValueError(f"<{handle.tag}> has already been flushed")
+        line = start_tag(handle.tag, handle.attrs)
+        if self.pretty:
+            line = f'{self.indent * handle.depth}{line}\n{self.indent * (handle.depth + 1)}{text}\n'
+        else:
+            line += text
+        self._parts[handle.index - self._flushed] = line
+
+    def mark(self):
+        return self._flushed + len(self._parts), self._depth
+
+    def rollback(self, mark):
+        """Huỷ mọi thứ đã ghi từ mark (dùng khi một block bị lỗi giữa chừng)."""
+        length, depth = mark
+        del self._parts[length - self._flushed:]
+        self._depth = depth
+
+    def since(self, mark):
+        """HTML đã ghi từ mark tới hiện tại."""
+        return ''.join(self._parts[mark[0] - self._flushed:])
+
+    def flush(self):
+        """Trả về phần HTML đã ghi kể từ lần flush trước và giải phóng buffer."""
+        chunk = ''.join(self._parts)
+        self._flushed += len(self._parts)
+        self._parts = []
+        return chunk
+
+    def getvalue(self):
+        return ''.join(self._parts)
+
+
+class SoupWriter:
+    """
+    Cùng giao diện với HtmlWriter nhưng dựng cây BeautifulSoup như converter vẫn làm,
+    và xuất bằng prettify() (hoặc str() khi compact). Giữ nguyên output cũ.
+    Lưu ý: BeautifulSoup luôn escape text khi xuất, kể cả với escaped_text().
+    """
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.soup = BeautifulSoup('', 'html.parser')
+        self._stack = [self.soup]
+
+    def start(self, tag, attrs=None):
+        element = self.soup.new_tag(tag, attrs=dict(attrs) if attrs else {})
+        self._stack[-1].append(element)
+        self._stack.append(element)
+        return element
+
+    def end(self, tag):
+        self._stack.pop()
+
+    def void(self, tag, attrs=None):
+        self._stack[-1].append(self.soup.new_tag(tag, attrs=dict(attrs) if attrs else {}))
+
+    def text(self, text):
+        self._stack[-1].append(text)
+
+    def escaped_text(self, text):
+        self._stack[-1].append(text)
+
+    def raw(self, html):
+        self._stack[-1].append(html)
+
+    def set_attribute(self, handle, name, value):
+        handle[name] = value
+
+    def set_text(self, handle, text):
+        handle.string = text
+
+    def mark(self):
+        parent = self._stack[-1]
+        return parent, len(parent.contents), len(self._stack)
+
+    def rollback(self, mark):
+        parent, length, depth = mark
+        for child in parent.contents[length:]:
+            child.extract()
+        del self._stack[depth:]
+
+    def getvalue(self):
+        return str(self.soup) if self.compact else self.soup.prettify()
@@ -0,0 +1,66 @@
+# helpers/image_store.py
+
+import os
+import re
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# content type -> đuôi file
+IMAGE_EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'image/tiff': '.tiff',
+    'image/webp': '.webp',
+    'image/svg+xml': '.svg',
+    'image/x-emf': '.emf',
+    'image/x-wmf': '.wmf',
+}
+MEDIA_TYPES = {ext: content_type for content_type, ext in IMAGE_EXTENSIONS.items()}
+
+# id ảnh = sha256 hex + đuôi file, ví dụ "3f2a...e9.png"
+IMAGE_ID_PATTERN = re.compile(r'^([0-9a-f]{64})(\.[a-z]+)$')
+
+
+class ImageStore:
+    """
+    Kho ảnh theo nội dung (content-addressed) trên đĩa: mỗi ảnh lưu một lần
+    theo SHA-256 của blob, nên cùng một logo/con dấu xuất hiện trong nhiều tài liệu
+    chỉ chiếm một file. HTML tham chiếu ảnh qua URL `{url_prefix}/{image_id}`.
+    """
+
+    def __init__(self, root_dir: str, url_prefix: str = "/items/images"):
+        self.root_dir = root_dir
+        self.url_prefix = url_prefix.rstrip('/')
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, image_id: str) -> str:
+        return os.path.join(self.root_dir, image_id[:2], image_id)
+
+    def put(self, blob: bytes, content_type: str) -> str:
+        """Lưu ảnh (nếu chưa có) và trả về URL của ảnh."""
+        image_id = hashlib.sha256(blob).hexdigest() + IMAGE_EXTENSIONS.get(content_type, '.bin')
+        path = self._path(image_id)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Ghi ra file tạm rồi đổi tên => request khác không đọc phải file ghi dở
+            # pid + thread id: hai thread cùng ghi một blob không dùng chung file tạm
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        return f"{self.url_prefix}/{image_id}"
+
+    def get(self, image_id: str):
+        """Trả về (đường dẫn file, media type) của ảnh, hoặc None nếu id không hợp lệ/không tồn tại."""
+        match = IMAGE_ID_PATTERN.match(image_id)
+        if not match:
+            return None
+        path = self._path(image_id)
+        if not os.path.exists(path):
+            return None
+        return path, MEDIA_TYPES.get(match.group(2), 'application/octet-stream')
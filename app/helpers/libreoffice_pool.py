@@ -0,0 +1,333 @@
+# helpers/libreoffice_pool.py
+
+import os
+import io
+import time
+import queue
+import shutil
+import zipfile
+import logging
+import tempfile
+import threading
+import subprocess
+
+try:
+    # python3-uno (đi kèm LibreOffice) - không bắt buộc
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    uno = None
+
+logger = logging.getLogger(__name__)
+
+ZIP_MAGIC = b'PK\x03\x04'
+
+# Filter xuất .docx của LibreOffice
+DOCX_FILTER = "MS Word 2007 XML"
+
+
+def is_ooxml_zip(file_bytes: bytes) -> bool:
+    """
+    Nhận diện file thực chất là .docx (OOXML zip) dù có đuôi .doc, dựa trên magic bytes
+    'PK\\x03\\x04' và sự có mặt của [Content_Types].xml + word/ trong zip.
+    File .doc thật (OLE2) bắt đầu bằng D0 CF 11 E0 nên bị loại ngay ở bước đầu.
+    """
+    if not file_bytes.startswith(ZIP_MAGIC):
+        return False
+    try:
+        with zipfile.ZipFile(io.BytesIO(file_bytes)) as package:
+            names = package.namelist()
+    except zipfile.BadZipFile:
+        return False
+    return '[Content_Types].xml' in names and any(name.startswith('word/') for name in names)
+
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+class LibreOfficeWorker:
+    """
+    Một worker LibreOffice với profile (UserInstallation) riêng.
+
+    - Có python3-uno: giữ một tiến trình soffice headless chạy lâu dài, lắng nghe trên
+      pipe riêng; mỗi job chỉ load + store qua UNO, không tốn thời gian khởi động.
+    - Không có uno: mỗi job chạy `soffice --convert-to` một lần nhưng vẫn dùng profile
+      và thư mục output riêng của worker, nên các job song song không đụng nhau.
+    """
+
+    def __init__(self, index: int, soffice_path: str = "soffice", startup_timeout: float = 60):
+        self.index = index
+        self.soffice_path = soffice_path
+        self.startup_timeout = startup_timeout
+        self.base_dir = tempfile.mkdtemp(prefix=f"lo_worker_{index}_")
+        self.profile_dir = os.path.join(self.base_dir, "profile")
+        self.pipe_name = f"lo_worker_{os.getpid()}_{index}"
+        self.process = None
+        self.desktop = None
+        self.jobs = 0
+        self.failures = 0
+        self.restarts = 0
+
+    @property
+    def profile_url(self) -> str:
+        return f"file://{self.profile_dir}"
+
+    @property
+    def persistent(self) -> bool:
+        return uno is not None
+
+    # ------------------------------------------------------------------
+    # Vòng đời tiến trình soffice (chỉ dùng khi có uno)
+    # ------------------------------------------------------------------
+    def start(self):
+        if not self.persistent:
+            return
+        command = [
+            self.soffice_path,
+            f"-env:UserInstallation={self.profile_url}",
+            "--headless", "--invisible", "--nologo", "--norestore", "--nodefault", "--nolockcheck",
+            f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+        ]
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.desktop = self._connect()
+
+    def _connect(self):
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"
+                )
+                return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"LibreOffice worker {self.index} failed to start")
+                time.sleep(0.25)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                pass
+        self.process = None
+        self.desktop = None
+
+    def restart(self):
+        self.stop()
+        # Profile có thể đã hỏng khi tiến trình bị kill giữa chừng => tạo lại
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.restarts += 1
+        self.start()
+
+    def is_healthy(self) -> bool:
+        """Tiến trình còn sống và còn trả lời qua UNO (luôn True ở chế độ chạy một lần)."""
+        if not self.persistent:
+            return True
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    # ------------------------------------------------------------------
+    # Chuyển đổi
+    # ------------------------------------------------------------------
+    def convert(self, doc_path: str, output_dir: str, timeout: float) -> str:
+        """Chuyển doc_path sang .docx trong output_dir, trả về đường dẫn file .docx."""
+        self.jobs += 1
+        docx_path = os.path.join(
+            output_dir, f"{os.path.splitext(os.path.basename(doc_path))[0]}.docx"
+        )
+        try:
+            if self.persistent:
+                self._convert_uno(doc_path, docx_path, timeout)
+            else:
+                self._convert_once(doc_path, output_dir, timeout)
+        except Exception:
+            self.failures += 1
+            raise
+        if not os.path.exists(docx_path):
+            self.failures += 1
+            raise FileNotFoundError("Converted .docx file not found.")
+        return docx_path
+
+    def _convert_uno(self, doc_path: str, docx_path: str, timeout: float):
+        result = {}
+
+        def run():
+            try:
+                document = self.desktop.loadComponentFromURL(
+                    uno.systemPathToFileUrl(os.path.abspath(doc_path)), "_blank", 0,
+                    (_property("Hidden", True), _property("ReadOnly", True)),
+                )
+                try:
+                    document.storeToURL(
+                        uno.systemPathToFileUrl(os.path.abspath(docx_path)),
+                        (_property("FilterName", DOCX_FILTER),),
+                    )
+                finally:
+                    document.close(True)
+            except Exception as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            # Job treo => kill tiến trình (lời gọi UNO sẽ lỗi và thread kết thúc) rồi khởi động lại
+            logger.error(f"LibreOffice worker {self.index} timed out after {timeout}s, restarting")
+            self.restart()
+            raise TimeoutError("LibreOffice conversion timed out")
+        if 'error' in result:
+            raise RuntimeError(f"LibreOffice conversion failed: {result['error']}") from result['error']
+
+    def _convert_once(self, doc_path: str, output_dir: str, timeout: float):
+        command = [
+            self.soffice_path,
+            f"-env:UserInstallation={self.profile_url}",
+            "--headless", "--norestore", "--nolockcheck",
+            "--convert-to", "docx",
+            doc_path,
+            "--outdir", output_dir,
+        ]
+        try:
+            # subprocess.run kill tiến trình khi quá timeout
+            subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            logger.error(f"LibreOffice worker {self.index} timed out after {timeout}s")
+            # Profile có thể bị khoá dở dang => xoá để lần sau tạo lại
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.restarts += 1
+            raise TimeoutError("LibreOffice conversion timed out") from e
+        except subprocess.CalledProcessError as e:
+            logger.error(f"LibreOffice conversion failed: {e.stderr.decode()}")
+            raise RuntimeError("Failed to convert .doc to .docx") from e
+
+    def status(self) -> dict:
+        return {
+            "index": self.index,
+            "persistent": self.persistent,
+            "healthy": self.is_healthy(),
+            "pid": self.process.pid if self.process is not None else None,
+            "jobs": self.jobs,
+            "failures": self.failures,
+            "restarts": self.restarts,
+        }
+
+
+class LibreOfficePool:
+    """
+    Pool các LibreOfficeWorker. Worker rảnh nằm trong một hàng đợi; mỗi request lấy một
+    worker (chờ tối đa queue_timeout giây), chuyển đổi với timeout riêng rồi trả worker lại.
+    Worker được khởi động khi cần lần đầu. Worker không còn trả lời được khởi động lại khi
+    lấy ra khỏi hàng đợi, và (chế độ UNO) một thread nền kiểm tra các worker rảnh mỗi
+    health_interval giây để request sau không phải chờ khởi động lại.
+    """
+
+    def __init__(self, size: int = 2, soffice_path: str = "soffice", job_timeout: float = 120,
+                 queue_timeout: float = 300, health_interval: float = 30):
+        self.size = size
+        self.soffice_path = soffice_path
+        self.job_timeout = job_timeout
+        self.queue_timeout = queue_timeout
+        self.health_interval = health_interval
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._stop_monitor = threading.Event()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            if uno is None:
+                logger.warning(
+                    "python3-uno is not importable: LibreOffice workers run one-shot 'soffice --convert-to' per job"
+                )
+            for index in range(self.size):
+                worker = LibreOfficeWorker(index, self.soffice_path)
+                try:
+                    worker.start()
+                except Exception as e:
+                    # Worker sẽ được khởi động lại ở job đầu tiên (is_healthy() == False)
+                    logger.error(f"An error occurred starting LibreOffice worker {index}: {e}")
+                self._workers.append(worker)
+                self._idle.put(worker)
+            self._started = True
+            if uno is not None and self.health_interval > 0:
+                self._stop_monitor.clear()
+                threading.Thread(target=self._monitor, name="libreoffice-health", daemon=True).start()
+
+    def _monitor(self):
+        while not self._stop_monitor.wait(self.health_interval):
+            try:
+                self.health_check()
+            except Exception as e:
+                logger.error(f"An error occurred in LibreOffice health check: {e}")
+
+    def convert(self, doc_path: str, output_dir: str) -> str:
+        """Chuyển doc_path sang .docx (trong output_dir) bằng một worker của pool."""
+        self._ensure_started()
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise TimeoutError("No LibreOffice worker available")
+        try:
+            if not worker.is_healthy():
+                # soffice chết/treo khi đang rảnh (crash, OOM kill...) => khởi động lại trước khi dùng
+                worker.restart()
+            return worker.convert(doc_path, output_dir, self.job_timeout)
+        finally:
+            self._idle.put(worker)
+
+    def health_check(self):
+        """Khởi động lại các worker rảnh không còn trả lời."""
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for worker in idle:
+                if not worker.is_healthy():
+                    try:
+                        worker.restart()
+                    except Exception as e:
+                        logger.error(f"An error occurred restarting LibreOffice worker {worker.index}: {e}")
+        finally:
+            for worker in idle:
+                self._idle.put(worker)
+
+    def status(self) -> dict:
+        return {
+            "size": self.size,
+            "started": self._started,
+            "idle": self._idle.qsize(),
+            "workers": [worker.status() for worker in self._workers],
+        }
+
+    def close(self):
+        self._stop_monitor.set()
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
+        self._idle = queue.Queue()
+        self._started = False
@@ -0,0 +1,160 @@
+# helpers/llm_client.py
+
+import asyncio
+import logging
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Optional
+
+import google.generativeai as genai
+
+from app.config import settings
+from app.helpers.prompt_cache import PromptCache
+from app.helpers.server_timing import span
+
+logger = logging.getLogger(__name__)
+
+
+class LLMTimeout(TimeoutError):
+    """Lời gọi LLM vượt quá deadline."""
+
+
+class AsyncLLMClient:
+    """
+    Client Gemini bất đồng bộ: dùng generate_content_async của SDK nên lời gọi đang chờ
+    không chiếm thread nào, nhiều request dùng chung một worker.
+    - Deadline cho từng lời gọi (timeout, mặc định GEMINI_TIMEOUT): quá hạn => LLMTimeout,
+      lời gọi bên dưới bị huỷ.
+    - Huỷ: task đang await generate() bị cancel (client ngắt kết nối, gather bị huỷ...)
+      thì lời gọi HTTP tới Gemini cũng bị huỷ theo.
+    - Tối đa GEMINI_MAX_CONCURRENCY lời gọi đồng thời trong một process, phần còn lại chờ.
+    - cache (PromptCache): cùng model + prompt (đã chuẩn hoá) => trả response đã lưu,
+      không gọi API.
+    """
+
+    def __init__(self, api_key: str, timeout: float, max_concurrency: int, cache: PromptCache = None):
+        genai.configure(api_key=api_key)
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self._semaphore = None
+
+    @classmethod
+    def from_settings(cls):
+        cache = None
+        if settings.PROMPT_CACHE_ENABLED:
+            cache = PromptCache(
+                settings.PROMPT_CACHE_PATH,
+                ttl=settings.PROMPT_CACHE_TTL,
+                max_bytes=settings.PROMPT_CACHE_MAX_BYTES,
+            )
+        return cls(
+            api_key=settings.GOOGLE_GENERATIVE_AI_API_KEY,
+            timeout=settings.GEMINI_TIMEOUT,
+            max_concurrency=settings.GEMINI_MAX_CONCURRENCY,
+            cache=cache,
+        )
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Tạo khi dùng lần đầu, bên trong event loop của ứng dụng
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def generate(self, prompt: str, model_name: str, timeout: Optional[float] = None):
+        """
+        Gọi model_name với prompt, trả về response của SDK (hoặc CachedResponse khi hit cache).
+        Ném LLMTimeout khi quá deadline.
+        """
+        key = None
+        if self.cache is not None:
+            key = PromptCache.make_key(model_name, prompt)
+            # SQLite (đọc đĩa, chờ lock) chạy ngoài event loop
+            with span("prompt-cache"):
+                cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return CachedResponse(cached)
+
+        timeout = self.timeout if timeout is None else timeout
+        model = genai.GenerativeModel(model_name)
+        async with self._get_semaphore():
+            started = perf_counter()
+            with span("gemini"):
+                try:
+                    response = await asyncio.wait_for(
+                        model.generate_content_async(prompt, request_options={"timeout": timeout}),
+                        timeout,
+                    )
+                except asyncio.TimeoutError:
+                    raise LLMTimeout(f"{model_name} did not respond within {timeout}s")
+            elapsed = perf_counter() - started
+
+        if key is not None:
+            candidates = snapshot_candidates(response)
+            # Response rỗng (bị chặn, lỗi...) không được cache
+            if any(''.join(parts).strip() for parts in candidates):
+                with span("prompt-cache"):
+                    await asyncio.to_thread(self.cache.set, key, model_name, candidates, elapsed)
+        return response
+
+    async def forget(self, prompt: str, model_name: str):
+        """Bỏ response đã cache của prompt (vd: không parse được), lần gọi sau sẽ gọi lại API."""
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.forget, PromptCache.make_key(model_name, prompt))
+
+    def cache_stats(self) -> dict:
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+
+    async def generate_text(self, prompt: str, model_name: str, timeout: Optional[float] = None) -> str:
+        """Như generate() nhưng trả về toàn bộ text của response."""
+        return response_text(await self.generate(prompt, model_name, timeout))
+
+
+class CachedResponse:
+    """
+    Response dựng lại từ PromptCache, có các thuộc tính mà code gọi đang dùng của
+    response SDK: text, parts, candidates[i].content.parts[j].text.
+    """
+
+    def __init__(self, candidates):
+        self.candidates = [
+            SimpleNamespace(
+                content=SimpleNamespace(parts=[SimpleNamespace(text=text) for text in parts]),
+                finish_reason=None,
+            )
+            for parts in candidates
+        ]
+        self.parts = self.candidates[0].content.parts if self.candidates else []
+        self.text = ''.join(part.text for part in self.parts)
+
+
+def snapshot_candidates(response):
+    """Text các part của từng candidate ([[text, ...], ...]) để lưu vào PromptCache."""
+    candidates = []
+    for candidate in getattr(response, 'candidates', None) or []:
+        parts = getattr(getattr(candidate, 'content', None), 'parts', None) or []
+        candidates.append([part.text for part in parts if hasattr(part, 'text')])
+    return candidates
+
+
+def response_text(response) -> str:
+    """Toàn bộ text của một response Gemini."""
+    if response.text:
+        return response.text
+    if hasattr(response, 'parts'):
+        return ''.join(part.text for part in response.parts if hasattr(part, 'text'))
+    logger.warning("Unexpected response format")
+    return str(response)
+
+
+_client = None
+
+
+def get_llm_client() -> AsyncLLMClient:
+    """Client dùng chung cho cả process."""
+    global _client
+    if _client is None:
+        _client = AsyncLLMClient.from_settings()
+    return _client
@@ -0,0 +1,23 @@
+# helpers/placeholder_ids.py
+
+import uuid
+
+# Namespace cố định cho uuid5 => cùng đường dẫn cấu trúc luôn ra cùng id
+PLACEHOLDER_NAMESPACE = uuid.UUID('6f0c8a52-3d1e-5b8f-9c47-2a61d0e4b7f3')
+
+ID_MODES = ("random", "stable")
+
+
+def stable_placeholder_id(*path) -> str:
+    """
+    id xác định của placeholder từ đường dẫn cấu trúc (block, paragraph, nhóm run, lần xuất hiện...).
+    Vẫn có dạng UUID nên các regex/prompt đang nhận diện id dạng UUID dùng được như cũ.
+    """
+    return str(uuid.uuid5(PLACEHOLDER_NAMESPACE, '/'.join(str(part) for part in path)))
+
+
+def placeholder_id(mode: str, *path) -> str:
+    """mode="stable" => stable_placeholder_id(*path); "random" => uuid4 (mỗi lần chuyển đổi một id khác)."""
+    if mode == "stable":
+        return stable_placeholder_id(*path)
+    return str(uuid.uuid4())
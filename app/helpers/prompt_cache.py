@@ -0,0 +1,172 @@
+# helpers/prompt_cache.py
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+
+class PromptCache:
+    """
+    Cache response của LLM theo nội dung prompt (content-addressed), lưu trong SQLite
+    nên còn lại sau khi khởi động lại và dùng chung được giữa các worker.
+
+    Khoá = SHA-256(tên model + prompt đã chuẩn hoá).
+    - ttl: entry cũ hơn ttl giây được coi là miss và bị xoá.
+    - max_bytes: tổng kích thước response tối đa, vượt quá => xoá entry ít được dùng gần đây nhất.
+    - Mỗi entry lưu thời gian lời gọi gốc để thống kê số giây tiết kiệm được khi hit.
+    File SQLite chỉ được mở (và tạo bảng) ở lần dùng đầu tiên, không phải khi khởi tạo.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self.evictions = 0
+
+        # Một connection cho cả process, các thread dùng chung qua self._lock
+        self._db = None
+
+    def _connect(self):
+        # Gọi khi đã giữ self._lock
+        if self._db is not None:
+            return self._db
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS prompt_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                elapsed REAL NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS prompt_cache_last_access ON prompt_cache (last_access)")
+        db.execute("CREATE INDEX IF NOT EXISTS prompt_cache_created ON prompt_cache (created)")
+        self._db = db
+        return db
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """Unicode NFC + gộp khoảng trắng: prompt chỉ khác nhau về khoảng trắng/dạng dấu dùng chung khoá."""
+        return ' '.join(unicodedata.normalize('NFC', prompt).split())
+
+    @classmethod
+    def make_key(cls, model: str, prompt: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(model.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(cls.normalize_prompt(prompt).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """Response đã cache (đối tượng JSON) hoặc None."""
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._connect()
+                row = db.execute(
+                    "SELECT response, elapsed, created FROM prompt_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[2] > self.ttl:
+                    db.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                db.execute(
+                    "UPDATE prompt_cache SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key)
+                )
+                self.hits += 1
+                self.seconds_saved += row[1]
+            return json.loads(row[0])
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.error(f"An error occurred reading prompt cache: {e}")
+            return None
+
+    def set(self, key: str, model: str, response, elapsed: float):
+        """Lưu response (đối tượng JSON) và thời gian (giây) của lời gọi gốc."""
+        data = json.dumps(response, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO prompt_cache (key, model, response, size, elapsed, created, last_access)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, data, size, elapsed, now, now),
+                )
+                db.execute("DELETE FROM prompt_cache WHERE created < ?", (now - self.ttl,))
+                self._evict()
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"An error occurred writing prompt cache: {e}")
+
+    def _evict(self):
+        # Gọi khi đã giữ self._lock: xoá entry dùng lâu nhất cho tới khi tổng kích thước <= max_bytes
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM prompt_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM prompt_cache ORDER BY last_access"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def forget(self, key: str):
+        """Xoá một entry (vd: response đã cache hoá ra không dùng được)."""
+        try:
+            with self._lock:
+                self._connect().execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"An error occurred writing prompt cache: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM prompt_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total_bytes, lifetime_hits, lifetime_saved = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0), COALESCE(SUM(hits * elapsed), 0)"
+                " FROM prompt_cache"
+            ).fetchone()
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "seconds_saved": round(self.seconds_saved, 3),
+                "evictions": self.evictions,
+                # Tính trên các entry còn trong cache, gồm cả hit của các process/lần chạy trước
+                "stored_hits": lifetime_hits,
+                "stored_seconds_saved": round(lifetime_saved, 3),
+                "path": self.path,
+            }
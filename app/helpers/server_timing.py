@@ -0,0 +1,145 @@
+# helpers/server_timing.py
+
+import threading
+import contextvars
+from functools import partial
+from time import perf_counter
+
+from starlette.datastructures import MutableHeaders
+
+# Bộ thu thời gian của request hiện tại (None => không đo, span() gần như không tốn gì)
+_current = contextvars.ContextVar("server_timing", default=None)
+
+
+class Timings:
+    """Tổng thời gian và số lần gọi theo tên giai đoạn của một request (thread-safe)."""
+
+    __slots__ = ("_stages", "_lock")
+
+    def __init__(self):
+        self._stages = {}  # tên -> [giây, số lần]
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, count: int = 1):
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                self._stages[name] = [seconds, count]
+            else:
+                stage[0] += seconds
+                stage[1] += count
+
+    def merge(self, stages: dict):
+        """Gộp kết quả as_dict() của một Timings khác (ví dụ đo trong process pool)."""
+        for name, (seconds, count) in stages.items():
+            self.record(name, seconds, count)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {name: (seconds, count) for name, (seconds, count) in self._stages.items()}
+
+    def header_value(self) -> str:
+        """Giá trị header Server-Timing, ví dụ: docx-load;dur=12.3, gemini;dur=2100.0;desc="x3"."""
+        entries = []
+        for name, (seconds, count) in self.as_dict().items():
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="x{count}"'
+            entries.append(entry)
+        return ", ".join(entries)
+
+
+class _Span:
+    __slots__ = ("timings", "name", "started")
+
+    def __init__(self, timings: Timings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timings.record(self.name, perf_counter() - self.started)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str):
+    """
+    Context manager đo một giai đoạn: `with span("docx-load"): ...`
+    Tên dùng làm metric trong Server-Timing nên không chứa khoảng trắng.
+    Không có request nào đang đo => trả về span rỗng dùng chung.
+    """
+    timings = _current.get()
+    if timings is None:
+        return _NOOP_SPAN
+    return _Span(timings, name)
+
+
+def current_timings():
+    return _current.get()
+
+
+def call_with_timings(fn, *args, **kwargs):
+    """
+    Chạy fn trong executor với bộ thu riêng, trả về (kết quả, thời gian từng giai đoạn)
+    để process/thread gọi gộp lại (context var không tự truyền sang executor).
+    Hàm module-level => pickle được cho process pool.
+    """
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        return fn(*args, **kwargs), timings.as_dict()
+    finally:
+        # Thread của executor được dùng lại => không để lại bộ thu của request này
+        _current.reset(token)
+
+
+def in_current_context(fn):
+    """Bọc fn để chạy trong bản sao context hiện tại (dùng khi submit vào ThreadPoolExecutor)."""
+    return partial(contextvars.copy_context().run, fn)
+
+
+class ServerTimingMiddleware:
+    """
+    Middleware ASGI: tạo bộ thu cho mỗi request HTTP và thêm header Server-Timing
+    (các giai đoạn đã đo + total) vào response. Với StreamingResponse chỉ gồm
+    các giai đoạn xong trước khi gửi header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = Timings()
+        started = perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timings.record("total", perf_counter() - started)
+                MutableHeaders(scope=message).append("Server-Timing", timings.header_value())
+            await send(message)
+
+        token = _current.set(timings)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,94 @@
+# helpers/style_classes.py
+
+import re
+
+STYLE_MODES = ("inline", "classes")
+
+# class="..." trong HTML đã ghi (dùng khi đổi tên class của fragment cache)
+CLASS_ATTR_PATTERN = re.compile(r'class="([^"]*)"')
+
+
+def normalize_css(css):
+    """Chuẩn hoá chuỗi style inline: bỏ khoảng trắng thừa và khai báo rỗng, cùng style => cùng chuỗi."""
+    declarations = []
+    for declaration in css.split(';'):
+        name, sep, value = declaration.partition(':')
+        if sep and name.strip():
+            declarations.append(f'{name.strip()}:{value.strip()}')
+    return ';'.join(declarations)
+
+
+class StyleClasses:
+    """
+    Gom các style inline giống nhau thành class sinh tự động (s0, s1, ...) trong một
+    khối <style> duy nhất, thẻ chỉ mang tên class ngắn thay vì cả chuỗi style.
+    Tên class đánh số theo thứ tự xuất hiện lần đầu trong tài liệu.
+    """
+
+    def __init__(self, prefix='s'):
+        self.prefix = prefix
+        self._names = {}  # css đã chuẩn hoá -> tên class
+        self._raw_names = {}  # chuỗi style gốc -> tên class (bỏ qua chuẩn hoá khi gặp lại)
+        self._rules = {}  # tên class -> css
+        self._emitted = 0  # Số rule đã lấy bằng take_new()
+
+    def class_for(self, css):
+        """Tên class của một chuỗi style (intern nếu chưa có), None nếu style rỗng."""
+        try:
+            return self._raw_names[css]
+        except KeyError:
+            pass
+        normalized = normalize_css(css)
+        name = self._names.get(normalized) if normalized else None
+        if normalized and name is None:
+            name = f'{self.prefix}{len(self._names)}'
+            self._names[normalized] = name
+            self._rules[name] = normalized
+        self._raw_names[css] = name
+        return name
+
+    def apply(self, attrs):
+        """
+        Thay thuộc tính style trong attrs (dict thuộc tính thẻ) bằng class tương ứng,
+        giữ các class đã có (vd: table-look-...). Trả về chính attrs.
+        """
+        if not attrs or 'style' not in attrs:
+            return attrs
+        name = self.class_for(attrs.pop('style') or '')
+        if name:
+            attrs['class'] = f"{attrs['class']} {name}" if attrs.get('class') else name
+        return attrs
+
+    def css(self, names=None):
+        """Nội dung khối <style>: mỗi class một dòng `.s0{...}`."""
+        names = self._rules if names is None else names
+        # Giá trị style lấy từ tài liệu => không để chuỗi nào đóng được thẻ <style>
+        return '\n'.join(f'.{name}{{{self._rules[name]}}}' for name in names).replace('</', '<\\/')
+
+    def take_new(self):
+        """CSS của các class tạo ra từ lần gọi trước (streaming: ghi thêm <style> sau mỗi block)."""
+        names = list(self._rules)[self._emitted:]
+        self._emitted += len(names)
+        return self.css(names)
+
+    def used_in(self, html):
+        """{tên class: css} của các class sinh tự động có trong một đoạn HTML."""
+        used = {}
+        for match in CLASS_ATTR_PATTERN.finditer(html):
+            for name in match.group(1).split():
+                if name in self._rules:
+                    used[name] = self._rules[name]
+        return used
+
+    def rename(self, html, classes):
+        """
+        Dùng lại đoạn HTML đã cache ở tài liệu khác: classes là {tên cũ: css} lưu cùng đoạn
+        HTML, mỗi tên cũ được thay bằng class của css đó trong tài liệu hiện tại.
+        """
+        if not classes:
+            return html
+        mapping = {name: self.class_for(css) for name, css in classes.items()}
+        return CLASS_ATTR_PATTERN.sub(
+            lambda m: 'class="{}"'.format(' '.join(mapping.get(name, name) for name in m.group(1).split())),
+            html,
+        )
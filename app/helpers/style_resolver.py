@@ -0,0 +1,285 @@
+# helpers/style_resolver.py
+
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+from lxml import etree
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.styles import BabelFish
+
+logger = logging.getLogger(__name__)
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def w(tag):
+    return f'{{{W_NS}}}{tag}'
+
+
+_FALSE_VALUES = ('0', 'false', 'off')
+
+# Thứ tự các thuộc tính của RunStyle, dùng làm khoá intern
+RUN_PROPERTY_KEYS = (
+    'font_size', 'bold', 'italic', 'underline', 'strikethrough', 'font_name',
+    'small_caps', 'all_caps', 'superscript', 'subscript', 'highlight_color', 'color',
+)
+
+# Các thuộc tính bật/tắt (ST_OnOff) trong w:rPr
+_ON_OFF_TAGS = (
+    ('bold', w('b')),
+    ('italic', w('i')),
+    ('strikethrough', w('strike')),
+    ('small_caps', w('smallCaps')),
+    ('all_caps', w('caps')),
+)
+
+
+@dataclass(frozen=True, slots=True)
+class RunStyle:
+    """
+    Định dạng hiệu lực (effective) của một run sau khi đã gộp docDefaults,
+    paragraph style, character style và định dạng trực tiếp.
+    Mỗi tổ hợp thuộc tính chỉ có một instance duy nhất trong một StyleResolver,
+    nên có thể so sánh bằng `is`.
+    """
+    font_size: Optional[float] = None
+    bold: Optional[bool] = None
+    italic: Optional[bool] = None
+    underline: object = None
+    strikethrough: Optional[bool] = None
+    font_name: Optional[str] = None
+    small_caps: Optional[bool] = None
+    all_caps: Optional[bool] = None
+    superscript: Optional[bool] = None
+    subscript: Optional[bool] = None
+    highlight_color: Optional[str] = None
+    color: Optional[int] = None
+    # Chuỗi CSS inline, tính một lần khi tạo style
+    css: Optional[str] = field(default=None, compare=False)
+
+
+@dataclass(frozen=True, slots=True)
+class ParagraphFormat:
+    """Định dạng hiệu lực của một paragraph (style id đã resolve, tên style, căn lề)."""
+    style_id: Optional[str]
+    style_name: Optional[str]
+    alignment: str
+
+
+def build_run_css(properties):
+    """
+    Từ dict thuộc tính run (font_size, bold, italic,...),
+    trả về chuỗi style inline (hoặc None nếu không có thuộc tính nào).
+    """
+    style_parts = []
+    if properties.get('font_size'):
+        style_parts.append(f'font-size: {properties["font_size"]}pt')
+    if properties.get('bold'):
+        style_parts.append('font-weight: bold')
+    if properties.get('italic'):
+        style_parts.append('font-style: italic')
+    if properties.get('underline'):
+        style_parts.append('text-decoration: underline')
+    if properties.get('color'):
+        # color là kiểu int (RGB), format thành hex 6 ký tự
+        style_parts.append(f'color: #{properties["color"]:06X}')
+    return '; '.join(style_parts) if style_parts else None
+
+
+def read_run_properties(rPr):
+    """Đọc các thuộc tính được khai báo trực tiếp trong một w:rPr (bỏ qua thuộc tính không có)."""
+    properties = {}
+    if rPr is None:
+        return properties
+
+    sz = rPr.find(w('sz'))
+    if sz is not None and sz.get(w('val')):
+        # w:sz tính theo half-point
+        properties['font_size'] = int(sz.get(w('val'))) / 2
+
+    for key, tag in _ON_OFF_TAGS:
+        element = rPr.find(tag)
+        if element is not None:
+            properties[key] = element.get(w('val')) not in _FALSE_VALUES
+
+    u = rPr.find(w('u'))
+    if u is not None:
+        u_val = u.get(w('val'))
+        if u_val == 'single':
+            properties['underline'] = True
+        elif u_val == 'none':
+            properties['underline'] = False
+        else:
+            properties['underline'] = u_val
+
+    rFonts = rPr.find(w('rFonts'))
+    if rFonts is not None and rFonts.get(w('ascii')):
+        properties['font_name'] = rFonts.get(w('ascii'))
+
+    vertAlign = rPr.find(w('vertAlign'))
+    if vertAlign is not None:
+        properties['superscript'] = vertAlign.get(w('val')) == 'superscript'
+        properties['subscript'] = vertAlign.get(w('val')) == 'subscript'
+
+    highlight = rPr.find(w('highlight'))
+    if highlight is not None:
+        properties['highlight_color'] = highlight.get(w('val'))
+
+    color = rPr.find(w('color'))
+    if color is not None:
+        color_val = color.get(w('val'))
+        properties['color'] = int(color_val, 16) if color_val and color_val != 'auto' else None
+
+    return properties
+
+
+def _alignment_name(jc_val):
+    try:
+        return WD_PARAGRAPH_ALIGNMENT.from_xml(jc_val).name.lower()
+    except (KeyError, ValueError):
+        # 'start'/'end' (ISO 29500) không có trong enum cũ
+        return {'start': 'left', 'end': 'right'}.get(jc_val, 'left')
+
+
+class StyleResolver:
+    """
+    Resolve định dạng hiệu lực của run/paragraph cho một tài liệu, có tính kế thừa
+    từ styles.xml (docDefaults -> paragraph style -> character style -> định dạng trực tiếp).
+
+    Kết quả được cache theo (paragraph style id, XML chuẩn hoá của w:rPr), nên
+    hàng nghìn run cùng định dạng chỉ cần resolve một lần.
+    """
+
+    def __init__(self, styles_element=None):
+        self._styles = {}
+        self._default_style_ids = {}
+        self._default_run_properties = {}
+        self._default_alignment = None
+
+        self._chain_cache = {}
+        self._run_cache = {}
+        self._paragraph_cache = {}
+        self._interned = {}
+        self.hits = 0
+        self.misses = 0
+
+        if styles_element is not None:
+            self._load(styles_element)
+
+    def _load(self, styles_element):
+        for style in styles_element.iterfind(w('style')):
+            style_id = style.get(w('styleId'))
+            style_type = style.get(w('type'), 'paragraph')
+            self._styles[style_id] = style
+            if style.get(w('default')) not in (None, *_FALSE_VALUES):
+                # Giống python-docx: nếu có nhiều style default, lấy style cuối
+                self._default_style_ids[style_type] = style_id
+
+        doc_defaults = styles_element.find(w('docDefaults'))
+        if doc_defaults is not None:
+            self._default_run_properties = read_run_properties(
+                doc_defaults.find(f'{w("rPrDefault")}/{w("rPr")}')
+            )
+            jc = doc_defaults.find(f'{w("pPrDefault")}/{w("pPr")}/{w("jc")}')
+            if jc is not None:
+                self._default_alignment = jc.get(w('val'))
+
+    def _style_of_type(self, style_id, style_type):
+        """Trả về style id hợp lệ theo loại, hoặc style mặc định của loại đó."""
+        style = self._styles.get(style_id)
+        if style is not None and style.get(w('type'), 'paragraph') == style_type:
+            return style_id
+        return self._default_style_ids.get(style_type)
+
+    def _style_chain(self, style_id):
+        """
+        Thuộc tính run và căn lề đã gộp theo chuỗi basedOn của một style,
+        trả về (run_properties, jc_val). Cache theo style id.
+        """
+        if style_id in self._chain_cache:
+            return self._chain_cache[style_id]
+
+        chain = []
+        seen = set()
+        current = style_id
+        while current is not None and current in self._styles and current not in seen:
+            seen.add(current)
+            style = self._styles[current]
+            chain.append(style)
+            based_on = style.find(w('basedOn'))
+            current = based_on.get(w('val')) if based_on is not None else None
+
+        run_properties = {}
+        jc_val = None
+        for style in reversed(chain):
+            run_properties.update(read_run_properties(style.find(w('rPr'))))
+            jc = style.find(f'{w("pPr")}/{w("jc")}')
+            if jc is not None:
+                jc_val = jc.get(w('val'))
+
+        self._chain_cache[style_id] = (run_properties, jc_val)
+        return run_properties, jc_val
+
+    def _intern(self, properties):
+        key = tuple(properties.get(name) for name in RUN_PROPERTY_KEYS)
+        style = self._interned.get(key)
+        if style is None:
+            style = RunStyle(*key, css=build_run_css(properties))
+            self._interned[key] = style
+        return style
+
+    def resolve_paragraph(self, pPr):
+        """Định dạng hiệu lực của paragraph từ w:pPr (có thể None)."""
+        pStyle = pPr.find(w('pStyle')) if pPr is not None else None
+        jc = pPr.find(w('jc')) if pPr is not None else None
+        key = (
+            pStyle.get(w('val')) if pStyle is not None else None,
+            jc.get(w('val')) if jc is not None else None,
+        )
+        paragraph_format = self._paragraph_cache.get(key)
+        if paragraph_format is not None:
+            return paragraph_format
+
+        style_id = self._style_of_type(key[0], 'paragraph')
+        _, style_jc = self._style_chain(style_id)
+        jc_val = key[1] or style_jc or self._default_alignment
+
+        name = None
+        if style_id in self._styles:
+            name_element = self._styles[style_id].find(w('name'))
+            if name_element is not None and name_element.get(w('val')) is not None:
+                name = BabelFish.internal2ui(name_element.get(w('val')))
+
+        paragraph_format = ParagraphFormat(
+            style_id=style_id,
+            style_name=name,
+            alignment=_alignment_name(jc_val) if jc_val else 'left',
+        )
+        self._paragraph_cache[key] = paragraph_format
+        return paragraph_format
+
+    def resolve_run(self, rPr, paragraph_style_id=None):
+        """
+        Định dạng hiệu lực của run từ w:rPr (có thể None) trong paragraph có
+        style `paragraph_style_id` (đã resolve bằng resolve_paragraph).
+        """
+        rpr_key = etree.tostring(rPr, method='c14n') if rPr is not None else b''
+        key = (paragraph_style_id, rpr_key)
+        style = self._run_cache.get(key)
+        if style is not None:
+            self.hits += 1
+            return style
+
+        self.misses += 1
+        properties = dict(self._default_run_properties)
+        properties.update(self._style_chain(paragraph_style_id)[0])
+        if rPr is not None:
+            rStyle = rPr.find(w('rStyle'))
+            if rStyle is not None:
+                character_style_id = self._style_of_type(rStyle.get(w('val')), 'character')
+                properties.update(self._style_chain(character_style_id)[0])
+            properties.update(read_run_properties(rPr))
+
+        style = self._intern(properties)
+        self._run_cache[key] = style
+        return style
@@ -173,38 +173,39 @@ def calculate_total_column_width(table):
         raise
 
 
-def apply_table_styles(table_tag, tblPr):
+def apply_table_styles(table_attrs, tblPr):
     """
-    Áp dụng style + borders cho <table>.
+    Áp dụng style + borders cho <table> (table_attrs: dict thuộc tính của thẻ).
     """
     if tblPr is not None:
         # Lấy style chung
         table_styles_css = extract_table_styles(tblPr)
         if table_styles_css:
-            if 'style' in table_tag.attrs:
-                table_tag['style'] += ' ' + table_styles_css
+            if 'style' in table_attrs:
+                table_attrs['style'] += ' ' + table_styles_css
             else:
-                table_tag['style'] = table_styles_css
+                table_attrs['style'] = table_styles_css
 
         # Lấy border
         tblBorders = tblPr.find(qn('w:tblBorders'))
         if tblBorders is not None:
             table_borders_css = extract_borders(tblBorders, is_table=True)
             if table_borders_css:
-                if 'style' in table_tag.attrs:
-                    table_tag['style'] += ' ' + table_borders_css
+                if 'style' in table_attrs:
+                    table_attrs['style'] += ' ' + table_borders_css
                 else:
-                    table_tag['style'] = table_borders_css
+                    table_attrs['style'] = table_borders_css
 
 
-def apply_cell_styles(td_tag, cell):
+def apply_cell_styles(td_attrs, tc):
     """
-    Áp dụng border, background... cho <td> hoặc <th> dựa trên cell._element.
+    Áp dụng border, background... cho <td> hoặc <th> (td_attrs: dict thuộc tính của thẻ)
+    dựa trên phần tử w:tc của ô.
     """
-    cellPr = cell._element.find(qn('w:tcPr'))
+    cellPr = tc.find(qn('w:tcPr'))
     if cellPr is None:
         # Không có style
-        td_tag['style'] = td_tag.get('style','') + ' border: 1px solid black;'
+        td_attrs['style'] = td_attrs.get('style','') + ' border: 1px solid black;'
         return
 
     # 1) Border
@@ -212,13 +213,13 @@ def apply_cell_styles(td_tag, cell):
     if tcBorders is not None:
         cell_borders_css = extract_borders(tcBorders, is_table=False)
         if cell_borders_css:
-            if 'style' in td_tag.attrs:
-                td_tag['style'] += ' ' + cell_borders_css
+            if 'style' in td_attrs:
+                td_attrs['style'] += ' ' + cell_borders_css
             else:
-                td_tag['style'] = cell_borders_css
+                td_attrs['style'] = cell_borders_css
     else:
         # Không có border => default
-        td_tag['style'] = td_tag.get('style','') + ' border: 1px solid black;'
+        td_attrs['style'] = td_attrs.get('style','') + ' border: 1px solid black;'
 
     # 2) Background
     tblShd = cellPr.find(qn('w:shd'))
@@ -226,10 +227,10 @@ def apply_cell_styles(td_tag, cell):
         fill = tblShd.get(qn('w:fill'))
         if fill:
             background_color = f'background-color: #{fill};'
-            if 'style' in td_tag.attrs:
-                td_tag['style'] += ' ' + background_color
+            if 'style' in td_attrs:
+                td_attrs['style'] += ' ' + background_color
             else:
-                td_tag['style'] = background_color
+                td_attrs['style'] = background_color
 
 def convert_table_width(table):
     """
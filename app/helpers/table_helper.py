@@ -10,10 +10,180 @@ import json
 def twips_to_pixels(twips):
     return int(twips * (96 / 1440))  # 96 DPI là tiêu chuẩn cho màn hình
 
+def get_cell_properties(tc):
+    """
+    Đọc thuộc tính của một ô từ phần tử w:tc (width, vAlign, borders, gridSpan, vMerge).
+    """
+    cell_prop = {}
+    tc_pr = tc.find(qn('w:tcPr'))
+    if tc_pr is not None:
+        # Chiều rộng ô
+        tc_w = tc_pr.find(qn('w:tcW'))
+        if tc_w is not None:
+            cell_prop['width'] = {
+                'type': tc_w.get(qn('w:type')),
+                'width': twips_to_pixels(int(tc_w.get(qn('w:w'), '0')))
+            }
+        # Căn chỉnh dọc
+        v_align = tc_pr.find(qn('w:vAlign'))
+        if v_align is not None:
+            cell_prop['vertical_alignment'] = v_align.get(qn('w:val'))
+        else:
+            cell_prop['vertical_alignment'] = None
+        # Biên ô
+        cell_borders = tc_pr.find(qn('w:tcBorders'))
+        borders = {}
+        if cell_borders is not None:
+            for border in ['top', 'left', 'bottom', 'right', 'insideH', 'insideV']:
+                element = cell_borders.find(qn(f'w:{border}'))
+                if element is not None:
+                    borders[border] = {
+                        'val': element.get(qn('w:val')),
+                        'sz': element.get(qn('w:sz')),
+                        'color': element.get(qn('w:color')),
+                        'space': element.get(qn('w:space')),
+                        'shadow': element.get(qn('w:shadow'))
+                    }
+        cell_prop['borders'] = borders
+        # Hợp nhất ô
+        grid_span = tc_pr.find(qn('w:gridSpan'))
+        if grid_span is not None:
+            cell_prop['grid_span'] = int(grid_span.get(qn('w:val'), '1'))
+        else:
+            cell_prop['grid_span'] = 1
+        v_merge = tc_pr.find(qn('w:vMerge'))
+        if v_merge is not None:
+            v_merge_val = v_merge.get(qn('w:val'))
+            cell_prop['v_merge'] = v_merge_val if v_merge_val else 'continue'
+        else:
+            cell_prop['v_merge'] = None
+        # Bạn có thể thêm xử lý các thuộc tính khác như shading, noWrap, etc. ở đây
+    return cell_prop
+
+
+_TR = qn('w:tr')
+_TC = qn('w:tc')
+_TR_PR = qn('w:trPr')
+_TC_PR = qn('w:tcPr')
+_VAL = qn('w:val')
+
+
+class GridCell:
+    """
+    Một ô thực sự được hiển thị (w:tc gốc) trong lưới của bảng.
+    Ô vMerge="continue" không có GridCell riêng mà được cộng vào rowspan của ô gốc phía trên.
+    """
+    __slots__ = ('tc', 'row', 'col', 'colspan', 'rowspan', 'properties')
+
+    def __init__(self, tc, row, col, colspan, properties):
+        self.tc = tc
+        self.row = row
+        self.col = col
+        self.colspan = colspan
+        self.rowspan = 1
+        self.properties = properties
+
+
+class TableGrid:
+    """
+    Mô hình lưới của một w:tbl, dựng trong MỘT lần duyệt XML:
+    - column_widths: chiều rộng từng cột lưới (px hoặc None), từ w:tblGrid
+    - row_elements / row_heights / row_height_rules: w:tr, chiều cao (px hoặc None), hRule của từng hàng
+    - rows: với mỗi hàng, danh sách GridCell cần hiển thị, đã có sẵn colspan/rowspan
+    - coverage: với mỗi hàng, GridCell phủ từng vị trí lưới (giống row.cells của python-docx:
+      ô gridSpan lặp lại, ô vMerge="continue" trỏ về ô gốc)
+
+    Thay cho việc đọc table.rows/row.cells (python-docx tính lại cả lưới mỗi lần)
+    và quét các hàng phía dưới để tính rowspan.
+    """
+
+    def __init__(self, tbl):
+        # tbl: phần tử w:tbl hoặc docx.table.Table
+        self.tbl = getattr(tbl, '_element', tbl)
+        self.column_widths = []
+        self.row_elements = []
+        self.row_heights = []
+        self.row_height_rules = []
+        self.rows = []
+        self.coverage = []
+        self._build()
+
+    def _build(self):
+        for grid_col in self.tbl.iterfind(f'{qn("w:tblGrid")}/{qn("w:gridCol")}'):
+            width = int(grid_col.get(qn('w:w'), '0') or 0)
+            self.column_widths.append(twips_to_pixels(width) if width else None)
+
+        above = {}  # grid offset -> GridCell của hàng trước tại vị trí đó
+        for row_index, tr in enumerate(self.tbl.iterchildren(_TR)):
+            trPr = tr.find(_TR_PR)
+            offset = 0
+            height = None
+            height_rule = None
+            if trPr is not None:
+                gridBefore = trPr.find(qn('w:gridBefore'))
+                if gridBefore is not None:
+                    offset = int(gridBefore.get(_VAL, '0'))
+                trHeight = trPr.find(qn('w:trHeight'))
+                if trHeight is not None and int(trHeight.get(_VAL, '0')):
+                    height = twips_to_pixels(int(trHeight.get(_VAL)))
+                    height_rule = trHeight.get(qn('w:hRule'))
+
+            cells = []
+            covered = []
+            current = {}
+            for tc in tr.iterchildren(_TC):
+                tcPr = tc.find(_TC_PR)
+                span = 1
+                v_merge = None
+                if tcPr is not None:
+                    gridSpan = tcPr.find(qn('w:gridSpan'))
+                    if gridSpan is not None:
+                        span = int(gridSpan.get(_VAL, '1'))
+                    vMerge = tcPr.find(qn('w:vMerge'))
+                    if vMerge is not None:
+                        v_merge = vMerge.get(_VAL) or 'continue'
+
+                root = above.get(offset) if v_merge == 'continue' else None
+                if root is not None:
+                    # Ô nối tiếp theo chiều dọc => tăng rowspan của ô gốc
+                    root.rowspan += 1
+                else:
+                    root = GridCell(tc, row_index, offset, span, get_cell_properties(tc))
+                    cells.append(root)
+
+                covered.extend([root] * root.colspan)
+                current[offset] = root
+                offset += span
+
+            above = current
+            self.row_elements.append(tr)
+            self.row_heights.append(height)
+            self.row_height_rules.append(height_rule)
+            self.rows.append(cells)
+            self.coverage.append(covered)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def cells_properties(self):
+        """Thuộc tính ô theo từng vị trí lưới của mỗi hàng (định dạng cũ của TableHelper)."""
+        return [[cell.properties for cell in covered] for covered in self.coverage]
+
+
 class TableHelper:
     def __init__(self, table):
+        # table: docx.table.Table hoặc phần tử w:tbl (engine lxml)
         self.table = table
-        self.tbl_pr = table._element.tblPr  # Truy cập phần tblPr trong XML
+        self.tbl = getattr(table, '_element', table)
+        self.tbl_pr = self.tbl.find(qn('w:tblPr'))  # Truy cập phần tblPr trong XML
+        self._grid = None
+
+    @property
+    def grid(self):
+        """TableGrid của bảng, dựng một lần khi cần."""
+        if self._grid is None:
+            self._grid = TableGrid(self.tbl)
+        return self._grid
 
     def get_alignment(self):
         jc = self.tbl_pr.find(qn('w:jc'))
@@ -77,80 +247,16 @@ class TableHelper:
         return look
 
     def get_columns_width(self):
-        columns = []
-        for col in self.table.columns:
-            width = col.width
-            if width:
-                columns.append(twips_to_pixels(width.twips))
-            else:
-                columns.append(None)
-        return columns
+        return list(self.grid.column_widths)
 
     def get_rows_height(self):
-        rows = []
-        for row in self.table.rows:
-            height = row.height
-            if height:
-                height_pixels = twips_to_pixels(height.twips)
-                height_rule = row.height_rule
-                rows.append({'height': height_pixels, 'height_rule': height_rule})
-            else:
-                rows.append({'height': None, 'height_rule': None})
-        return rows
+        return [
+            {'height': height, 'height_rule': height_rule}
+            for height, height_rule in zip(self.grid.row_heights, self.grid.row_height_rules)
+        ]
 
     def get_cells_properties(self):
-        cells_props = []
-        for row in self.table.rows:
-            row_props = []
-            for cell in row.cells:
-                cell_prop = {}
-                tc = cell._element  # Đã là CT_Tc
-                tc_pr = tc.find(qn('w:tcPr'))
-                if tc_pr is not None:
-                    # Chiều rộng ô
-                    tc_w = tc_pr.find(qn('w:tcW'))
-                    if tc_w is not None:
-                        cell_prop['width'] = {
-                            'type': tc_w.get(qn('w:type')),
-                            'width': twips_to_pixels(int(tc_w.get(qn('w:w'), '0')))
-                        }
-                    # Căn chỉnh dọc
-                    v_align = tc_pr.find(qn('w:vAlign'))
-                    if v_align is not None:
-                        cell_prop['vertical_alignment'] = v_align.get(qn('w:val'))
-                    else:
-                        cell_prop['vertical_alignment'] = None
-                    # Biên ô
-                    cell_borders = tc_pr.find(qn('w:tcBorders'))
-                    borders = {}
-                    if cell_borders is not None:
-                        for border in ['top', 'left', 'bottom', 'right', 'insideH', 'insideV']:
-                            element = cell_borders.find(qn(f'w:{border}'))
-                            if element is not None:
-                                borders[border] = {
-                                    'val': element.get(qn('w:val')),
-                                    'sz': element.get(qn('w:sz')),
-                                    'color': element.get(qn('w:color')),
-                                    'space': element.get(qn('w:space')),
-                                    'shadow': element.get(qn('w:shadow'))
-                                }
-                    cell_prop['borders'] = borders
-                    # Hợp nhất ô
-                    grid_span = tc_pr.find(qn('w:gridSpan'))
-                    if grid_span is not None:
-                        cell_prop['grid_span'] = int(grid_span.get(qn('w:val'), '1'))
-                    else:
-                        cell_prop['grid_span'] = 1
-                    v_merge = tc_pr.find(qn('w:vMerge'))
-                    if v_merge is not None:
-                        v_merge_val = v_merge.get(qn('w:val'))
-                        cell_prop['v_merge'] = v_merge_val if v_merge_val else 'continue'
-                    else:
-                        cell_prop['v_merge'] = None
-                    # Bạn có thể thêm xử lý các thuộc tính khác như shading, noWrap, etc. ở đây
-                row_props.append(cell_prop)
-            cells_props.append(row_props)
-        return cells_props
+        return self.grid.cells_properties()
 
     def get_all_properties(self):
         return {
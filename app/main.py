@@ -1,5 +1,10 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from app.config import settings
+from app.helpers.executors import ExecutorSaturated, executor_stats, shutdown_executors
+from app.helpers.docx_limits import DocumentTooLarge
+from app.helpers.server_timing import ServerTimingMiddleware
 from app.controllers.item_controller import router as item_router
 from app.controllers.qr_controller import router as qr_router
 from app.controllers.process_file_controller import router as process_file_router
@@ -17,11 +22,41 @@ app.add_middleware(
     allow_headers=["*"],  # Hoặc thay "*" bằng danh sách các header được phép như ["Content-Type", "Authorization"]
 )
 
+# Header Server-Timing: thời gian từng giai đoạn (load DOCX, bảng, LibreOffice, Gemini...) của request
+if settings.SERVER_TIMING_ENABLED:
+    app.add_middleware(ServerTimingMiddleware)
+
 # Đăng ký router cho các API
 app.include_router(item_router, prefix="/items", tags=["Items"])
 app.include_router(qr_router, prefix="/qr", tags=["QR Codes"])
 app.include_router(process_file_router, prefix="/process", tags=["Process Files Gemini"])
 
+# Hàng đợi executor đầy => 503 để client/load balancer thử lại sau
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Máy chủ đang quá tải, vui lòng thử lại sau."},
+        headers={"Retry-After": "5"},
+    )
+
+# Tài liệu vượt giới hạn của chế độ bounded => 413, báo rõ part nào vượt
+@app.exception_handler(DocumentTooLarge)
+async def document_too_large_handler(request: Request, exc: DocumentTooLarge):
+    return JSONResponse(
+        status_code=413,
+        content={"detail": f"Tài liệu quá lớn: {exc}", "part": exc.part, "size": exc.size, "limit": exc.limit},
+    )
+
+@app.on_event("shutdown")
+def on_shutdown():
+    shutdown_executors()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to FastAPI Project"}
+
+@app.get("/health")
+async def health():
+    # Chạy ngay trên event loop, không qua executor => vẫn trả lời khi đang chuyển đổi file lớn
+    return {"status": "ok", "executors": executor_stats()}
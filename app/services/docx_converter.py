@@ -1,18 +1,24 @@
 # services/docx_converter.py
 
 import uuid
+import html
+import json
+import hashlib
 from docx import Document
 from docx.text.paragraph import Paragraph
-from docx.table import Table
+from docx.table import Table, _Cell
 from docx.oxml.ns import qn
-from docx.enum.style import WD_STYLE_TYPE
 import base64
-from docx.shared import RGBColor
 from bs4 import BeautifulSoup
 import re
-from docx.image.exceptions import UnrecognizedImageError
 import logging
 from app.helpers.table_helper import TableHelper
+from app.helpers.style_resolver import StyleResolver
+from app.helpers.html_writer import HtmlWriter, SoupWriter
+from app.helpers.conversion_cache import ConversionCache
+from app.helpers.placeholder_ids import placeholder_id
+from app.helpers.style_classes import StyleClasses
+from app.helpers.server_timing import span
 from lxml import etree
 from app.helpers.table_converter_helper import apply_table_styles, apply_cell_styles, twips_to_pixels
 
@@ -27,12 +33,11 @@ def twips_to_pixels(twips):
     """
     return twips * (1 / 20) * 1.333
 
-def is_header_row(row):
+def is_header_row(tr_element):
     """
-    Kiểm tra <w:tblHeader> trong XML của row.
+    Kiểm tra <w:tblHeader> trong XML của row (phần tử w:tr).
     Nếu row có <w:tblHeader>, ta coi row này là header.
     """
-    tr_element = row._element
     trPr = tr_element.find('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}trPr')
     if trPr is not None:
         tblHeader = trPr.find('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}tblHeader')
@@ -40,139 +45,286 @@ def is_header_row(row):
             return True
     return False
 
+# Tăng khi thay đổi làm output HTML khác đi, để cache kết quả cũ không còn được dùng
+CONVERTER_VERSION = "6"
+
+A_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+R_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+V_NS = 'urn:schemas-microsoft-com:vml'
+MC_NS = 'http://schemas.openxmlformats.org/markup-compatibility/2006'
+
+# Ảnh trong run: DrawingML (w:drawing/.../a:blip r:embed) và VML cũ (w:pict/v:imagedata r:id).
+# Bỏ qua mc:Fallback để ảnh có cả hai dạng không bị ghi hai lần.
+_BLIP_EMBED_XPATH = etree.XPath(
+    './/a:blip[not(ancestor::mc:Fallback)]/@r:embed | .//v:imagedata[not(ancestor::mc:Fallback)]/@r:id',
+    namespaces={'a': A_NS, 'r': R_NS, 'v': V_NS, 'mc': MC_NS},
+)
+_HAS_IMAGE_TAGS = (
+    '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}drawing',
+    '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}pict',
+    f'{{{MC_NS}}}AlternateContent',
+)
+
+# CSS chung trong <head> của tài liệu xuất ra
+DOCUMENT_CSS = """
+                body { font-family: Arial, sans-serif; margin: 20px; }
+                h1, h2, h3, h4, h5, h6 { color: #2e6c80; }
+                table, th, td { padding: 20px; text-align: left; }
+                img { max-width: 100%; height: auto; }
+                ul, ol { margin: 0; padding-left: 40px; }
+                td {vertical-align: top;}
+                p { margin: 0 0 1em 0; }
+            """
+
+DOTS_PATTERN = re.compile(r'(\.{3,})')
+UUID_ID_PATTERN = re.compile(r'id="([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})"')
+TAG_PATTERN = re.compile(r'<[^>]+>')
+
+# Làm sạch text của group: ký tự đơn (…, khoảng trắng không ngắt) thay bằng bảng translate,
+# các dạng dấu chấm bị ngắt quãng (". .", ".. ", "./.", "/ ..", ...) thay bằng "..." bằng một regex
+_CLEAN_TEXT_TABLE = str.maketrans({'…': '...', '\xa0': ' '})
+_BROKEN_DOTS_PATTERN = re.compile(r'\. \.|\.\. | \.\.|\./\.|/ \.\.|/\.\.|\./ |/ \.')
+
+
+def clean_text(text):
+    """Chuẩn hoá dấu chấm điền (...) trong text đã escape."""
+    text = text.translate(_CLEAN_TEXT_TABLE)
+    # "..." vừa thay có thể ghép với ký tự kề bên thành mẫu mới (". . ." => "... ." => ".....")
+    # => lặp tới khi không còn mẫu nào (thực tế tối đa 2 lượt)
+    while True:
+        text, count = _BROKEN_DOTS_PATTERN.subn('...', text)
+        if not count:
+            return text
+
+
+class RunGroup:
+    """Các run liền nhau cùng style của một paragraph (xem group_runs_by_style)."""
+    __slots__ = ('style', 'text', 'run', 'images')
+
+    def __init__(self, style, run, images, text=''):
+        self.style = style  # RunStyle (đã intern) hoặc None
+        self.text = text  # Text đã escape và làm sạch
+        self.run = run  # Run đầu tiên của group
+        self.images = images  # rel id các ảnh trong run (group có ảnh chỉ gồm một run)
+
 class DocxToHtmlConverter:
-    def __init__(self, input_path):
-        self.doc = Document(input_path)
+    def __init__(self, input_path, output='soup', compact=False, image_store=None, fragment_cache=None,
+                 ids='random', styles='inline'):
+        """
+        output: 'soup'   => dựng cây BeautifulSoup rồi prettify() (mặc định, giữ output cũ)
+                'string' => HtmlWriter ghi thẳng chuỗi HTML, không dựng cây
+        compact: True => không pretty-print (không thụt lề/xuống dòng)
+        image_store: ImageStore => ảnh được lưu vào kho và <img> tham chiếu bằng URL;
+                     None => nhúng ảnh dạng data URI base64
+        fragment_cache: ConversionCache => chuyển đổi tăng dần: block (w:p, w:tbl) không đổi
+                        dùng lại fragment HTML đã cache (chỉ áp dụng với output='string')
+        ids: 'random' => id placeholder là uuid4, mỗi lần chuyển đổi một khác
+             'stable' => id suy ra từ đường dẫn cấu trúc (block, path), cùng tài liệu
+                         luôn cho cùng HTML (cache/ETag/dedup prompt được)
+        styles: 'inline'  => mỗi thẻ mang nguyên chuỗi style="..."
+                'classes' => mỗi style khác nhau thành một class (s0, s1, ...) khai báo trong
+                             một khối <style>, thẻ chỉ mang class="sN" (HTML ngắn hơn nhiều)
+
+        Sau khi chuyển đổi, self.placeholders là chỉ mục các span dấu chấm (...) theo thứ tự
+        trong tài liệu, mỗi phần tử:
+            {'id', 'block': chỉ số phần tử con của <w:body>,
+             'table': [[row, col], ...] từ bảng ngoài vào bảng trong (None nếu không nằm trong bảng),
+             'label': text ngay trước dấu chấm, 'text_after': text ngay sau, 'dots': số dấu chấm,
+             'path': [paragraph, nhóm run, lần xuất hiện] trong block}
+        """
+        self._init_state(output, compact, image_store, fragment_cache, ids, styles)
+        with span('docx-load'):
+            self.doc = Document(input_path)
+        with span('docx-styles'):
+            self.style_resolver = StyleResolver(self.doc.styles.element)
+
+    def _init_state(self, output, compact, image_store, fragment_cache, ids, styles):
+        """Trạng thái chuyển đổi dùng chung cho mọi engine (không phụ thuộc cách đọc file .docx)."""
+        self.output = output
+        self.compact = compact
+        self.image_store = image_store
+        self.fragment_cache = fragment_cache
+        self.ids = ids
+        self.styles = styles
+        self.style_classes = StyleClasses() if styles == 'classes' else None
+        self._class_style = None
+        self._block_context = None
+        self.placeholders = []
+        self.block_index = None
+        self._paragraph_index = 0
+        self._cell_path = []
         self.soup = BeautifulSoup('<html><head></head><body></body></html>', 'html.parser')
         self.list_stack = []
         self.nsmap = {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}
 
+    # ------------------------------------------------------------------
+    # Truy cập dữ liệu tài liệu (engine python-docx).
+    # Engine lxml (StreamingDocxToHtmlConverter) override các hàm này để đọc
+    # thẳng từ XML mà không cần tạo proxy Paragraph/Table/Run.
+    # ------------------------------------------------------------------
+    def iter_body_elements(self):
+        return self.doc._element.body.iterchildren()
+
+    def make_paragraph(self, element):
+        return Paragraph(element, self.doc)
+
+    def make_table(self, element):
+        return Table(element, self.doc)
+
+    def get_page_margins(self):
+        """
+        Trả về (top, right, bottom, left) theo point của section đầu tiên,
+        hoặc None nếu tài liệu không có section.
+        """
+        if not self.doc.sections:
+            return None
+        first_section = self.doc.sections[0]
+        return (
+            first_section.top_margin.pt,
+            first_section.right_margin.pt,
+            first_section.bottom_margin.pt,
+            first_section.left_margin.pt,
+        )
+
+    def get_image_part(self, rel_id):
+        """Trả về (content_type, blob) của ảnh theo relationship id."""
+        image_part = self.doc.part.related_parts[rel_id]
+        return image_part.content_type, image_part.blob
+
+    def get_paragraph_element(self, paragraph):
+        return paragraph._element
+
+    def get_runs(self, paragraph):
+        return paragraph.runs
+
+    def get_run_element(self, run):
+        return run._element
+
+    def get_run_text(self, run):
+        return run.text
+
+    def get_paragraph_text(self, paragraph):
+        return paragraph.text
+
+    def get_paragraph_format(self, paragraph):
+        """Định dạng hiệu lực (style id, tên style, căn lề) của paragraph, qua StyleResolver."""
+        pPr = self.get_paragraph_element(paragraph).find('w:pPr', namespaces=self.nsmap)
+        return self.style_resolver.resolve_paragraph(pPr)
+
+    def get_paragraph_alignment(self, paragraph):
+        return self.get_paragraph_format(paragraph).alignment
+
+    def get_paragraph_style_name(self, paragraph):
+        return self.get_paragraph_format(paragraph).style_name
+
+    def get_table_element(self, table):
+        return table._element
+
+    def make_cell(self, tc, table):
+        return _Cell(tc, table)
+
+    def get_cell_element(self, cell):
+        return cell._element
+
+    def get_cell_paragraphs(self, cell):
+        return cell.paragraphs
+
+    def get_cell_tables(self, cell):
+        return cell.tables
+
+    def get_styles_fingerprint(self):
+        """SHA-256 của styles.xml, một phần khoá cache fragment."""
+        return hashlib.sha256(etree.tostring(self.doc.styles.element)).hexdigest()
+
+    def get_run_images(self, run):
+        """Danh sách relationship id của các ảnh trong run (rỗng nếu run không có ảnh)."""
+        element = self.get_run_element(run)
+        for child in element:
+            if child.tag in _HAS_IMAGE_TAGS:
+                return _BLIP_EMBED_XPATH(element)
+        return []
+
+    def image_src(self, rel_id):
+        """Giá trị src của <img>: URL trong kho ảnh, hoặc data URI khi không dùng kho."""
+        content_type, blob = self.get_image_part(rel_id)
+        if self.image_store is not None:
+            return self.image_store.put(blob, content_type)
+        b64 = base64.b64encode(blob).decode('utf-8')
+        return f"data:{content_type};base64,{b64}"
+
+    def write_images(self, rel_ids):
+        for rel_id in rel_ids:
+            try:
+                self.out.void('img', {'src': self.image_src(rel_id)})
+            except Exception as e:
+                # Ảnh liên kết ngoài (r:link) hoặc relationship hỏng => bỏ qua ảnh
+                logger.error(f"An error occurred write_images: {e}")
+
+    def styled(self, attrs):
+        """Thuộc tính thẻ theo chế độ styles: 'classes' => style được thay bằng class sinh tự động."""
+        if self.style_classes is None:
+            return attrs
+        return self.style_classes.apply(attrs)
+
     def escape_html(self, text):
         return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;').replace("'", '&#39;')
 
-    def get_style_properties(self, run):
+    def get_style_properties(self, run, paragraph_style_id=None):
+        """
+        Trả về RunStyle (định dạng hiệu lực, đã intern) của run.
+        StyleResolver cache theo w:rPr + paragraph style nên mỗi định dạng chỉ resolve một lần.
+        """
         try:
-            properties = {}
-            font = run.font
-            
-            properties['font_size'] = font.size.pt if font.size else None
-            properties['bold'] = font.bold
-            properties['italic'] = font.italic
-            properties['underline'] = font.underline
-            properties['strikethrough'] = font.strike
-            properties['font_name'] = font.name
-            # properties['font_family'] = font.family
-            properties['small_caps'] = font.small_caps
-            properties['all_caps'] = font.all_caps
-            properties['superscript'] = font.superscript
-            properties['subscript'] = font.subscript
-
-            if font.highlight_color:
-                properties['highlight_color'] = font.highlight_color
-            else:
-                properties['highlight_color'] = None
-
-            if font.color and font.color.rgb:
-                try:
-                    color = font.color.rgb
-                    if isinstance(color, RGBColor) and hasattr(color, 'r') and hasattr(color, 'g') and hasattr(color, 'b'):
-                        rgb_int = (color.r << 16) + (color.g << 8) + color.b
-                        properties['color'] = rgb_int
-                    else:
-                        properties['color'] = None
-                except AttributeError:
-                    properties['color'] = None
-            else:
-                properties['color'] = None
-            return properties
+            rPr = self.get_run_element(run).find('w:rPr', namespaces=self.nsmap)
+            return self.style_resolver.resolve_run(rPr, paragraph_style_id)
         except Exception as e:
             logger.error(f"An error occurred get_style_properties: {e}")
             return None
 
-    def build_style_str(self, style_dict):
+    def group_runs_by_style(self, paragraph):
         """
-        Từ dictionary mô tả style (font_size, bold, italic,...),
-        trả về một chuỗi style hợp lệ (hoặc None nếu không có thuộc tính).
+        Gom các run liền nhau cùng style thành RunGroup.
+        Text của mỗi run được escape một lần, các mảnh được join một lần khi đóng group
+        rồi làm sạch (clean_text) một lần trên text của cả group, nên dấu chấm bị Word
+        tách qua nhiều run vẫn được nối đúng và thời gian tuyến tính theo số run.
         """
-        style_parts = []
-
-        if style_dict.get('font_size'):
-            style_parts.append(f'font-size: {style_dict["font_size"]}pt')
-        if style_dict.get('bold'):
-            style_parts.append('font-weight: bold')
-        if style_dict.get('italic'):
-            style_parts.append('font-style: italic')
-        if style_dict.get('underline'):
-            style_parts.append('text-decoration: underline')
-        if style_dict.get('color'):
-            # color là kiểu int (RGB), format thành hex 6 ký tự
-            style_parts.append(f'color: #{style_dict["color"]:06X}')
-
-        # Nếu không có thuộc tính style nào, trả về None
-        if style_parts:
-            return "; ".join(style_parts)
-        return None
-
-    def group_runs_by_style(self, paragraph):
         try:
-            runs = paragraph.runs
+            runs = self.get_runs(paragraph)
             groups = []
             if not runs:
                 return groups
-            
-            def clean_text(text):
-                """Hàm làm sạch văn bản"""
-                try:
-                    return (
-                        text.replace('…', '...')
-                        .replace(' ', ' ')  # Thay khoảng trắng không phải ASCII bằng khoảng trắng chuẩn
-                        .replace('. .', '...')
-                        .replace('.. ', '...')
-                        .replace(' ..', '...')
-                        .replace('./.', '...')
-                        .replace('/ ..', '...')
-                        .replace('/..', '...')
-                        .replace('./ ', '...')
-                        .replace('/ .', '...')
-                        .replace(' ..', '...')
-                        # .replace('\t', '...')
-                        # .replace('  ', ' ')  # Loại bỏ khoảng trắng thừa
-                        # .strip()  # Xóa khoảng trắng đầu và cuối chuỗi
-                    )
-                except Exception as e:
-                    logger.error(f"An error occurred: {e}")
-                    return text
-
-            current_group = {
-                'style': self.get_style_properties(runs[0]),
-                'text': clean_text(self.escape_html(runs[0].text)),
-                # LƯU LẠI RUN ĐỂ DÙNG Ở convert_paragraph
-                'run': runs[0]
-            }
-            
-            for run in runs[1:]:
-                # Debug tùy ý
-                run_style = self.get_style_properties(run)
-                run_text = clean_text(self.escape_html(run.text))
-
-                # So sánh style cũ với run_style mới
+            paragraph_style_id = self.get_paragraph_format(paragraph).style_id
+
+            current_group = None
+            pieces = []
+            for run in runs:
+                run_style = self.get_style_properties(run, paragraph_style_id)
+                run_text = self.escape_html(self.get_run_text(run))
+                run_images = self.get_run_images(run)
+
+                # So sánh style cũ với run_style mới (RunStyle đã intern => so sánh bằng is)
                 # Nếu cùng style và run_text không chứa \n => gộp
+                # Run có ảnh luôn là một group riêng để giữ đúng vị trí ảnh
                 # Ngược lại => tách group
-                if (run_style == current_group['style']
+                if (current_group is not None
+                    and run_style is current_group.style
                     and '\n' not in run_text
                     and '\r' not in run_text
+                    and not run_images
+                    and not current_group.images
                     ):
-                    current_group['text'] += run_text
-                    current_group['text'] = clean_text(current_group['text'])
-                else:
+                    pieces.append(run_text)
+                    continue
+
+                if current_group is not None:
+                    current_group.text = clean_text(''.join(pieces))
                     groups.append(current_group)
-                    current_group = {
-                        'style': run_style,
-                        'text': run_text,
-                        'run': run
-                    }
+                # Giữ lại run đầu của group để dùng ở convert_paragraph
+                current_group = RunGroup(run_style, run, run_images)
+                pieces = [run_text]
 
             # Append group cuối
+            current_group.text = clean_text(''.join(pieces))
             groups.append(current_group)
 
             return groups
@@ -182,20 +334,25 @@ class DocxToHtmlConverter:
 
     def handle_hyperlinks(self, paragraph, groups):
         try:
-            hyperlinks = paragraph._element.findall('.//w:hyperlink', namespaces=self.nsmap)
+            hyperlinks = self.get_paragraph_element(paragraph).findall('.//w:hyperlink', namespaces=self.nsmap)
             for hyperlink in hyperlinks:
                 runs = hyperlink.findall('.//w:r', namespaces=self.nsmap)
-                text = ''.join([self.escape_html(run.text) for run in runs])
+                text = ''.join([self.escape_html(self.get_run_text(run)) for run in runs])
                 href = hyperlink.get(qn('r:href'))
                 for group in groups:
-                    if group['text'] == text:
-                        group['text'] = f'<a href="{href}">{text}</a>'
+                    if group.text == text:
+                        group.text = f'<a href="{href}">{text}</a>'
             return groups
         except Exception as e:
             logger.error(f"An error occurred handle_hyperlinks: {e}")
             return None
 
     def convert_paragraph(self, paragraph):
+        """Ghi <p> của paragraph vào self.out. Trả về True nếu thành công, None nếu lỗi."""
+        out = self.out
+        mark = out.mark()
+        paragraph_index = self._paragraph_index
+        self._paragraph_index += 1
         try:
             # 1) Gom nhóm runs có cùng style
             groups = self.group_runs_by_style(paragraph)
@@ -203,39 +360,29 @@ class DocxToHtmlConverter:
             # 2) Xử lý hyperlink
             groups = self.handle_hyperlinks(paragraph, groups)
 
-            # Tạo p_tag với text-align
-            p_tag = self.soup.new_tag(
-                'p',
-                style=f'text-align: {paragraph.alignment.name.lower()};'
-                if paragraph.alignment else 'text-align: left;'
-            )
+            # Text và placeholder theo thứ tự ghi ra, để lấy nhãn xung quanh mỗi placeholder
+            segments = []
+
+            # Tạo <p> với text-align
+            out.start('p', self.styled({'style': f'text-align: {self.get_paragraph_alignment(paragraph)};'}))
 
-            for group in groups:
-                if group['text'].strip() == '':
+            occurrence = 0
+            for group_index, group in enumerate(groups):
+                if group.images:
+                    self.write_images(group.images)
+                    if group.text.strip() == '':
+                        continue
+                if group.text.strip() == '':
                     # Nếu nhóm có text trống, chèn <br/>
-                    br_tag = self.soup.new_tag('br')
-                    p_tag.append(br_tag)
+                    out.void('br')
+                    segments.append('\n')
                     continue  # Bỏ qua phần xử lý text
-                # -- Build style_str (giữ nguyên logic cũ) --
-                style_str = []
-                if group['style']['font_size']:
-                    style_str.append(f'font-size: {group["style"]["font_size"]}pt')
-                if group['style']['bold']:
-                    style_str.append('font-weight: bold')
-                if group['style']['italic']:
-                    style_str.append('font-style: italic')
-                if group['style']['underline']:
-                    style_str.append('text-decoration: underline')
-                if group['style']['color']:
-                    style_str.append(f'color: #{group["style"]["color"]:06X}')
-
-                final_style = '; '.join(style_str) if style_str else None
-
-                # if group['text'].strip() == '':
-                #     group['text'] = "\n"
+                # -- Style inline đã được StyleResolver tính sẵn cho mỗi RunStyle --
+                final_style = group.style.css if group.style else None
+                span_attrs = self.styled({'style': final_style}) if final_style else None
 
                 # text ở đây có thể chứa \n hoặc \r (xuống dòng mềm)
-                text = group['text']
+                text = group.text
 
                 # Tách text theo dòng (khi SHIFT+ENTER => Word gộp vào .text có ký tự \n)
                 # splitlines(keepends=False) -> cắt \n, \r\n ra
@@ -243,55 +390,90 @@ class DocxToHtmlConverter:
 
                 # Duyệt từng dòng, với logic regex(\.{3,}) cũ
                 for idx, line_content in enumerate(lines):
-                    # --- Áp regex tìm '...' ---
-                    pattern = r'(\.{3,})'
-                    matches = list(re.finditer(pattern, line_content))
-
                     last_end = 0
 
                     # Tạo 1 <span> cho dòng này
-                    line_span = self.soup.new_tag('span')
-                    if final_style:
-                        line_span['style'] = final_style
+                    out.start('span', span_attrs)
 
-                    for match in matches:
+                    # --- Áp regex tìm '...' ---
+                    for match in DOTS_PATTERN.finditer(line_content):
                         start, end = match.span()
                         if start > last_end:
-                            sub_text = line_content[last_end:start]
-                            line_span.append(sub_text)
-
-                        dots_sub = self.soup.new_tag('span', id=str(uuid.uuid4()))
-                        if final_style:
-                            dots_sub['style'] = final_style
-                        dots_sub.string = match.group(1)
-                        line_span.append(dots_sub)
+                            out.escaped_text(line_content[last_end:start])
+                            segments.append(line_content[last_end:start])
+
+                        dots_path = [paragraph_index, group_index, occurrence]
+                        occurrence += 1
+                        dots_id = placeholder_id(self.ids, self.block_index, *dots_path)
+                        dots_attrs = {'id': dots_id}
+                        if span_attrs:
+                            dots_attrs.update(span_attrs)
+                        out.start('span', dots_attrs)
+                        out.escaped_text(match.group(1))
+                        out.end('span')
+                        segments.append({'id': dots_id, 'dots': len(match.group(1)), 'path': dots_path})
                         last_end = end
 
                     # Đoạn còn lại sau match cuối
                     if last_end < len(line_content):
-                        remaining_text = line_content[last_end:]
-                        line_span.append(remaining_text)
+                        out.escaped_text(line_content[last_end:])
+                        segments.append(line_content[last_end:])
 
-                    # Đưa line_span vào p_tag
-                    p_tag.append(line_span)
+                    out.end('span')
 
                     # Nếu chưa phải dòng cuối => chèn <br> để xuống dòng
                     # (vì SHIFT+ENTER => "xuống dòng mềm" trong cùng paragraph)
                     if idx < len(lines) - 1:
-                        br_tag = self.soup.new_tag('br')
-                        p_tag.append(br_tag)
+                        out.void('br')
+                        segments.append('\n')
 
-            return p_tag
+            out.end('p')
+            self.index_placeholders(segments)
+            return True
 
         except Exception as e:
+            out.rollback(mark)
             logger.error(f"An error occurred convert_paragraph: {e}")
             return None
 
-    
+    def index_placeholders(self, segments):
+        """
+        Thêm các placeholder của một paragraph vào self.placeholders.
+        segments: text (đã escape, có thể chứa thẻ <a>) xen kẽ placeholder {'id', 'dots', 'path'}
+        theo thứ tự ghi ra; '\n' là chỗ xuống dòng (<br>).
+        Nhãn = text từ placeholder trước (hoặc đầu dòng) đến placeholder này, trên cùng một dòng.
+        """
+        def plain_text(parts):
+            return html.unescape(TAG_PATTERN.sub('', ''.join(parts)))
+
+        table = [list(cell) for cell in self._cell_path] or None
+        for i, segment in enumerate(segments):
+            if isinstance(segment, str):
+                continue
+            before = []
+            for part in reversed(segments[:i]):
+                if not isinstance(part, str):
+                    break
+                before.append(part)
+            after = []
+            for part in segments[i + 1:]:
+                if not isinstance(part, str):
+                    break
+                after.append(part)
+            self.placeholders.append({
+                'id': segment['id'],
+                'block': self.block_index,
+                'table': table,
+                'label': plain_text(reversed(before)).split('\n')[-1].strip(),
+                'text_after': plain_text(after).split('\n')[0].strip(),
+                'dots': segment['dots'],
+                'path': segment['path'],
+            })
+
     def is_list_paragraph(self, paragraph):
         try:
-            pPr = paragraph._element.pPr
-            if pPr is not None and pPr.numPr is not None and pPr.numPr.numId is not None:
+            pPr = self.get_paragraph_element(paragraph).find('w:pPr', namespaces=self.nsmap)
+            if pPr is not None and pPr.find('w:numPr/w:numId', namespaces=self.nsmap) is not None:
                 return True
             return False
         except Exception as e:
@@ -301,7 +483,7 @@ class DocxToHtmlConverter:
     def convert_list_item(self, paragraph):
         try:
             li_tag = self.soup.new_tag('li')
-            li_tag.string = paragraph.text
+            li_tag.string = self.get_paragraph_text(paragraph)
             return li_tag
         except Exception as e:
             logger.error(f"An error occurred convert_list_item: {e}")
@@ -322,15 +504,18 @@ class DocxToHtmlConverter:
             return None
 
     def convert_headings(self, paragraph):
+        """Ghi <hN> nếu paragraph dùng style Heading N. Trả về True nếu đã ghi, None nếu không phải heading."""
         try:
-            if paragraph.style and paragraph.style.type == WD_STYLE_TYPE.PARAGRAPH and paragraph.style.name.startswith('Heading'):
+            style_name = self.get_paragraph_style_name(paragraph)
+            if style_name and style_name.startswith('Heading'):
                 # Remove both "Heading " and "#" from the style name
-                heading_level_str = paragraph.style.name.replace('Heading ', '').replace('#', '').strip()
+                heading_level_str = style_name.replace('Heading ', '').replace('#', '').strip()
                 level = int(heading_level_str)
                 heading_tag = f'h{level}'
-                h_tag = self.soup.new_tag(heading_tag)
-                h_tag.string = paragraph.text
-                return h_tag
+                self.out.start(heading_tag)
+                self.out.text(self.get_paragraph_text(paragraph))
+                self.out.end(heading_tag)
+                return True
             return None
         except Exception as e:
             logger.error(f"An error occurred convert_headings: {e}")
@@ -338,28 +523,30 @@ class DocxToHtmlConverter:
 
     def convert_tables(self, table):
         """
-        Chuyển docx.table.Table -> <table> HTML
+        Ghi <table> HTML của bảng vào self.out.
         Tích hợp logic chia thead/tbody (is_header_row),
         in ra tblPr, cell attrs, ...
+        Trả về True nếu thành công, None nếu lỗi (phần đã ghi được huỷ).
         """
+        out = self.out
+        mark = out.mark()
+        placeholder_count = len(self.placeholders)
         try:
-            # 1) Tạo table_tag
-            table_tag = self.soup.new_tag('table')
-
-            # 2) Lấy property bảng bằng TableHelper
-            helper = TableHelper(table)
-            table_props = helper.get_all_properties()
-            alignment = table_props['alignment']
-            allow_autofit = table_props['allow_autofit']
-            table_width_info = table_props['table_width']
-            table_look = table_props['table_look']
-            columns_width = table_props['columns_width']
-            rows_height = table_props['rows_height']
-            cells_properties = table_props['cells_properties']
-
-            # 2.a) Gọi apply_table_styles(table_tag, table._element.tblPr)
-            tblPr = table._element.tblPr
-            apply_table_styles(table_tag, tblPr)
+            # 1) Thuộc tính của <table>
+            table_attrs = {}
+
+            # 2) Lấy property bảng bằng TableHelper, lưới ô dựng một lần bằng TableGrid
+            helper = TableHelper(self.get_table_element(table))
+            alignment = helper.get_alignment()
+            allow_autofit = helper.get_allow_autofit()
+            table_width_info = helper.get_table_width()
+            table_look = helper.get_table_look()
+            grid = helper.grid
+            columns_width = grid.column_widths
+
+            # 2.a) Gọi apply_table_styles(table_attrs, tblPr)
+            tblPr = self.get_table_element(table).find('w:tblPr', namespaces=self.nsmap)
+            apply_table_styles(table_attrs, tblPr)
 
             # 3) Nếu table_width_type = dxa => set width px
             table_width_type = table_width_info.get('type')
@@ -367,226 +554,292 @@ class DocxToHtmlConverter:
             if table_width_type == 'dxa' and table_width_value:
                 table_width_px = twips_to_pixels(table_width_value)
                 # Append vào style
-                table_tag['style'] = (table_tag.get('style','') + f' width: {table_width_px}px;')
+                table_attrs['style'] = (table_attrs.get('style','') + f' width: {table_width_px}px;')
             elif table_width_type == 'pct' and table_width_value:
                 # example
-                table_tag['style'] = (table_tag.get('style','') + ' width: 100%;')
+                table_attrs['style'] = (table_attrs.get('style','') + ' width: 100%;')
             # else: default => do apply_table_styles or existing
 
             # 3.a) set alignment => center, right...
             if alignment == 'center':
-                table_tag['style'] += ' margin-left: auto; margin-right: auto;'
+                table_attrs['style'] += ' margin-left: auto; margin-right: auto;'
             elif alignment in ['right','end']:
-                table_tag['style'] += ' margin-left: auto;'
+                table_attrs['style'] += ' margin-left: auto;'
+
+            # Thêm table-look => class
+            if table_look:
+                look_val = table_look.get('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}val')
+                if look_val:
+                    table_attrs['class'] = f'table-look-{look_val}'
+
+            out.start('table', self.styled(table_attrs))
 
             # 3.b) Xử lý autofit => colgroup
-            if not allow_autofit and columns_width and len(columns_width) > 0:
-                total_width_px = sum(columns_width)
+            if len(grid) and not allow_autofit and columns_width and len(columns_width) > 0:
+                total_width_px = sum(w or 0 for w in columns_width)
                 if total_width_px > 0:
-                    colgroup_tag = self.soup.new_tag('colgroup')
+                    out.start('colgroup')
                     for w in columns_width:
                         pct = (w / total_width_px)*100 if w else 0
-                        col_tag = self.soup.new_tag('col')
-                        col_tag['style'] = f'width:{pct:.2f}%;'
-                        colgroup_tag.append(col_tag)
-                    table_tag.insert(0, colgroup_tag)
+                        out.void('col', self.styled({'style': f'width:{pct:.2f}%;'}))
+                    out.end('colgroup')
 
             # 4) Tách thead/tbody
-            rows = list(table.rows)
-            if not rows:
-                return table_tag
-
             head_rows = []
             body_rows = []
-            for row in rows:
-                if is_header_row(row):
-                    head_rows.append(row)
+            for row_index, tr in enumerate(grid.row_elements):
+                if is_header_row(tr):
+                    head_rows.append(row_index)
                 else:
-                    body_rows.append(row)
+                    body_rows.append(row_index)
 
             # Tạo thead
             if head_rows:
-                thead = self.soup.new_tag('thead')
-                for row in head_rows:
-                    tr_tag = self._convert_row(row, table, cells_properties, rows_height, is_header=True)
-                    thead.append(tr_tag)
-                table_tag.append(thead)
+                out.start('thead')
+                for row_index in head_rows:
+                    self._convert_row(table, grid, row_index, is_header=True)
+                out.end('thead')
 
             # Tạo tbody
             if body_rows:
-                tbody = self.soup.new_tag('tbody')
-                for row in body_rows:
-                    tr_tag = self._convert_row(row, table, cells_properties, rows_height, is_header=False)
-                    tbody.append(tr_tag)
-                table_tag.append(tbody)
-
-            # Thêm table-look => class
-            if table_look:
-                look_val = table_look.get('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}val')
-                if look_val:
-                    table_tag['class'] = f'table-look-{look_val}'
+                out.start('tbody')
+                for row_index in body_rows:
+                    self._convert_row(table, grid, row_index, is_header=False)
+                out.end('tbody')
 
-            return table_tag
+            out.end('table')
+            return True
 
         except Exception as e:
+            out.rollback(mark)
+            del self.placeholders[placeholder_count:]
             logger.error(f"Error in convert_tables: {e}")
             return None
 
 
 
-    def _convert_row(self, row, table, cells_properties, rows_height, is_header=False):
+    def _convert_row(self, table, grid, row_index, is_header=False):
         """
-        row: docx.table._Row
+        Ghi một hàng của TableGrid.
+        colspan/rowspan đã được tính sẵn trong GridCell; ô vMerge="continue" không có GridCell
+        nên không bị ghi ra.
         is_header: True => <th>, False => <td>
         """
-        tr_tag = self.soup.new_tag('tr')
-        row_index = row._index
+        out = self.out
 
         # set row height
-        height_info = rows_height[row_index]
-        if height_info and height_info['height']:
-            tr_tag['style'] = f"height: {height_info['height']}px;"
-
-        num_cells = len(row.cells)
-
-        for col_idx, cell in enumerate(row.cells):
-            cell_info = cells_properties[row_index][col_idx]
-            tag_name = 'th' if is_header else 'td'
-            td_tag = self.soup.new_tag(tag_name)
-
-            # colspan
-            colspan = cell_info.get('grid_span',1)
-            if colspan > 1:
-                td_tag['colspan'] = str(colspan)
-
-            # v_merge => rowspan
-            v_merge = cell_info.get('v_merge')
-            rowspan = 1
-            if v_merge == 'restart':
-                # Tính số row
-                span_count = 1
-                for r2 in range(row_index+1, len(table.rows)):
-                    next_cell_info = cells_properties[r2][col_idx]
-                    if next_cell_info.get('v_merge') == 'continue':
-                        span_count += 1
-                    else:
-                        break
-                if span_count > 1:
-                    td_tag['rowspan'] = str(span_count)
-            elif v_merge == 'continue':
-                # Ẩn ô => skip hiển thị => or style="display:none"
-                # Ở đây ta skip hẳn
-                continue
-
-            # Gán cell style ban đầu => width: X%
-            # (có code chia cột, v.v.)
-            # Hoặc let it auto
-            # => Ta tạm bỏ qua logic percentage row
+        tr_attrs = {}
+        height = grid.row_heights[row_index]
+        if height:
+            tr_attrs['style'] = f"height: {height}px;"
+        out.start('tr', self.styled(tr_attrs))
+
+        tag_name = 'th' if is_header else 'td'
+        for grid_cell in grid.rows[row_index]:
+            td_attrs = {}
+            if grid_cell.colspan > 1:
+                td_attrs['colspan'] = str(grid_cell.colspan)
+            if grid_cell.rowspan > 1:
+                td_attrs['rowspan'] = str(grid_cell.rowspan)
 
             # Gọi apply_cell_styles
-            apply_cell_styles(td_tag, cell)
-
-            # Xử lý nội dung paragraphs
-            for paragraph in cell.paragraphs:
-                p_html = self.convert_paragraph(paragraph)
-                self.append_elements(td_tag, p_html)
-
-            # Xử lý nested table
-            for nested_table in cell.tables:
-                nested_html = self.convert_tables(nested_table)
-                self.append_elements(td_tag, nested_html)
-
-            tr_tag.append(td_tag)
-
-        return tr_tag
-
-        
-    def append_elements(self, parent, elements):
-        try:
-            if elements is None:
-                return  # Không chèn gì nếu elements là None
-
-            if isinstance(elements, list):
-                for el in elements:
-                    if el is not None:
-                        parent.append(el)
-            else:
-                parent.append(elements)
-        except Exception as e:
-            logger.error(f"An error occurred append_elements: {e}")
-            return None
+            apply_cell_styles(td_attrs, grid_cell.tc)
+            out.start(tag_name, self.styled(td_attrs))
+
+            cell = self.make_cell(grid_cell.tc, table)
+
+            # Toạ độ ô (hàng, cột lưới) cho chỉ mục placeholder
+            self._cell_path.append((row_index, grid_cell.col))
+            try:
+                # Xử lý nội dung paragraphs
+                for paragraph in self.get_cell_paragraphs(cell):
+                    self.convert_paragraph(paragraph)
+
+                # Xử lý nested table
+                for nested_table in self.get_cell_tables(cell):
+                    self.convert_tables(nested_table)
+            finally:
+                self._cell_path.pop()
+
+            out.end(tag_name)
+
+        out.end('tr')
+
+    def create_writer(self):
+        """Tạo backend ghi HTML theo self.output ('soup' hoặc 'string') và self.compact."""
+        if self.output == 'string':
+            return HtmlWriter(pretty=not self.compact)
+        return SoupWriter(compact=self.compact)
+
+    def apply_page_margins(self, body, margins):
+        top_pt, right_pt, bottom_pt, left_pt = margins
+
+        # Chuyển points -> px (1 pt ~ 1.3333 px)
+        top_px = int(top_pt * 1.3333)
+        right_px = int(right_pt * 1.3333)
+        bottom_px = int(bottom_pt * 1.3333)
+        left_px = int(left_pt * 1.3333)
+
+        margin = f"margin: {top_px}px {right_px}px {bottom_px}px {left_px}px;"
+        if isinstance(self.out, HtmlWriter) and self.out.is_flushed(body):
+            # Streaming: <body> đã gửi đi trước khi biết lề trang => bổ sung bằng CSS
+            self.out.start('style')
+            self.out.raw(f"body {{ {margin} }}")
+            self.out.end('style')
+            return
+
+        # Gán margin vào body style
+        self.out.set_attribute(body, 'style', margin)
+
+    def render_block(self, element):
+        """Ghi một phần tử con của <w:body> (w:p hoặc w:tbl) vào self.out."""
+        if element.tag == f'{{{self.nsmap["w"]}}}p':
+            with span('docx-paragraphs'):
+                paragraph = self.make_paragraph(element)
+                if not self.convert_headings(paragraph):
+                    self.convert_paragraph(paragraph)
+        elif element.tag == f'{{{self.nsmap["w"]}}}tbl':
+            with span('docx-tables'):
+                table = self.make_table(element)
+                self.convert_tables(table)
+
+    def convert_block(self, element):
+        """
+        Ghi một block, dùng lại fragment HTML đã cache nếu block không đổi
+        (chỉ với output='string' và khi có fragment_cache).
+        """
+        self._paragraph_index = 0
+        if element.tag == f'{{{self.nsmap["w"]}}}p':
+            paragraph = self.make_paragraph(element)
+            if self.is_list_paragraph(paragraph):
+                # List phụ thuộc trạng thái list_stack của các block trước => không cache
+                list_item = self.convert_list_item(paragraph)
+                self.handle_list(list_item)
+                return
+
+        if self.fragment_cache is None or not isinstance(self.out, HtmlWriter):
+            self.render_block(element)
+            return
+
+        key = self.block_key(element)
+        cached = self.fragment_cache.get(key)
+        if cached is not None:
+            self.reuse_fragment(json.loads(cached))
+            return
+
+        mark = self.out.mark()
+        placeholder_count = len(self.placeholders)
+        self.render_block(element)
+        fragment = {'html': self.out.since(mark), 'placeholders': self.placeholders[placeholder_count:]}
+        if self.style_classes is not None:
+            # Tên class đánh số theo tài liệu => lưu kèm css để đổi tên khi dùng lại
+            fragment['classes'] = self.style_classes.used_in(fragment['html'])
+        self.fragment_cache.set(key, json.dumps(fragment, ensure_ascii=False))
+
+    def reuse_fragment(self, fragment):
+        """
+        Ghi fragment đã cache ({'html', 'placeholders'}, kèm 'classes' với styles='classes')
+        và bổ sung chỉ mục placeholder của nó.
+        """
+        # id của placeholder phải duy nhất trong tài liệu và (ids='stable') phụ thuộc vị trí block
+        # => sinh lại khi dùng lại fragment
+        new_ids = {
+            placeholder['id']: placeholder_id(self.ids, self.block_index, *placeholder['path'])
+            for placeholder in fragment['placeholders']
+        }
+        fragment_html = fragment['html']
+        if self.style_classes is not None:
+            fragment_html = self.style_classes.rename(fragment_html, fragment.get('classes'))
+        self.out.fragment(UUID_ID_PATTERN.sub(
+            lambda m: f'id="{new_ids.get(m.group(1)) or uuid.uuid4()}"', fragment_html
+        ))
+        for placeholder in fragment['placeholders']:
+            self.placeholders.append(dict(placeholder, id=new_ids[placeholder['id']], block=self.block_index))
+
+    def block_key(self, element):
+        """
+        Khoá cache của một block: XML của block + ngữ cảnh mà HTML của nó phụ thuộc
+        (styles.xml, kiểu output, chế độ ảnh, chế độ style, nội dung các ảnh được tham chiếu).
+        """
+        if self._block_context is None:
+            image_mode = self.image_store.url_prefix if self.image_store is not None else 'inline'
+            self._block_context = (
+                self.get_styles_fingerprint(), self.output, self.compact, image_mode, self.styles
+            )
+        image_hashes = []
+        for rel_id in _BLIP_EMBED_XPATH(element):
+            try:
+                image_hashes.append(hashlib.sha256(self.get_image_part(rel_id)[1]).hexdigest())
+            except Exception:
+                image_hashes.append(rel_id)
+        return ConversionCache.make_key(
+            etree.tostring(element), CONVERTER_VERSION, *self._block_context, *image_hashes
+        )
+
+    def write_head(self, class_style=True):
+        """
+        Ghi <head> và mở <body> (kèm lề trang nếu đã biết).
+        class_style: với styles='classes', chừa sẵn một <style> trong <head> để điền các class
+        khi chuyển đổi xong (iter_html không dùng vì <head> đã được gửi đi trước).
+        """
+        out = self.out
+        out.start('head')
+        out.void('meta', {'charset': 'UTF-8'})
+        out.start('style')
+        out.raw(DOCUMENT_CSS)
+        out.end('style')
+        if self.style_classes is not None and class_style:
+            self._class_style = out.start('style')
+            out.end('style')
+        out.end('head')
+
+        body = out.start('body')
+        self.body = body
+
+        margins = self.get_page_margins()
+        if margins:
+            self.apply_page_margins(body, margins)
+
+    def iter_html(self):
+        """
+        Sinh HTML theo từng phần: <head> + <body>, rồi HTML của từng block ngay khi
+        chuyển đổi xong, cuối cùng là </body>. Dùng cho StreamingResponse:
+        không giữ toàn bộ HTML trong bộ nhớ. Luôn dùng HtmlWriter (output='string').
+        """
+        out = self.out = HtmlWriter(pretty=not self.compact)
+        self.write_head(class_style=False)
+        yield out.flush()
+
+        for index, element in enumerate(self.iter_body_elements()):
+            self.block_index = index
+            self.convert_block(element)
+            if self.style_classes is not None:
+                # <head> đã gửi => class mới của block được khai báo ngay sau block
+                rules = self.style_classes.take_new()
+                if rules:
+                    out.start('style')
+                    out.raw(rules)
+                    out.end('style')
+            chunk = out.flush()
+            if chunk:
+                yield chunk
+
+        out.end('body')
+        yield out.flush()
 
     def convert_document(self):
         try:
-            html = BeautifulSoup('', 'html.parser')
-            head = html.new_tag('head')
-
-            meta_tag = html.new_tag('meta', charset='UTF-8')
-            head.append(meta_tag)
-
-            style = html.new_tag('style')
-            style.string = """
-                body { font-family: Arial, sans-serif; margin: 20px; }
-                h1, h2, h3, h4, h5, h6 { color: #2e6c80; }
-                table, th, td { padding: 20px; text-align: left; }
-                img { max-width: 100%; height: auto; }
-                ul, ol { margin: 0; padding-left: 40px; }
-                td {vertical-align: top;}
-                p { margin: 0 0 1em 0; }
-            """
-            head.append(style)
-            html.append(head)
-            body = html.new_tag('body')
-            html.append(body)
-
-            if self.doc.sections:
-                first_section = self.doc.sections[0]
-                top_pt = first_section.top_margin.pt
-                right_pt = first_section.right_margin.pt
-                bottom_pt = first_section.bottom_margin.pt
-                left_pt = first_section.left_margin.pt
-
-                # Chuyển points -> px (1 pt ~ 1.3333 px)
-                top_px = int(top_pt * 1.3333)
-                right_px = int(right_pt * 1.3333)
-                bottom_px = int(bottom_pt * 1.3333)
-                left_px = int(left_pt * 1.3333)
-
-                # Gán margin vào body style
-                margin_style = f"margin: {top_px}px {right_px}px {bottom_px}px {left_px}px;"
-                body['style'] = margin_style
-
-            for element in self.doc._element.body.iterchildren():
-                if element.tag == f'{{{self.nsmap["w"]}}}p':
-                    paragraph = Paragraph(element, self.doc)
-                    if self.is_list_paragraph(paragraph):
-                        list_item = self.convert_list_item(paragraph)
-                        self.handle_list(list_item)
-                    else:
-                        heading = self.convert_headings(paragraph)
-                        if heading:
-                            self.append_elements(body, heading)
-                        else:
-                            p_tags = self.convert_paragraph(paragraph)
-                            self.append_elements(body, p_tags)
-                elif element.tag == f'{{{self.nsmap["w"]}}}tbl':
-                    table = Table(element, self.doc)
-                    table_tag = self.convert_tables(table)
-                    self.append_elements(body, table_tag)
-                elif element.tag == f'{{{self.nsmap["w"]}}}drawing':
-                    # Xử lý drawing => image
-                    for inline in element.findall('.//w:inline', namespaces=self.nsmap):
-                        try:
-                            image_part_id = inline.find('.//wp:docPr', namespaces=self.nsmap).get('id')
-                            image_part = self.doc.part.related_parts[image_part_id]
-                            blob = image_part.blob
-                            b64 = base64.b64encode(blob).decode('utf-8')
-                            img_tag = self.soup.new_tag('img', src=f"data:{image_part.content_type};base64,{b64}")
-                            self.append_elements(body, img_tag)
-                        except UnrecognizedImageError:
-                            pass
-
-            return html.prettify()
+            out = self.out = self.create_writer()
+            self.write_head()
+
+            for index, element in enumerate(self.iter_body_elements()):
+                self.block_index = index
+                self.convert_block(element)
+            out.end('body')
+            if self._class_style is not None:
+                out.set_text(self._class_style, self.style_classes.css())
+            with span('docx-serialize'):
+                return out.getvalue()
         except Exception as e:
             logger.error(f"An error occurred convert_document: {e}")
             return None
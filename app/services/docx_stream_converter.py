@@ -0,0 +1,281 @@
+# services/docx_stream_converter.py
+
+import hashlib
+import posixpath
+import zipfile
+import logging
+from lxml import etree
+
+from app.services.docx_converter import DocxToHtmlConverter
+from app.helpers.style_resolver import StyleResolver
+from app.helpers.server_timing import span
+
+logger = logging.getLogger(__name__)
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+R_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CT_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+
+RT_OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+RT_STYLES = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles'
+RT_IMAGE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+
+def w(tag):
+    return f'{{{W_NS}}}{tag}'
+
+
+# Các phần tử con của w:r có text tương đương (giống CT_R.text của python-docx)
+_T, _TAB, _PTAB, _BR, _CR, _NO_BREAK_HYPHEN = (
+    w('t'), w('tab'), w('ptab'), w('br'), w('cr'), w('noBreakHyphen')
+)
+
+def _read_xml(package, name):
+    with package.open(name) as f:
+        return etree.parse(f, etree.XMLParser(remove_blank_text=True, resolve_entities=False)).getroot()
+
+
+def _read_rels(package, part_name):
+    """Đọc file .rels của một part, trả về {rId: (type, target đã chuẩn hoá)}."""
+    base_dir, file_name = posixpath.split(part_name)
+    rels_name = posixpath.join(base_dir, '_rels', f'{file_name}.rels')
+    if rels_name not in package.namelist():
+        return {}
+    rels = {}
+    for rel in _read_xml(package, rels_name).iter(f'{{{PKG_REL_NS}}}Relationship'):
+        target = rel.get('Target')
+        if rel.get('TargetMode') != 'External':
+            target = posixpath.normpath(posixpath.join(base_dir, target)).lstrip('/')
+        rels[rel.get('Id')] = (rel.get('Type'), target)
+    return rels
+
+
+class StreamingDocxToHtmlConverter(DocxToHtmlConverter):
+    """
+    Engine chuyển đổi thứ hai: đọc word/document.xml bằng lxml iterparse,
+    xử lý từng phần tử con của <w:body> rồi giải phóng ngay, không dựng
+    proxy Paragraph/Table/Run của python-docx và không load các part khác
+    (header, footer, media...) khi không cần.
+    Kết quả HTML giống DocxToHtmlConverter.
+    """
+
+    def __init__(self, input_file, output='soup', compact=False, image_store=None, fragment_cache=None,
+                 ids='random', styles='inline', limits=None):
+        # input_file: đường dẫn hoặc file-like (BytesIO) của file .docx
+        # limits: DocxLimits => kiểm tra kích thước các part sẽ đọc trước khi đọc,
+        #         vượt giới hạn thì ném DocumentTooLarge ngay (chế độ giới hạn bộ nhớ)
+        self._init_state(output, compact, image_store, fragment_cache, ids, styles)
+
+        with span('docx-load'):
+            self.package = zipfile.ZipFile(input_file)
+            if limits is not None:
+                self._check_limits(limits)
+            self.document_part = self._find_document_part()
+            self.document_rels = _read_rels(self.package, self.document_part)
+            self.content_types = self._load_content_types()
+        with span('docx-styles'):
+            self.style_resolver = self._load_styles()
+        self.body = None
+        self.page_margins = None
+
+    # ------------------------------------------------------------------
+    # Đọc package
+    # ------------------------------------------------------------------
+    def _check_limits(self, limits):
+        """
+        Chỉ xét các part mà engine này đọc: rels, [Content_Types].xml, document.xml, styles.xml
+        và các ảnh được document.xml tham chiếu. Part khác (header, footer, embeddings,
+        ảnh không dùng...) không bao giờ được đọc nên không bị tính.
+        """
+        limits.check_part(self.package, '[Content_Types].xml')
+        limits.check_part(self.package, '_rels/.rels')
+        document_part = self._find_document_part()
+        base_dir, file_name = posixpath.split(document_part)
+        limits.check_part(self.package, posixpath.join(base_dir, '_rels', f'{file_name}.rels'))
+        limits.check_part(self.package, document_part)
+        document_rels = _read_rels(self.package, document_part)
+        for rel_type, target in document_rels.values():
+            if rel_type == RT_STYLES:
+                limits.check_part(self.package, target)
+        limits.check_media(self.package, [
+            target for rel_type, target in document_rels.values()
+            if rel_type == RT_IMAGE and target in self.package.NameToInfo
+        ])
+
+    def _find_document_part(self):
+        for rel_type, target in _read_rels(self.package, '').values():
+            if rel_type == RT_OFFICE_DOCUMENT:
+                return target
+        return 'word/document.xml'
+
+    def _styles_part(self):
+        styles_part = next(
+            (target for rel_type, target in self.document_rels.values() if rel_type == RT_STYLES),
+            None,
+        )
+        if styles_part is None or styles_part not in self.package.namelist():
+            return None
+        return styles_part
+
+    def _load_styles(self):
+        """Đọc styles.xml (nếu có) để dựng StyleResolver."""
+        styles_part = self._styles_part()
+        if styles_part is None:
+            return StyleResolver()
+        return StyleResolver(_read_xml(self.package, styles_part))
+
+    def get_styles_fingerprint(self):
+        styles_part = self._styles_part()
+        if styles_part is None:
+            return None
+        return hashlib.sha256(self.package.read(styles_part)).hexdigest()
+
+    def _load_content_types(self):
+        defaults, overrides = {}, {}
+        root = _read_xml(self.package, '[Content_Types].xml')
+        for element in root.iterfind(f'{{{CT_NS}}}Default'):
+            defaults[element.get('Extension').lower()] = element.get('ContentType')
+        for element in root.iterfind(f'{{{CT_NS}}}Override'):
+            overrides[element.get('PartName').lstrip('/')] = element.get('ContentType')
+        return defaults, overrides
+
+    def _content_type(self, part_name):
+        defaults, overrides = self.content_types
+        if part_name in overrides:
+            return overrides[part_name]
+        return defaults.get(posixpath.splitext(part_name)[1].lstrip('.').lower())
+
+    # ------------------------------------------------------------------
+    # Truy cập dữ liệu tài liệu (engine lxml)
+    # ------------------------------------------------------------------
+    def iter_body_elements(self):
+        """
+        Duyệt các phần tử con trực tiếp của <w:body> bằng iterparse.
+        Mỗi phần tử được xoá khỏi cây ngay sau khi xử lý xong để giữ bộ nhớ ổn định.
+        """
+        body_tag = w('body')
+        with self.package.open(self.document_part) as f:
+            context = etree.iterparse(
+                f, events=('start', 'end'), remove_blank_text=True, resolve_entities=False, huge_tree=True
+            )
+            depth = 0
+            for event, element in context:
+                if event == 'start':
+                    depth += 1
+                    continue
+                depth -= 1
+                # document (0) > body (1) > phần tử cần xử lý (2)
+                if depth != 2 or element.getparent() is None or element.getparent().tag != body_tag:
+                    continue
+                self._detect_section(element)
+                yield element
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+    def _detect_section(self, element):
+        """Ghi nhận sectPr đầu tiên (theo thứ tự tài liệu) để lấy lề trang."""
+        if self.page_margins is not None:
+            return
+        if element.tag == w('sectPr'):
+            sectPr = element
+        elif element.tag == w('p'):
+            sectPr = element.find(f'{w("pPr")}/{w("sectPr")}')
+        else:
+            sectPr = None
+        if sectPr is None:
+            return
+        pgMar = sectPr.find(w('pgMar'))
+        if pgMar is None:
+            return
+        try:
+            # pgMar tính theo twips, 1pt = 20 twips
+            self.page_margins = tuple(
+                int(pgMar.get(w(side), '0')) / 20 for side in ('top', 'right', 'bottom', 'left')
+            )
+        except ValueError:
+            return
+        if self.body is not None:
+            self.apply_page_margins(self.body, self.page_margins)
+
+    def make_paragraph(self, element):
+        return element
+
+    def make_table(self, element):
+        return element
+
+    def get_page_margins(self):
+        # sectPr nằm cuối document.xml nên lề trang được gán khi iterparse gặp nó
+        return None
+
+    def get_image_part(self, rel_id):
+        _, target = self.document_rels[rel_id]
+        return self._content_type(target), self.package.read(target)
+
+    def get_paragraph_element(self, paragraph):
+        return paragraph
+
+    def get_runs(self, paragraph):
+        return paragraph.findall(w('r'))
+
+    def get_run_element(self, run):
+        return run
+
+    def get_run_text(self, run):
+        parts = []
+        for child in run:
+            tag = child.tag
+            if tag == _T:
+                parts.append(child.text or '')
+            elif tag == _TAB or tag == _PTAB:
+                parts.append('\t')
+            elif tag == _BR:
+                if child.get(w('type'), 'textWrapping') == 'textWrapping':
+                    parts.append('\n')
+            elif tag == _CR:
+                parts.append('\n')
+            elif tag == _NO_BREAK_HYPHEN:
+                parts.append('-')
+        return ''.join(parts)
+
+    def get_paragraph_text(self, paragraph):
+        texts = []
+        for child in paragraph:
+            if child.tag == w('r'):
+                texts.append(self.get_run_text(child))
+            elif child.tag == w('hyperlink'):
+                texts.extend(self.get_run_text(run) for run in child.iterfind(w('r')))
+        return ''.join(texts)
+
+    def get_table_element(self, table):
+        return table
+
+    def make_cell(self, tc, table):
+        return tc
+
+    def get_cell_element(self, cell):
+        return cell
+
+    def get_cell_paragraphs(self, cell):
+        return cell.findall(w('p'))
+
+    def get_cell_tables(self, cell):
+        return cell.findall(w('tbl'))
+
+    def convert_document(self):
+        try:
+            # Lề trang chỉ biết được khi iterparse tới sectPr, convert_document giữ
+            # tham chiếu self.body để gán style khi gặp (xem _detect_section).
+            self.page_margins = None
+            return super().convert_document()
+        finally:
+            self.package.close()
+
+    def iter_html(self):
+        try:
+            self.page_margins = None
+            yield from super().iter_html()
+        finally:
+            self.package.close()
+
@@ -1,15 +1,20 @@
 # fastapi_project/app/services/html_to_json_service.py
 
-import google.generativeai as genai
 import json
 import re  # Import the re module for regular expressions
 from typing import Optional, List, Dict
 from ..config import settings  # Ensure settings are imported correctly
 import logging
+import asyncio
 import uuid
 from bs4 import BeautifulSoup
-import concurrent.futures
 from bs4 import NavigableString
+from app.helpers.placeholder_ids import placeholder_id
+from app.helpers.html_chunk_splitter import HtmlChunkSplitter, estimate_tokens
+from app.helpers.html_minifier import HtmlMinifier, minify_html
+from app.helpers.field_rules import FieldRuleExtractor
+from app.helpers.server_timing import span
+from app.helpers.llm_client import get_llm_client, response_text, LLMTimeout
 
 logger = logging.getLogger(__name__)
 
@@ -34,50 +39,27 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def split_body_into_chunks(html, max_length=3000):
+# Khung cho chunk HTML đã rút gọn (không kèm CSS của HTML_TEMPLATE)
+MINIFIED_HTML_TEMPLATE = "<html><body>{content}</body></html>"
+
+def split_body_into_chunks(html, max_tokens=3000, template=HTML_TEMPLATE):
         """
-        Chia nội dung trong thẻ body của HTML thành các chunk không vượt quá max_length ký tự.
-        Nếu một phần tử đơn lẻ vượt quá max_length thì sẽ được chia nhỏ.
+        Chia nội dung trong thẻ body của HTML thành các chunk không vượt quá max_tokens token (ước lượng).
+        Chỉ cắt ở ranh giới phần tử nên mỗi chunk đều là HTML trọn vẹn; phần tử đơn lẻ quá lớn
+        (bảng, hàng, đoạn văn...) được chia đệ quy theo các phần tử con (xem HtmlChunkSplitter).
         """
         print("start split_body_into_chunks")
         soup = BeautifulSoup(html, 'html.parser')
         body = soup.body
         if body is None:
             raise ValueError("Không tìm thấy thẻ <body> trong HTML.")
-        
-        # Lấy danh sách các phần tử con trực tiếp của body
-        children = list(body.children)
-        chunks = []
-        current_chunk = ""
-        
-        for child in children:
-            # Chuyển đổi phần tử sang chuỗi HTML
-            child_str = str(child)
-            # Nếu thêm child này sẽ vượt quá max_length:
-            if len(current_chunk) + len(child_str) > max_length:
-                # Nếu current_chunk không rỗng, lưu chunk hiện tại lại
-                if current_chunk:
-                    chunks.append(current_chunk)
-                    current_chunk = ""
-                
-                # Nếu child_str đơn lẻ vượt quá max_length, cần tách nó thành các phần nhỏ hơn.
-                if len(child_str) > max_length:
-                    for i in range(0, len(child_str), max_length):
-                        sub_chunk = child_str[i:i+max_length]
-                        chunks.append(sub_chunk)
-                else:
-                    # Nếu child_str không vượt quá max_length, gán nó cho current_chunk (khởi đầu chunk mới)
-                    current_chunk = child_str
-            else:
-                # Nếu không vượt quá, thêm child_str vào current_chunk
-                current_chunk += child_str
-        
-        # Sau vòng lặp, nếu còn dư thì thêm vào danh sách chunks
-        if current_chunk:
-            chunks.append(current_chunk)
-        
+
+        # Gom các phần tử con trực tiếp của body thành các chunk đầy nhất có thể
+        splitter = HtmlChunkSplitter(max_length=max_tokens, measure=estimate_tokens)
+        chunks = splitter.pack_siblings(body.children)
+
         # Bọc mỗi chunk vào mẫu HTML hoàn chỉnh
-        final_pages = [HTML_TEMPLATE.format(content=chunk) for chunk in chunks]
+        final_pages = [template.format(content=chunk) for chunk in chunks]
         # print("chunks len",len(chunks))
         print("end split_body_into_chunks")
         return final_pages
@@ -96,23 +78,106 @@ class HtmlToJsonService:
     def __init__(self):
         print("Initializing HtmlToJsonService...")
         print("API Key:", settings.GOOGLE_GENERATIVE_AI_API_KEY)
-        self.max_chunk_length = 25000
-        # Configure API Key for Google Generative AI
-        genai.configure(api_key=settings.GOOGLE_GENERATIVE_AI_API_KEY)
+        # Giới hạn kích thước HTML gửi trong một lời gọi, tính theo token ước lượng
+        self.max_chunk_tokens = settings.GEMINI_CHUNK_MAX_TOKENS
+        # Client Gemini bất đồng bộ (cấu hình API Key cho Google Generative AI)
+        self.llm = get_llm_client()
 
-    def convert_html_to_json(self, html_content: str) -> Optional[List[Dict]]:
+    async def convert_html_to_json(self, html_content: str) -> Optional[List[Dict]]:
         """
         Chia nội dung HTML thành các chunk, sau đó với mỗi chunk gọi API của Google Generative AI
         để trích xuất các trường dữ liệu. Các kết quả JSON thu được từ từng chunk sẽ được gom lại.
+        Trước đó FieldRuleExtractor gán nhãn các placeholder theo mẫu câu quen thuộc; chỉ phần
+        HTML chứa placeholder còn lại được gửi cho Gemini (không còn thì không gọi API).
         """
         try:
-            # Tách nội dung HTML thành các chunk
-            chunks = split_body_into_chunks(html_content, max_length=self.max_chunk_length)
-            extracted_jsons = []
+            extractor = None
+            rule_fields = []
+            if settings.FIELD_RULES_ENABLED:
+                with span("field-rules"):
+                    extractor = FieldRuleExtractor(html_content)
+                    rule_fields = extractor.extract()
+                total = len(extractor.position)
+                if not total:
+                    # Không có placeholder nào: gửi cả tài liệu như trước
+                    extractor = None
+                elif not extractor.unresolved:
+                    logger.info(f"All {total} placeholders resolved by rules, Gemini not called.")
+                    return combine_nested_lists([rule_fields])
+                else:
+                    logger.info(f"{len(extractor.unresolved)}/{total} placeholders left for Gemini.")
+                    html_content = extractor.unresolved_html()
+
+            # Tách nội dung HTML thành các chunk; kết quả trích xuất tham chiếu theo id placeholder
+            # nên gửi bản rút gọn không cần ánh xạ ngược
+            with span("html-split"):
+                if settings.GEMINI_MINIFY_HTML:
+                    chunks = split_body_into_chunks(
+                        minify_html(html_content), max_tokens=self.max_chunk_tokens, template=MINIFIED_HTML_TEMPLATE
+                    )
+                else:
+                    chunks = split_body_into_chunks(html_content, max_tokens=self.max_chunk_tokens)
+
+            # Gọi Gemini song song (tối đa GEMINI_CHUNK_CONCURRENCY chunk cùng lúc),
+            # gather trả kết quả theo thứ tự chunk ban đầu
+            semaphore = asyncio.Semaphore(settings.GEMINI_CHUNK_CONCURRENCY)
+
+            async def extract(chunk_idx, chunk):
+                async with semaphore:
+                    return await self.extract_chunk_fields_with_retry(chunk_idx, chunk)
+
+            chunk_results = await asyncio.gather(
+                *(extract(chunk_idx, chunk) for chunk_idx, chunk in enumerate(chunks))
+            )
+
+            extracted_jsons = [
+                json_data for result in chunk_results if result for json_data in result
+            ]
+            if extractor is not None:
+                # Gemini thấy cả placeholder đã có nhãn trong phần ngữ cảnh => bỏ trùng, xếp theo tài liệu
+                llm_fields = extractor.drop_resolved(combine_nested_lists(extracted_jsons)[0])
+                if not llm_fields:
+                    logger.error("No valid JSON data extracted for the placeholders left by the rules.")
+                    if not rule_fields:
+                        return None
+                return combine_nested_lists([sorted(rule_fields + llm_fields, key=extractor.sort_key)])
+            if not extracted_jsons:
+                logger.error("No valid JSON data extracted from any chunk.")
+                return None
+            
+            return combine_nested_lists(extracted_jsons)
             
-            for chunk_idx, chunk in enumerate(chunks):
-                # Xây dựng prompt cho từng chunk HTML
-                prompt = f"""
+        except Exception as e:
+            logger.error(f"An error occurred in convert_html_to_json: {e}")
+            return None
+
+    async def extract_chunk_fields_with_retry(self, chunk_idx: int, chunk: str) -> Optional[List]:
+        """
+        Gọi extract_chunk_fields cho một chunk, lỗi thì thử lại riêng chunk đó
+        (tối đa GEMINI_CHUNK_RETRIES lần, chờ GEMINI_RETRY_BACKOFF * 2^n giây giữa các lần).
+        Hết lượt thử => bỏ qua chunk (trả về None), các chunk khác vẫn được dùng.
+        """
+        attempts = settings.GEMINI_CHUNK_RETRIES + 1
+        for attempt in range(attempts):
+            try:
+                return await self.extract_chunk_fields(chunk_idx, chunk)
+            except Exception as e:
+                if attempt + 1 >= attempts:
+                    logger.error(f"Chunk {chunk_idx} failed after {attempts} attempts: {e}")
+                    return None
+                delay = settings.GEMINI_RETRY_BACKOFF * (2 ** attempt)
+                logger.warning(f"Chunk {chunk_idx} failed (attempt {attempt + 1}/{attempts}): {e}. Retrying in {delay}s.")
+                await asyncio.sleep(delay)
+
+    async def extract_chunk_fields(self, chunk_idx: int, chunk: str) -> List:
+        """
+        Gọi Gemini trích xuất các trường dữ liệu của một chunk HTML.
+        Trả về danh sách các khối JSON theo thứ tự candidate/part/block.
+        Ném ValueError khi response không có candidates hoặc JSON không hợp lệ,
+        LLMTimeout khi quá deadline (để thử lại).
+        """
+        # Xây dựng prompt cho chunk HTML
+        prompt = f"""
     You are an AI expert in form data extraction. Given an HTML document (converted from DOCX), identify all fields for user input by locating `<span>` elements with a unique `id` (UUID).
 
     Goal: Generate a JSON array representing these fields so that the JSON alone conveys the original context (labels) for data entry.
@@ -154,51 +219,42 @@ class HtmlToJsonService:
 
     (Big Note: Do not convert id values to snake_case.)
                 """
-                
-                # Gọi API của Google Generative AI cho chunk hiện tại
-                model = genai.GenerativeModel("gemini-1.5-flash")
-                response = model.generate_content(prompt)
-                logger.info(f"Response from API for chunk {chunk_idx}: {response}")
-                
-                if not hasattr(response, 'candidates'):
-                    logger.error(f"No candidates found in the response for chunk {chunk_idx}.")
+
+        # Gọi API của Google Generative AI cho chunk
+        response = await self.llm.generate(prompt, "gemini-1.5-flash")
+        logger.info(f"Response from API for chunk {chunk_idx}: {response}")
+
+        if not hasattr(response, 'candidates'):
+            raise ValueError(f"No candidates found in the response for chunk {chunk_idx}.")
+
+        extracted_jsons = []
+        for candidate_idx, candidate in enumerate(response.candidates):
+            if not hasattr(candidate, 'content') or not hasattr(candidate.content, 'parts'):
+                logger.warning(f"No content parts found in candidate {candidate_idx} for chunk {chunk_idx}.")
+                continue
+
+            parts = candidate.content.parts
+            for part_idx, part in enumerate(parts):
+                text = part.text.strip()
+                logger.debug(f"Chunk {chunk_idx}, Candidate {candidate_idx}, Part {part_idx} Text: {text}")
+
+                # Dùng regex để trích xuất JSON được bọc trong ```json ... ```
+                json_blocks = re.findall(r'```json\s*(.*?)\s*```', text, re.DOTALL)
+                if not json_blocks:
+                    logger.warning(f"No JSON block found in candidate {candidate_idx}, part {part_idx} for chunk {chunk_idx}.")
                     continue
-                
-                for candidate_idx, candidate in enumerate(response.candidates):
-                    if not hasattr(candidate, 'content') or not hasattr(candidate.content, 'parts'):
-                        logger.warning(f"No content parts found in candidate {candidate_idx} for chunk {chunk_idx}.")
-                        continue
-                    
-                    parts = candidate.content.parts
-                    for part_idx, part in enumerate(parts):
-                        text = part.text.strip()
-                        logger.debug(f"Chunk {chunk_idx}, Candidate {candidate_idx}, Part {part_idx} Text: {text}")
-                        
-                        # Dùng regex để trích xuất JSON được bọc trong ```json ... ```
-                        json_blocks = re.findall(r'```json\s*(.*?)\s*```', text, re.DOTALL)
-                        if not json_blocks:
-                            logger.warning(f"No JSON block found in candidate {candidate_idx}, part {part_idx} for chunk {chunk_idx}.")
-                            continue
-                        
-                        for block_idx, json_str in enumerate(json_blocks):
-                            try:
-                                logger.debug(f"Extracted JSON String from chunk {chunk_idx}, candidate {candidate_idx}, part {part_idx}, block {block_idx}: {json_str}")
-                                json_data = json.loads(json_str)
-                                extracted_jsons.append(json_data)
-                            except json.JSONDecodeError as jde:
-                                logger.error(f"JSON Decode Error in chunk {chunk_idx}, candidate {candidate_idx}, part {part_idx}, block {block_idx}: {jde}")
-                                raise ValueError("JSON Decode Error.")
-                                
-            if not extracted_jsons:
-                logger.error("No valid JSON data extracted from any chunk.")
-                return None
-            
-            return combine_nested_lists(extracted_jsons)
-            
-        except Exception as e:
-            logger.error(f"An error occurred in convert_html_to_json: {e}")
-            return None
-        
+
+                for block_idx, json_str in enumerate(json_blocks):
+                    try:
+                        logger.debug(f"Extracted JSON String from chunk {chunk_idx}, candidate {candidate_idx}, part {part_idx}, block {block_idx}: {json_str}")
+                        extracted_jsons.append(json.loads(json_str))
+                    except json.JSONDecodeError as jde:
+                        logger.error(f"JSON Decode Error in chunk {chunk_idx}, candidate {candidate_idx}, part {part_idx}, block {block_idx}: {jde}")
+                        # Không để response hỏng nằm trong cache => lần thử lại gọi API thật
+                        await self.llm.forget(prompt, "gemini-1.5-flash")
+                        raise ValueError("JSON Decode Error.")
+        return extracted_jsons
+
     # def html_ai_processing(self, html_content: str) -> Optional[str]:
     #     """
     #     Xử lý nội dung HTML bằng Google Generative AI để chèn placeholders vào những vị trí cần điền dữ liệu.
@@ -346,26 +402,41 @@ class HtmlToJsonService:
     #         logger.exception(f"An error occurred in html_ai_processing: {e}") # Sử dụng logger.exception để log đầy đủ traceback
     #         return None
 
-    def html_ai_processing(self, html_content: str) -> Optional[str]:
+    async def html_ai_processing(self, html_content: str, ids: str = "random") -> Optional[str]:
         """
         Xử lý nội dung HTML bằng Google Generative AI.
-        Nếu HTML quá dài (vượt quá max_chunk_length), sẽ chia nhỏ nội dung theo thẻ body,
+        Nếu HTML quá dài (vượt quá max_chunk_tokens), sẽ chia nhỏ nội dung theo thẻ body,
         sau đó xử lý từng chunk riêng và ghép lại kết quả cuối cùng.
+        ids="stable" => id của span placeholder suy ra từ vị trí (lần xuất hiện) của "..." trong HTML,
+        cùng HTML đầu vào luôn cho cùng prompt.
         """
         try:
             # 1. Tiền xử lý: Thay thế các placeholder "..." bằng thẻ <span> có id duy nhất.
             placeholder_uuid_map = {}
 
             def replace_placeholder(match):
-                unique_id = str(uuid.uuid4())
+                unique_id = placeholder_id(ids, 'html_ai', len(placeholder_uuid_map))
                 placeholder_uuid_map[unique_id] = match.group(0)  # Lưu lại placeholder gốc nếu cần
                 return f'<span id="{unique_id}">...</span>'
 
             modified_html_content = re.sub(r'\.\.\.', replace_placeholder, html_content)
 
+            # Gửi bản rút gọn (text, cấu trúc, id placeholder), span mới do AI chèn
+            # được ánh xạ ngược vào HTML đầy đủ ở cuối
+            minifier = None
+            template = HTML_TEMPLATE
+            if settings.GEMINI_MINIFY_HTML:
+                with span("html-minify"):
+                    minifier = HtmlMinifier(modified_html_content)
+                modified_html_content = minifier.html
+                template = MINIFIED_HTML_TEMPLATE
+
             # 2. Nếu nội dung nhỏ hơn ngưỡng thì xử lý trực tiếp.
-            if len(modified_html_content) <= self.max_chunk_length:
-                processed_chunk = self.process_html_chunk(modified_html_content)
+            if estimate_tokens(modified_html_content) <= self.max_chunk_tokens:
+                processed_chunk = await self.process_html_chunk(modified_html_content)
+                if minifier is not None:
+                    with span("html-minify"):
+                        return minifier.restore(processed_chunk)
                 return processed_chunk
 
             # 3. Đảm bảo HTML có thẻ <body>; nếu không, bọc nó vào cấu trúc đầy đủ.
@@ -373,30 +444,31 @@ class HtmlToJsonService:
                 modified_html_content = f"<html><body>{modified_html_content}</body></html>"
 
             # 4. Chia nhỏ HTML thành các chunk sử dụng hàm split_body_into_chunks
-            chunks: List[str] = split_body_into_chunks(modified_html_content, max_length=int(self.max_chunk_length/3))
+            with span("html-split"):
+                chunks: List[str] = split_body_into_chunks(
+                    modified_html_content, max_tokens=int(self.max_chunk_tokens/3), template=template
+                )
             logger.info(f"Đã chia HTML thành {len(chunks)} chunk.")
-            # độ dài của mỗi chunk
-            for chunk in chunks:
-                print("chunk length: ",len(chunk))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Số token ước lượng của mỗi chunk: {[estimate_tokens(chunk) for chunk in chunks]}")
+
+            # 5. Xử lý các chunk qua API song song (tối đa GEMINI_CHUNK_CONCURRENCY chunk cùng lúc).
+            semaphore = asyncio.Semaphore(settings.GEMINI_CHUNK_CONCURRENCY)
 
-            # 5. Xử lý các chunk qua API song song.
+            async def process(chunk):
+                async with semaphore:
+                    return await self.process_html_chunk(chunk)
+
+            results = await asyncio.gather(*(process(chunk) for chunk in chunks), return_exceptions=True)
             processed_chunks = [None] * len(chunks)
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future_to_index = {
-                    executor.submit(self.process_html_chunk, chunk): idx
-                    for idx, chunk in enumerate(chunks)
-                }
-                for future in concurrent.futures.as_completed(future_to_index):
-                    idx = future_to_index[future]
-                    try:
-                        result = future.result()
-                        if result is None:
-                            logger.warning(f"Chunk {idx} không được xử lý. Sử dụng chunk gốc.")
-                            result = chunks[idx]  # Fallback: dùng chunk gốc
-                        processed_chunks[idx] = result
-                    except Exception as exc:
-                        logger.error(f"Chunk {idx} gặp lỗi: {exc}. Sử dụng chunk gốc.")
-                        processed_chunks[idx] = chunks[idx]
+            for idx, result in enumerate(results):
+                if isinstance(result, Exception):
+                    logger.error(f"Chunk {idx} gặp lỗi: {result}. Sử dụng chunk gốc.")
+                    result = chunks[idx]
+                elif result is None:
+                    logger.warning(f"Chunk {idx} không được xử lý. Sử dụng chunk gốc.")
+                    result = chunks[idx]  # Fallback: dùng chunk gốc
+                processed_chunks[idx] = result
 
             # 6. Ghép lại các chunk đã xử lý:
             # Vì các chunk ở bước 5 là HTML đầy đủ (có thẻ <html>/<body>),
@@ -413,14 +485,17 @@ class HtmlToJsonService:
                     combined_body_content += processed_chunk
 
             # 7. Bọc nội dung đã ghép vào mẫu HTML hoàn chỉnh.
-            final_html = HTML_TEMPLATE.format(content=combined_body_content)
+            final_html = template.format(content=combined_body_content)
+            if minifier is not None:
+                with span("html-minify"):
+                    return minifier.restore(final_html)
             return final_html
 
         except Exception as e:
             logger.exception(f"An error occurred in html_ai_processing: {e}")
             return None
 
-    def process_html_chunk(self, chunk_html: str) -> Optional[str]:
+    async def process_html_chunk(self, chunk_html: str) -> Optional[str]:
         """
         Xử lý một chunk HTML qua Google Generative AI API.
         Trả về đoạn HTML đã được xử lý (được bao bọc trong cặp thẻ html).
@@ -442,8 +517,7 @@ html
 {chunk_html}
 Vui lòng trả về DUY NHẤT phần mã HTML đã được chỉnh sửa, được bao bọc trong cặp thẻ html.
 """ 
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            response = model.generate_content(prompt)
+            response = await self.llm.generate(prompt, "gemini-1.5-flash")
             print("Response từ API:\n%s", response)
             if not hasattr(response, 'candidates') or not response.candidates:
                 logger.error("Không có candidates nào trong response từ AI cho xử lý HTML chunk.")
@@ -482,6 +556,7 @@ Vui lòng trả về DUY NHẤT phần mã HTML đã được chỉnh sửa, đ
 
             if not extracted_html_str:
                 logger.warning("Không có dữ liệu HTML hợp lệ nào được trích xuất từ response cho HTML chunk.")
+                await self.llm.forget(prompt, "gemini-1.5-flash")
                 return chunk_html  # Fallback: trả về chunk gốc
 
             logger.info("Extracted HTML chunk thành công.")
@@ -491,6 +566,10 @@ Vui lòng trả về DUY NHẤT phần mã HTML đã được chỉnh sửa, đ
             logger.exception(f"An error occurred in process_html_chunk: {e}")
             return chunk_html  # Fallback: trả về chunk gốc
 
+    def get_prompt_cache_stats(self) -> dict:
+        """Số liệu cache prompt Gemini: hit rate, số giây tiết kiệm được..."""
+        return self.llm.cache_stats()
+
     def flatten_id_spans(self, html_str):
         """
         Hàm này nhận vào một chuỗi HTML và xử lý các thẻ <span> có thuộc tính id lồng nhau.
@@ -514,20 +593,14 @@ Vui lòng trả về DUY NHẤT phần mã HTML đã được chỉnh sửa, đ
         
         return soup.prettify()
     
-    def generate_content(self, prompt: str, model_name: str) -> Optional[str]:
+    async def generate_content(self, prompt: str, model_name: str) -> Optional[str]:
         try:
-            genai.configure(api_key=settings.GOOGLE_GENERATIVE_AI_API_KEY)
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt)
-            
             # Ensure we're returning the full text content
-            if response.text:
-                return response.text
-            elif hasattr(response, 'parts'):
-                return ''.join(part.text for part in response.parts if hasattr(part, 'text'))
-            else:
-                print("Warning: Unexpected response format")
-                return str(response)
+            response = await self.llm.generate(prompt, model_name)
+            return response_text(response)
+        except LLMTimeout as e:
+            print(f"Error generating content: {str(e)}")
+            return "ERROR: API không phản hồi trong thời gian cho phép."
         except Exception as e:
             print(f"Error generating content: {str(e)}")
             if "exceed the maximum token limit" in str(e):
@@ -1,79 +1,367 @@
 import os
-import subprocess
-import uuid
+import json
+import atexit
+import asyncio
+import zipfile
 import logging
-from tempfile import NamedTemporaryFile, gettempdir
+import posixpath
+from io import BytesIO
+from tempfile import TemporaryDirectory, mkdtemp
 
-from app.services.docx_converter import DocxToHtmlConverter
+from app.config import settings
+from app.services.docx_converter import DocxToHtmlConverter, CONVERTER_VERSION
+from app.services.docx_stream_converter import StreamingDocxToHtmlConverter
+from app.helpers.conversion_cache import ConversionCache
+from app.helpers.image_store import ImageStore
+from app.helpers.docx_limits import DocxLimits
+from app.helpers.placeholder_ids import ID_MODES
+from app.helpers.style_classes import STYLE_MODES
+from app.helpers.libreoffice_pool import LibreOfficePool, is_ooxml_zip
+from app.helpers.executors import run_cpu, run_io, ExecutorSaturated
+from app.helpers.server_timing import span
 
 logger = logging.getLogger(__name__)
 
+
+_fragment_cache = None
+
+
+def get_fragment_cache() -> ConversionCache:
+    """
+    Cache fragment HTML theo block, một instance cho mỗi process. Tầng bộ nhớ là riêng của từng
+    process, tầng đĩa (FRAGMENT_CACHE_DIR) dùng chung => lần tải lên sau rơi vào worker khác
+    của process pool vẫn dùng lại được các block không đổi.
+    """
+    global _fragment_cache
+    if _fragment_cache is None:
+        _fragment_cache = ConversionCache(
+            max_bytes=settings.FRAGMENT_CACHE_MAX_BYTES,
+            disk_dir=settings.FRAGMENT_CACHE_DIR,
+        )
+    return _fragment_cache
+
+
+def convert_docx_bytes(docx_bytes: bytes, streaming: bool = False, output: str = "soup", compact: bool = False,
+                       images: str = "inline", incremental: bool = False, with_index: bool = False,
+                       ids: str = "random", bounded: bool = False, styles: str = "inline"):
+    """
+    Chuyển nội dung .docx (bytes) sang HTML bằng engine được chọn.
+    images="store" lưu ảnh vào kho ảnh (IMAGE_STORE_DIR) và tham chiếu bằng URL,
+    "inline" nhúng data URI.
+    incremental=True dùng lại fragment HTML của các block không đổi (bắt buộc output="string"
+    hoặc bounded=True, nếu không ném ValueError).
+    with_index=True trả về {"html", "placeholders"} (chỉ mục span dấu chấm, xem
+    DocxToHtmlConverter.placeholders) thay vì chỉ chuỗi HTML.
+    ids="stable" => id placeholder xác định theo cấu trúc tài liệu (cùng file => cùng HTML).
+    bounded=True => chế độ giới hạn bộ nhớ (xem create_converter).
+    styles="classes" => style inline được gom thành class trong một khối <style>.
+    Hàm module-level, tham số đơn giản => chạy được trong process pool.
+    """
+    converter = create_converter(docx_bytes, streaming, output, compact, images, incremental, ids, bounded, styles)
+    html_output = converter.convert_document()
+    if with_index:
+        return {"html": html_output, "placeholders": converter.placeholders}
+    return html_output
+
+
+def create_converter(docx_bytes: bytes, streaming: bool = False, output: str = "soup", compact: bool = False,
+                     images: str = "inline", incremental: bool = False, ids: str = "random",
+                     bounded: bool = False, styles: str = "inline"):
+    """
+    Tạo converter (engine python-docx hoặc lxml) cho nội dung .docx với các tuỳ chọn đã cho.
+    bounded=True luôn dùng engine lxml iterparse và HtmlWriter (không dựng cây python-docx
+    hay BeautifulSoup), kiểm tra kích thước các part/ảnh cần đọc theo DOCX_MAX_* và ném
+    DocumentTooLarge trước khi giải nén bất cứ thứ gì vượt giới hạn.
+    """
+    limits = None
+    if bounded:
+        streaming, output, limits = True, "string", DocxLimits.from_settings()
+    if incremental and output != "string":
+        # Backend soup không ghép được fragment HTML đã cache
+        raise ValueError("incremental=True requires output='string'.")
+    image_store = None
+    if images == "store":
+        image_store = ImageStore(settings.IMAGE_STORE_DIR, settings.IMAGE_URL_PREFIX)
+    fragment_cache = get_fragment_cache() if incremental else None
+    if streaming:
+        return StreamingDocxToHtmlConverter(
+            BytesIO(docx_bytes), output=output, compact=compact, image_store=image_store,
+            fragment_cache=fragment_cache, ids=ids, styles=styles, limits=limits,
+        )
+    return DocxToHtmlConverter(
+        BytesIO(docx_bytes), output=output, compact=compact, image_store=image_store, fragment_cache=fragment_cache,
+        ids=ids, styles=styles,
+    )
+
+
 class ItemService:
-    def convert_docx_to_html(self, file_bytes: bytes, file_extension: str) -> str:
-        # Tạo file tạm thời với đúng định dạng
-        with NamedTemporaryFile(delete=False, suffix=file_extension) as tmp:
-            tmp.write(file_bytes)
-            tmp_path = tmp.name
+    def __init__(self, cache: ConversionCache = None):
+        # Cache DOCX -> HTML theo nội dung file, None => không cache
+        if cache is None and settings.CONVERSION_CACHE_ENABLED:
+            cache = ConversionCache(
+                max_bytes=settings.CONVERSION_CACHE_MAX_BYTES,
+                disk_dir=settings.CONVERSION_CACHE_DIR,
+            )
+        self.cache = cache
 
-        docx_path = None  # Khởi tạo biến docx_path để tránh lỗi tham chiếu trước gán
+        # Worker LibreOffice chạy lâu dài cho .doc, khởi động khi có file .doc đầu tiên
+        self.libreoffice_pool = LibreOfficePool(
+            size=settings.LIBREOFFICE_POOL_SIZE,
+            soffice_path=settings.LIBREOFFICE_PATH,
+            job_timeout=settings.LIBREOFFICE_JOB_TIMEOUT,
+            queue_timeout=settings.LIBREOFFICE_QUEUE_TIMEOUT,
+            health_interval=settings.LIBREOFFICE_HEALTH_INTERVAL,
+        )
+        atexit.register(self.libreoffice_pool.close)
 
-        try:
-            # Nếu file là .doc, chuyển đổi sang .docx trước
-            if file_extension.lower() == ".doc":
-                docx_path = self.convert_doc_to_docx(tmp_path)
-                tmp_path = docx_path  # Sử dụng file .docx đã chuyển đổi
-            elif file_extension.lower() == ".docx":
-                # Đảm bảo rằng file là .docx
-                pass
-            else:
-                raise ValueError("Unsupported file extension.")
+    def convert_docx_to_html(self, file_bytes: bytes, file_extension: str, streaming: bool = False,
+                             output: str = "soup", compact: bool = False, images: str = "inline",
+                             incremental: bool = False, with_index: bool = False, ids: str = "random",
+                             bounded: bool = False, styles: str = "inline"):
+        """
+        Chuyển file .docx/.doc sang HTML.
+        streaming=True dùng engine lxml iterparse (StreamingDocxToHtmlConverter),
+        nhanh và ít bộ nhớ hơn với tài liệu lớn; mặc định dùng engine python-docx.
+        output="string" ghi HTML trực tiếp ra chuỗi (không dựng cây BeautifulSoup),
+        compact=True bỏ thụt lề/xuống dòng.
+        images="store" tách ảnh ra kho ảnh (GET /items/images/{id}) thay vì nhúng base64.
+        incremental=True chỉ render lại các block đã thay đổi so với các lần tải lên trước
+        (cần output="string" hoặc bounded=True).
+        with_index=True trả về {"html", "placeholders"} thay vì chuỗi HTML.
+        ids="stable" sinh id placeholder xác định (uuid5 theo block/paragraph/nhóm run/lần xuất hiện)
+        thay vì uuid4, nên cùng một file luôn cho cùng một HTML.
+        bounded=True => chế độ giới hạn bộ nhớ cho tài liệu lớn: engine lxml + output="string",
+        vượt giới hạn DOCX_MAX_* thì ném DocumentTooLarge (413) thay vì đọc hết vào bộ nhớ.
+        styles="classes" gom mỗi style inline khác nhau thành một class (s0, s1, ...) trong một
+        khối <style>, thẻ chỉ mang class ngắn => HTML (và prompt Gemini) nhỏ hơn nhiều.
+        Kết quả được cache theo SHA-256 nội dung file + CONVERTER_VERSION + các tuỳ chọn,
+        hit được trả về ngay, không gọi python-docx hay soffice.
+        """
+        cache_key, cached = self._lookup_cache(
+            file_bytes, file_extension, streaming, output, compact, images, with_index, ids, bounded, styles
+        )
+        if cached is not None:
+            return cached
 
-            # Chuyển đổi .docx sang HTML
-            converter = DocxToHtmlConverter(tmp_path)
-            html_output = converter.convert_document()
+        try:
+            docx_bytes = self.to_docx_bytes(file_bytes, file_extension)
+            html_output = convert_docx_bytes(
+                docx_bytes, streaming, output, compact, images, incremental, with_index, ids, bounded, styles
+            )
         except Exception as e:
             logger.error(f"Error in convert_docx_to_html: {e}")
             raise
-        finally:
-            # Xóa file tạm thời
-            os.remove(tmp_path)
-            if docx_path and os.path.exists(docx_path):  # Chỉ xóa nếu docx_path không phải None
-                os.remove(docx_path)  # Xóa file .docx đã chuyển đổi nếu có
 
+        self._store_cache(cache_key, html_output)
         return html_output
 
-    def convert_doc_to_docx(self, doc_path: str, output_dir: str = None) -> str:
-        if not output_dir:
-            output_dir = gettempdir()
-
-        # Tạo tên file tạm thời cho .docx
-        docx_filename = f"converted_{uuid.uuid4().hex}.docx"
-        docx_path = os.path.join(output_dir, docx_filename)
+    async def convert_docx_to_html_async(self, file_bytes: bytes, file_extension: str, streaming: bool = False,
+                                         output: str = "soup", compact: bool = False,
+                                         images: str = "inline", incremental: bool = False,
+                                         with_index: bool = False, ids: str = "random",
+                                         bounded: bool = False, styles: str = "inline"):
+        """
+        Giống convert_docx_to_html nhưng không chặn event loop:
+        LibreOffice chạy trên thread pool I/O, DOCX -> HTML chạy trên process pool CPU.
+        Cache được tra/ghi ngay trong process chính.
+        Ném ExecutorSaturated khi hàng đợi đầy.
+        """
+        cache_key, cached = self._lookup_cache(
+            file_bytes, file_extension, streaming, output, compact, images, with_index, ids, bounded, styles
+        )
+        if cached is not None:
+            return cached
 
-        # Thực hiện chuyển đổi bằng LibreOffice
         try:
-            # Lệnh chuyển đổi: soffice --headless --convert-to docx "input.doc" --outdir "output_dir"
-            command = [
-                "soffice",
-                "--headless",
-                "--convert-to",
-                "docx",
-                doc_path,
-                "--outdir",
-                output_dir
-            ]
-            subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"LibreOffice conversion failed: {e.stderr.decode()}")
-            raise RuntimeError("Failed to convert .doc to .docx") from e
-
-        # Kiểm tra xem file .docx đã được tạo chưa
-        if not os.path.exists(docx_path):
-            # LibreOffice có thể tạo file với tên khác, do đó tìm file .docx trong output_dir
-            converted_files = [f for f in os.listdir(output_dir) if f.lower().endswith(".docx")]
-            if converted_files:
-                docx_path = os.path.join(output_dir, converted_files[0])
+            if self.needs_libreoffice(file_bytes, file_extension):
+                docx_bytes = await run_io(self.to_docx_bytes, file_bytes, file_extension)
             else:
-                raise FileNotFoundError("Converted .docx file not found.")
+                docx_bytes = self.to_docx_bytes(file_bytes, file_extension)
+            html_output = await run_cpu(
+                convert_docx_bytes, docx_bytes, streaming, output, compact, images, incremental, with_index, ids,
+                bounded, styles,
+            )
+        except ExecutorSaturated:
+            raise
+        except Exception as e:
+            logger.error(f"Error in convert_docx_to_html_async: {e}")
+            raise
+
+        self._store_cache(cache_key, html_output)
+        return html_output
 
-        return docx_path
+    async def stream_docx_to_html(self, file_bytes: bytes, file_extension: str, streaming: bool = True,
+                                  compact: bool = False, images: str = "inline", incremental: bool = False,
+                                  ids: str = "random", bounded: bool = False, styles: str = "inline"):
+        """
+        Async generator trả HTML theo từng phần (head, từng block, thẻ đóng) ngay khi
+        chuyển đổi xong, dùng cho StreamingResponse. Mỗi bước chạy trên thread pool I/O
+        để không chặn event loop. Luôn xuất bằng HtmlWriter (output="string").
+        Cache hit được trả về trong một phần duy nhất; kết quả stream không được ghi vào cache
+        (để không phải giữ toàn bộ HTML trong bộ nhớ).
+        """
+        _, cached = self._lookup_cache(
+            file_bytes, file_extension, streaming, "string", compact, images, ids=ids, bounded=bounded, styles=styles
+        )
+        if cached is not None:
+            yield cached
+            return
+
+        if self.needs_libreoffice(file_bytes, file_extension):
+            docx_bytes = await run_io(self.to_docx_bytes, file_bytes, file_extension)
+        else:
+            docx_bytes = self.to_docx_bytes(file_bytes, file_extension)
+
+        converter = await run_io(
+            create_converter, docx_bytes, streaming, "string", compact, images, incremental, ids, bounded, styles
+        )
+        chunks = converter.iter_html()
+        try:
+            while True:
+                chunk = await run_io(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            chunks.close()
+
+    def extract_batch_archive(self, archive_bytes: bytes):
+        """Danh sách (tên file, bytes) các file .docx/.doc trong một file zip."""
+        items = []
+        with zipfile.ZipFile(BytesIO(archive_bytes)) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or posixpath.basename(name).startswith("~$"):
+                    continue
+                if posixpath.splitext(name)[1].lower() not in (".docx", ".doc"):
+                    continue
+                if len(items) >= settings.BATCH_MAX_FILES:
+                    raise ValueError(f"Batch has more than {settings.BATCH_MAX_FILES} files.")
+                items.append((name, archive.read(info)))
+        return items
+
+    async def convert_batch(self, items, **options):
+        """
+        Chuyển nhiều file song song (tối đa BATCH_CONCURRENCY file cùng lúc), yield kết quả
+        từng file theo thứ tự hoàn thành: {"index", "filename", "status", "html" | "error"}
+        (kèm "placeholders" khi with_index=True).
+        Lỗi của một file không làm dừng cả batch.
+        items: danh sách (tên file, bytes); options: như convert_docx_to_html_async.
+        """
+        semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+
+        async def convert_one(index, filename, file_bytes):
+            async with semaphore:
+                result = {"index": index, "filename": filename}
+                try:
+                    extension = posixpath.splitext(filename)[1].lower()
+                    html_output = await self.convert_docx_to_html_async(file_bytes, extension, **options)
+                    if isinstance(html_output, dict):
+                        result["placeholders"] = html_output["placeholders"]
+                        html_output = html_output["html"]
+                    if html_output is None:
+                        raise RuntimeError("Conversion returned no output")
+                    result.update(status="ok", html=html_output)
+                except Exception as e:
+                    logger.error(f"Error in convert_batch ({filename}): {e}")
+                    result.update(status="error", error=str(e) or type(e).__name__)
+                return result
+
+        tasks = [
+            asyncio.ensure_future(convert_one(index, filename, file_bytes))
+            for index, (filename, file_bytes) in enumerate(items)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Client ngắt kết nối => huỷ các file chưa chuyển đổi
+            for task in tasks:
+                task.cancel()
+
+    def _lookup_cache(self, file_bytes: bytes, file_extension: str, streaming: bool, output: str, compact: bool,
+                      images: str, with_index: bool = False, ids: str = "random", bounded: bool = False,
+                      styles: str = "inline"):
+        """
+        Kiểm tra tham số và tra cache, trả về (cache_key, kết quả đã cache hoặc None).
+        Kết quả kèm chỉ mục placeholder (with_index=True) được lưu dạng JSON.
+        bounded=True => kiểm tra kích thước file tải lên trước (trước cả LibreOffice).
+        """
+        if output not in ("soup", "string"):
+            raise ValueError("Unsupported output backend.")
+        if images not in ("inline", "store"):
+            raise ValueError("Unsupported images mode.")
+        if ids not in ID_MODES:
+            raise ValueError("Unsupported placeholder id mode.")
+        if styles not in STYLE_MODES:
+            raise ValueError("Unsupported styles mode.")
+        if bounded:
+            DocxLimits.from_settings().check_upload(len(file_bytes))
+        if self.cache is None:
+            return None, None
+        cache_key = ConversionCache.make_key(
+            file_bytes, CONVERTER_VERSION, file_extension.lower(), streaming, output, compact, images, with_index, ids,
+            bounded, styles,
+        )
+        with span("cache"):
+            cached = self.cache.get(cache_key)
+        if cached is not None and with_index:
+            cached = json.loads(cached)
+        return cache_key, cached
+
+    def _store_cache(self, cache_key, result):
+        if isinstance(result, dict):
+            if result["html"] is None:
+                return
+            result = json.dumps(result, ensure_ascii=False)
+        if cache_key is not None and result is not None:
+            self.cache.set(cache_key, result)
+
+    def needs_libreoffice(self, file_bytes: bytes, file_extension: str) -> bool:
+        # File .docx bị đặt nhầm đuôi .doc => không cần LibreOffice
+        return file_extension.lower() == ".doc" and not is_ooxml_zip(file_bytes)
+
+    def to_docx_bytes(self, file_bytes: bytes, file_extension: str) -> bytes:
+        """Trả về nội dung .docx của file tải lên (.doc được chuyển qua pool LibreOffice)."""
+        extension = file_extension.lower()
+        if extension not in (".docx", ".doc"):
+            raise ValueError("Unsupported file extension.")
+        if not self.needs_libreoffice(file_bytes, extension):
+            # .docx: dùng thẳng bytes trong bộ nhớ, không ghi file tạm
+            return file_bytes
+
+        # .doc: LibreOffice cần file trên đĩa.
+        # Thư mục tạm riêng cho mỗi request, tự xoá cả .doc và .docx khi xong
+        with TemporaryDirectory(prefix="doc_job_") as job_dir:
+            doc_path = os.path.join(job_dir, f"input{file_extension}")
+            with open(doc_path, "wb") as f:
+                f.write(file_bytes)
+            with span("libreoffice"):
+                docx_path = self.convert_doc_to_docx(doc_path, job_dir)
+            with open(docx_path, "rb") as f:
+                return f.read()
+
+    def get_image(self, image_id: str):
+        """(đường dẫn file, media type) của ảnh trong kho ảnh, hoặc None."""
+        return ImageStore(settings.IMAGE_STORE_DIR, settings.IMAGE_URL_PREFIX).get(image_id)
+
+    def get_cache_stats(self) -> dict:
+        """Số liệu hit/miss của cache chuyển đổi."""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+
+    def get_libreoffice_status(self) -> dict:
+        """Trạng thái các worker LibreOffice (chạy health check trước)."""
+        self.libreoffice_pool.health_check()
+        return self.libreoffice_pool.status()
+
+    def convert_doc_to_docx(self, doc_path: str, output_dir: str = None) -> str:
+        """
+        Chuyển .doc sang .docx bằng pool LibreOffice (profile riêng cho từng worker).
+        output_dir mặc định là một thư mục tạm mới, nên tên file kết quả luôn xác định
+        (<tên file>.docx) và không lẫn với file của request khác.
+        """
+        if not output_dir:
+            output_dir = mkdtemp(prefix="doc_job_")
+        return self.libreoffice_pool.convert(doc_path, output_dir)
@@ -1,12 +1,13 @@
 import re
 import io
-import time
+import asyncio
 import logging
 from typing import List
 from docx import Document
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .html_to_json_service import HtmlToJsonService
+from app.helpers.executors import run_io, ExecutorSaturated
+from app.helpers.server_timing import span
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
@@ -17,7 +18,6 @@ class ProcessFileService:
     def __init__(self):
         self.MAX_RETRIES = 3
         self.RETRY_DELAY = 5  # giây
-        self.MAX_WORKERS = 5  # Số luồng tối đa
 
     def _create_prompt(self, check_type: str, text: str, max_length: int = 2000) -> str:
         prompts = {
@@ -71,7 +71,7 @@ class ProcessFileService:
             logger.warning(f"Không tìm thấy nhận xét nào. Nội dung phản hồi (phần đầu):\n{text[:500]}...")
         return comments
 
-    def _process_prompt(self, check_type: str, full_text: str, selected_model: str) -> List[str]:
+    async def _process_prompt(self, check_type: str, full_text: str, selected_model: str) -> List[str]:
         for attempt in range(self.MAX_RETRIES):
             try:
                 logger.info(f"Đang xử lý {check_type}...")
@@ -81,12 +81,12 @@ class ProcessFileService:
                 logger.info(f"Đang gửi yêu cầu kiểm tra {check_type} đến API...")
                 print(f"Selected Model: {selected_model}")
                 print(f"Prompt: {prompt}")
-                response = AiModel.generate_content(prompt, selected_model)
+                response = await AiModel.generate_content(prompt, selected_model)
 
                 if response is None or response.startswith("ERROR:"):
                     if response and "429 Resource has been exhausted" in response:
                         logger.info(f"Quota API đã hết, chờ {self.RETRY_DELAY} giây rồi thử lại...")
-                        time.sleep(self.RETRY_DELAY)
+                        await asyncio.sleep(self.RETRY_DELAY)
                         continue
                     raise Exception(response or f"Không nhận được phản hồi từ API cho {check_type}")
 
@@ -102,7 +102,12 @@ class ProcessFileService:
                     logger.error("Đã thử quá số lần quy định.")
         return []
 
-    def _process_single_file(
+    def _read_docx_text(self, file_bytes: bytes) -> str:
+        with span("docx-read"):
+            doc = Document(io.BytesIO(file_bytes))
+            return "\n".join([para.text for para in doc.paragraphs])
+
+    async def _process_single_file(
         self,
         file_bytes: bytes,
         spelling_grammar: bool,
@@ -110,9 +115,11 @@ class ProcessFileService:
         selected_model: str,
     ) -> str:
         try:
-            doc = Document(io.BytesIO(file_bytes))
-            full_text = "\n".join([para.text for para in doc.paragraphs])
+            # Đọc DOCX trên thread pool I/O, các lời gọi Gemini chạy thẳng trên event loop
+            full_text = await run_io(self._read_docx_text, file_bytes)
             logger.info(f"Đã đọc nội dung file. Độ dài văn bản: {len(full_text)} ký tự")
+        except ExecutorSaturated:
+            raise
         except Exception as e:
             raise Exception(f"Lỗi khi đọc file: {str(e)}")
 
@@ -123,30 +130,28 @@ class ProcessFileService:
         if content_suggestion:
             check_types.append("content_suggestion")
 
-        with ThreadPoolExecutor(max_workers=len(check_types) or 1) as executor:
-            future_to_check = {
-                executor.submit(self._process_prompt, check_type, full_text, selected_model): check_type
-                for check_type in check_types
-            }
-            for future in as_completed(future_to_check):
-                check_type = future_to_check[future]
-                try:
-                    comments = future.result()
-                    if comments:
-                        if check_type == "spelling_grammar":
-                            all_comments.append("Spelling and Grammar")
-                            all_comments.append("-" * 40)
-                            all_comments.extend(comments)
-                            all_comments.append("\n")
-                        elif check_type == "content_suggestion":
-                            all_comments.append("Content Suggestions")
-                            all_comments.append("-" * 40)
-                            all_comments.extend(comments)
-                            all_comments.append("\n")
-                    else:
-                        logger.info(f"Không có nhận xét nào được tạo cho {check_type}")
-                except Exception as exc:
-                    logger.error(f"Lỗi khi xử lý {check_type}: {str(exc)}")
+        # Các loại kiểm tra gọi API đồng thời, kết quả theo thứ tự check_types
+        results = await asyncio.gather(
+            *(self._process_prompt(check_type, full_text, selected_model) for check_type in check_types),
+            return_exceptions=True,
+        )
+        for check_type, comments in zip(check_types, results):
+            if isinstance(comments, Exception):
+                logger.error(f"Lỗi khi xử lý {check_type}: {str(comments)}")
+                continue
+            if comments:
+                if check_type == "spelling_grammar":
+                    all_comments.append("Spelling and Grammar")
+                    all_comments.append("-" * 40)
+                    all_comments.extend(comments)
+                    all_comments.append("\n")
+                elif check_type == "content_suggestion":
+                    all_comments.append("Content Suggestions")
+                    all_comments.append("-" * 40)
+                    all_comments.extend(comments)
+                    all_comments.append("\n")
+            else:
+                logger.info(f"Không có nhận xét nào được tạo cho {check_type}")
 
         if not all_comments:
             logger.warning("Không tìm thấy nhận xét nào trong phản hồi")
@@ -154,15 +159,14 @@ class ProcessFileService:
         else:
             return "\n".join(all_comments)
 
-    def process_question_logic(
+    async def process_question_logic(
         self,
         file_bytes: bytes,
         question: str,
         selected_model: str,
     ) -> str:
         try:
-            doc = Document(io.BytesIO(file_bytes))
-            content = "\n".join([para.text for para in doc.paragraphs])
+            content = await run_io(self._read_docx_text, file_bytes)
             prompt = (
                 f"Dưới đây là nội dung của một văn bản:\n\n{content}\n\n"
                 f"Câu hỏi: {question}\n\n"
@@ -171,9 +175,11 @@ class ProcessFileService:
             )
             print(f"Selected Model: {selected_model}")
             print(f"Prompt: {prompt}")
-            response = AiModel.generate_content(prompt, selected_model)
+            response = await AiModel.generate_content(prompt, selected_model)
             if response is None or response.startswith("ERROR:"):
                 raise Exception(response or "Không nhận được phản hồi từ API.")
             return self._clean_comment(response)
+        except ExecutorSaturated:
+            raise
         except Exception as e:
             raise Exception(f"Lỗi khi xử lý câu hỏi: {str(e)}")
@@ -9,6 +9,8 @@ from PIL import Image
 import logging
 from datetime import datetime
 from app.helpers.qr_utils import QRHelper   # Import the QRHelper class
+from app.helpers.executors import run_io, ExecutorSaturated
+from app.helpers.server_timing import span
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,15 +39,21 @@ class QRService:
                 contents = await file.read()
                 if not contents:
                     raise HTTPException(status_code=400, detail="Empty file")
-                image = Image.open(BytesIO(contents))
-                frame = np.array(image)
+                with span("qr-read"):
+                    image = Image.open(BytesIO(contents))
+                    frame = np.array(image)
             except Exception as e:
                 logger.error(f"Error reading image file: {str(e)}")
                 raise HTTPException(status_code=400, detail="Error reading image file")
 
             # Phát hiện QR trong ảnh sử dụng QRDetector
+            # Model chạy trên thread pool để không chặn event loop
+            # (giữ model trong process hiện tại, không pickle sang process pool)
             try:
-                detections = self.detector.detect(image=frame, is_bgr=True)
+                with span("qr-detect"):
+                    detections = await run_io(self.detector.detect, image=frame, is_bgr=True)
+            except ExecutorSaturated:
+                raise
             except Exception as e:
                 logger.error(f"Error detecting QR code with QRDetector: {str(e)}")
                 raise HTTPException(status_code=500, detail="Error detecting QR code")
@@ -63,7 +71,8 @@ class QRService:
             for index, detection in enumerate(detections):
                 try:
                     # Giải mã QR trực tiếp từ vùng ảnh sử dụng _decode_qr_zbar_v2
-                    decoded_info = self.qr_helper._decode_qr_zbar_v2(frame, detection)
+                    with span("qr-decode"):
+                        decoded_info = await run_io(self.qr_helper._decode_qr_zbar_v2, frame, detection)
 
                     # Nếu giải mã thành công, xử lý dữ liệu QR
                     if decoded_info:
@@ -92,9 +101,13 @@ class QRService:
                             )
                     else:
                         raise HTTPException(status_code=404, detail="QR code not decoded")
+                except ExecutorSaturated:
+                    raise
                 except Exception as e:
                     logger.error(f"Error processing QR code {index+1}: {str(e)}")
                     raise HTTPException(status_code=500, detail=f"Error processing QR code {index+1}: {str(e)}")
+        except ExecutorSaturated:
+            raise
         except Exception as e:
             logger.error(f"Error in scan_CCCD_qr_code: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
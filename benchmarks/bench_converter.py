@@ -0,0 +1,332 @@
+# benchmarks/bench_converter.py
+
+"""
+Benchmark DOCX -> HTML (DocxToHtmlConverter / StreamingDocxToHtmlConverter) trên bộ
+tài liệu tổng hợp của benchmarks/corpus.py.
+
+Đo theo từng giai đoạn (load, parse, head, paragraphs, tables, serialize, other),
+thông lượng và bộ nhớ đỉnh, ghi ra file JSON. So sánh với một lần chạy trước
+(--compare) để phát hiện chậm đi giữa các commit.
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.bench_converter
+    python -m benchmarks.bench_converter --cases dot_leaders,merged_tables --repeat 3
+    python -m benchmarks.bench_converter --compare benchmarks/results/<commit cũ>.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from benchmarks.corpus import CASES, build_corpus
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+STAGES = ('load', 'parse', 'head', 'paragraphs', 'tables', 'serialize', 'other')
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def converter_classes():
+    # Import muộn: process con (đo bộ nhớ) chỉ import khi cần
+    from app.services.docx_converter import DocxToHtmlConverter
+    from app.services.docx_stream_converter import StreamingDocxToHtmlConverter
+    return {'docx': DocxToHtmlConverter, 'lxml': StreamingDocxToHtmlConverter}
+
+
+def instrumented(base):
+    """
+    Lớp con của converter ghi thời gian từng giai đoạn vào self.stage_times.
+    Chỉ bọc các hook sẵn có (iter_body_elements, write_head, render_block, create_writer),
+    không sửa converter.
+    """
+    class Instrumented(base):
+        def __init__(self, *args, **kwargs):
+            self.stage_times = defaultdict(float)
+            self.block_count = 0
+            started = perf_counter()
+            super().__init__(*args, **kwargs)
+            self.stage_times['load'] += perf_counter() - started
+
+        def iter_body_elements(self):
+            # Thời gian lấy phần tử tiếp theo (engine lxml: iterparse document.xml)
+            elements = super().iter_body_elements()
+            while True:
+                started = perf_counter()
+                try:
+                    element = next(elements)
+                except StopIteration:
+                    self.stage_times['parse'] += perf_counter() - started
+                    return
+                self.stage_times['parse'] += perf_counter() - started
+                self.block_count += 1
+                yield element
+
+        def write_head(self, class_style=True):
+            started = perf_counter()
+            try:
+                return super().write_head(class_style)
+            finally:
+                self.stage_times['head'] += perf_counter() - started
+
+        def render_block(self, element):
+            stage = 'tables' if element.tag == f'{{{W_NS}}}tbl' else 'paragraphs'
+            started = perf_counter()
+            try:
+                return super().render_block(element)
+            finally:
+                self.stage_times[stage] += perf_counter() - started
+
+        def create_writer(self):
+            writer = super().create_writer()
+            getvalue = writer.getvalue
+
+            def timed_getvalue():
+                started = perf_counter()
+                try:
+                    return getvalue()
+                finally:
+                    self.stage_times['serialize'] += perf_counter() - started
+
+            writer.getvalue = timed_getvalue
+            return writer
+
+    Instrumented.__name__ = f'Instrumented{base.__name__}'
+    return Instrumented
+
+
+def run_once(converter_class, data: bytes, output: str) -> dict:
+    """Chuyển đổi một lần, trả về tổng thời gian, thời gian từng giai đoạn và kích thước kết quả."""
+    started = perf_counter()
+    converter = converter_class(io.BytesIO(data), output=output)
+    html = converter.convert_document()
+    total = perf_counter() - started
+    if html is None:
+        raise RuntimeError('convert_document returned None')
+    stages = {stage: converter.stage_times.get(stage, 0.0) for stage in STAGES if stage != 'other'}
+    stages['other'] = max(0.0, total - sum(stages.values()))
+    return {
+        'total': total,
+        'stages': stages,
+        'blocks': converter.block_count,
+        'placeholders': len(converter.placeholders),
+        'html_chars': len(html),
+    }
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: byte
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _current_rss_bytes() -> int:
+    """RSS hiện tại (Linux: /proc/self/statm), nơi khác dùng RSS đỉnh thay thế."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return _peak_rss_bytes()
+
+
+def measure_memory(engine: str, data: bytes, output: str) -> dict:
+    """
+    Chạy trong process mới: bộ nhớ đỉnh của một lần chuyển đổi.
+    peak_traced_bytes: cấp phát Python (tracemalloc, không gồm bộ nhớ C của libxml2);
+    peak_rss_delta_bytes: RSS đỉnh trừ RSS ngay trước khi chuyển đổi (gồm cả libxml2; nếu
+    import đã đẩy RSS đỉnh cao hơn mức chuyển đổi cần thì giá trị này bị đánh giá thấp).
+    """
+    converter_class = converter_classes()[engine]
+    rss_before = _current_rss_bytes() if resource is not None else None
+    tracemalloc.start()
+    try:
+        converter_class(io.BytesIO(data), output=output).convert_document()
+        _, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'peak_traced_bytes': traced_peak,
+        'peak_rss_delta_bytes': max(0, _peak_rss_bytes() - rss_before) if rss_before is not None else None,
+    }
+
+
+def summarize(values):
+    return {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+
+
+def bench_case(name, data, engine, output, repeat, warmup, memory):
+    converter_class = instrumented(converter_classes()[engine])
+    for _ in range(warmup):
+        run_once(converter_class, data, output)
+    runs = [run_once(converter_class, data, output) for _ in range(repeat)]
+
+    total = summarize([run['total'] for run in runs])
+    result = {
+        'case': name,
+        'engine': engine,
+        'output': output,
+        'input_bytes': len(data),
+        'input_sha256': hashlib.sha256(data).hexdigest(),
+        'blocks': runs[0]['blocks'],
+        'placeholders': runs[0]['placeholders'],
+        'html_chars': runs[0]['html_chars'],
+        'total_s': total,
+        'stages_s': {stage: statistics.median(run['stages'][stage] for run in runs) for stage in STAGES},
+        'throughput': {
+            'blocks_per_s': runs[0]['blocks'] / total['median'],
+            'input_mb_per_s': len(data) / total['median'] / 1e6,
+            'html_mb_per_s': runs[0]['html_chars'] / total['median'] / 1e6,
+        },
+    }
+    if memory:
+        # Process riêng cho mỗi lần đo để RSS đỉnh không bị lẫn giữa các trường hợp
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result.update(executor.submit(measure_memory, engine, data, output).result())
+    return result
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True
+        ).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def collect_meta(args):
+    import docx
+    import lxml.etree
+    from app.services.docx_converter import CONVERTER_VERSION
+    commit, dirty = git_commit()
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'python_docx': getattr(docx, '__version__', None),
+        'lxml': '.'.join(str(part) for part in lxml.etree.LXML_VERSION),
+        'converter_version': CONVERTER_VERSION,
+        'scale': args.scale,
+        'seed': args.seed,
+        'repeat': args.repeat,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    So sánh thời gian median với baseline. Trả về danh sách các trường hợp chậm đi quá threshold
+    (chỉ so khi input giống hệt nhau: cùng sha256).
+    """
+    regressions = []
+    print(f"\n{'case':<34}{'baseline':>12}{'current':>12}{'change':>10}")
+    for key, current in results['results'].items():
+        previous = baseline.get('results', {}).get(key)
+        if previous is None:
+            continue
+        if previous['input_sha256'] != current['input_sha256']:
+            print(f"{key:<34}{'(input khác, bỏ qua)':>34}")
+            continue
+        before = previous['total_s']['median']
+        after = current['total_s']['median']
+        change = after / before - 1 if before else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print(f"{key:<34}{before * 1000:>10.1f}ms{after * 1000:>10.1f}ms{change:>+9.1%}{flag}")
+    return regressions
+
+
+def print_result(key, result):
+    stages = ' '.join(f"{stage}={result['stages_s'][stage] * 1000:.1f}" for stage in STAGES)
+    memory = ''
+    if result.get('peak_traced_bytes') is not None:
+        memory = f" peak={result['peak_traced_bytes'] / 1e6:.1f}MB"
+        if result.get('peak_rss_delta_bytes') is not None:
+            memory += f" rss+={result['peak_rss_delta_bytes'] / 1e6:.1f}MB"
+    print(
+        f"{key:<34}{result['total_s']['median'] * 1000:>9.1f}ms "
+        f"{result['throughput']['blocks_per_s']:>9.0f} blocks/s{memory}\n    {stages}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default='', help=f"danh sách cách nhau bởi dấu phẩy ({', '.join(CASES)})")
+    parser.add_argument('--engines', default='docx,lxml', help="docx (python-docx), lxml (iterparse)")
+    parser.add_argument('--outputs', default='soup,string', help="soup, string")
+    parser.add_argument('--scale', type=float, default=1.0, help="nhân kích thước các tài liệu tổng hợp")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help="không đo bộ nhớ đỉnh (nhanh hơn)")
+    parser.add_argument('--output', help="file JSON kết quả (mặc định benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', help="file JSON của lần chạy trước để so sánh")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="chậm đi quá tỉ lệ này so với --compare => exit code 1")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [name for name in args.cases.split(',') if name]
+    unknown = set(names) - set(CASES)
+    if unknown:
+        raise SystemExit(f"Unknown cases: {', '.join(sorted(unknown))}")
+    engines = [engine for engine in args.engines.split(',') if engine]
+    outputs = [output for output in args.outputs.split(',') if output]
+
+    corpus = build_corpus(args.scale, names, args.seed)
+    meta = collect_meta(args)
+    results = {'meta': meta, 'results': {}}
+    for name, data in corpus.items():
+        for engine in engines:
+            for output in outputs:
+                key = f"{name}/{engine}/{output}"
+                result = bench_case(name, data, engine, output, args.repeat, args.warmup, not args.no_memory)
+                results['results'][key] = result
+                print_result(key, result)
+
+    path = args.output
+    if not path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        label = (meta['commit'] or 'local')[:12] + ('-dirty' if meta['dirty'] else '')
+        path = os.path.join(RESULTS_DIR, f"{label}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nResults written to {path}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
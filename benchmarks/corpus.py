@@ -0,0 +1,179 @@
+# benchmarks/corpus.py
+
+"""
+Sinh bộ tài liệu DOCX tổng hợp (synthetic) cho benchmark bằng python-docx.
+Mọi thứ đều xác định theo seed => cùng phiên bản python-docx luôn cho cùng bytes,
+nên kết quả giữa các commit so sánh được với nhau.
+"""
+
+import io
+import random
+import datetime
+import struct
+import zipfile
+import zlib
+
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Inches, Pt, RGBColor
+
+LABELS = ['Họ và tên: ', 'Địa chỉ: ', 'Số CCCD: ', 'Nơi cấp: ', 'Điện thoại: ', 'Email: ', 'Ghi chú: ']
+FILLER = ['Căn cứ Luật Doanh nghiệp ', 'đề nghị cơ quan có thẩm quyền ', 'xác nhận nội dung sau ',
+          'theo quy định hiện hành ', 'a & b <c> "q" ']
+FIXED_TIME = datetime.datetime(2024, 1, 1)
+ALIGNMENTS = [None, WD_ALIGN_PARAGRAPH.CENTER, WD_ALIGN_PARAGRAPH.JUSTIFY, WD_ALIGN_PARAGRAPH.RIGHT]
+
+
+def make_png(rng: random.Random, size: int = 32) -> bytes:
+    """Ảnh PNG size x size điểm ảnh ngẫu nhiên (mỗi ảnh một nội dung khác nhau)."""
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data
+                + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    raw = b''.join(b'\x00' + bytes(rng.getrandbits(8) for _ in range(size * 3)) for _ in range(size))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw))
+            + chunk(b'IEND', b''))
+
+
+def add_paragraphs(document, rng, count, runs_per_paragraph, dot_density, uniform_style=False):
+    """
+    count paragraph, mỗi paragraph runs_per_paragraph run.
+    dot_density: xác suất một run là nhãn + dấu chấm ("Họ và tên: ........").
+    uniform_style=True => mọi run cùng định dạng (Word phân mảnh run nhưng style giống nhau).
+    """
+    for _ in range(count):
+        paragraph = document.add_paragraph()
+        paragraph.alignment = rng.choice(ALIGNMENTS)
+        for _ in range(runs_per_paragraph):
+            if rng.random() < dot_density:
+                text = rng.choice(LABELS) + '.' * rng.randint(3, 40)
+            else:
+                text = rng.choice(FILLER)
+            run = paragraph.add_run(text)
+            if uniform_style:
+                continue
+            if rng.random() < .3:
+                run.bold = True
+            if rng.random() < .2:
+                run.italic = True
+            if rng.random() < .2:
+                run.font.size = Pt(rng.choice([12, 13, 14]))
+            if rng.random() < .05:
+                run.font.color.rgb = RGBColor(0xc0, 0, 0)
+            if rng.random() < .05:
+                run.add_break()
+
+
+def fill_table(table, rng, dot_density):
+    for row_index, row in enumerate(table.rows):
+        for col_index, cell in enumerate(row.cells):
+            if rng.random() < dot_density:
+                cell.text = f'{rng.choice(LABELS)}{"." * rng.randint(3, 20)}'
+            else:
+                cell.text = f'r{row_index}c{col_index} {rng.choice(FILLER)}'
+
+
+def add_merged_table(document, rng, rows, cols, dot_density):
+    """Bảng rows x cols có ô gộp ngang (gridSpan) và gộp dọc (vMerge)."""
+    table = document.add_table(rows=rows, cols=cols)
+    table.style = 'Table Grid'
+    fill_table(table, rng, dot_density)
+    for row_index in range(0, rows - 2, 3):
+        # Gộp ngang hai ô đầu hàng, gộp dọc ba hàng ở cột cuối
+        table.cell(row_index, 0).merge(table.cell(row_index, 1))
+        table.cell(row_index, cols - 1).merge(table.cell(row_index + 2, cols - 1))
+    return table
+
+
+def add_nested_table(container, rng, depth, rows, cols, dot_density):
+    """Bảng lồng nhau depth cấp (container: Document hoặc ô _Cell)."""
+    table = container.add_table(rows=rows, cols=cols)
+    if hasattr(table, 'style'):
+        table.style = 'Table Grid'
+    fill_table(table, rng, dot_density)
+    if depth > 1:
+        add_nested_table(table.cell(rows - 1, cols - 1), rng, depth - 1, rows, cols, dot_density)
+    return table
+
+
+def add_images(document, rng, count, size=32):
+    for _ in range(count):
+        document.add_paragraph(rng.choice(LABELS))
+        document.add_picture(io.BytesIO(make_png(rng, size)), width=Inches(0.5))
+
+
+def build_document(spec: dict, seed: int = 0) -> bytes:
+    """Dựng DOCX theo spec (xem CASES), trả về bytes."""
+    rng = random.Random(seed)
+    document = Document()
+    document.add_heading('Mẫu số 01', 1)
+    if spec.get('paragraphs'):
+        add_paragraphs(
+            document, rng, spec['paragraphs'], spec.get('runs', 4), spec.get('dot_density', .2),
+            uniform_style=spec.get('uniform_style', False),
+        )
+    for _ in range(spec.get('tables', 0)):
+        add_merged_table(document, rng, spec.get('rows', 20), spec.get('cols', 6), spec.get('dot_density', .2))
+        document.add_paragraph()
+    for _ in range(spec.get('nested_tables', 0)):
+        add_nested_table(document, rng, spec.get('depth', 3), 3, 3, spec.get('dot_density', .2))
+        document.add_paragraph()
+    if spec.get('images'):
+        add_images(document, rng, spec['images'], spec.get('image_size', 32))
+    # Cố định metadata thời gian để bytes của file không phụ thuộc lúc sinh
+    document.core_properties.created = FIXED_TIME
+    document.core_properties.modified = FIXED_TIME
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return normalize_zip(buffer.getvalue())
+
+
+def normalize_zip(data: bytes) -> bytes:
+    """Ghi lại file zip với thời gian cố định cho mọi entry (zip lưu giờ lúc ghi file)."""
+    output = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as source, \
+            zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            target.writestr(zipfile.ZipInfo(info.filename, FIXED_TIME.timetuple()[:6]), source.read(info),
+                            compress_type=zipfile.ZIP_DEFLATED)
+    return output.getvalue()
+
+
+def scaled(spec: dict, scale: float) -> dict:
+    """Nhân các số lượng (paragraph, bảng, ảnh, hàng) trong spec với scale."""
+    result = dict(spec)
+    for key in ('paragraphs', 'tables', 'nested_tables', 'images', 'rows'):
+        if result.get(key):
+            result[key] = max(1, int(round(result[key] * scale)))
+    return result
+
+
+# Các trường hợp benchmark: mỗi trường hợp nhấn vào một phần của converter
+CASES = {
+    # Văn bản thường, ít run
+    'paragraphs': {'paragraphs': 1000, 'runs': 4, 'dot_density': .1},
+    # Word tách một paragraph thành hàng trăm run cùng style (gộp run trong group_runs_by_style)
+    'fragmented_runs': {'paragraphs': 100, 'runs': 300, 'dot_density': .02, 'uniform_style': True},
+    # Biểu mẫu dày đặc dấu chấm (regex + span placeholder)
+    'dot_leaders': {'paragraphs': 800, 'runs': 6, 'dot_density': .9},
+    # Bảng lớn có gridSpan/vMerge
+    'merged_tables': {'tables': 10, 'rows': 40, 'cols': 8, 'dot_density': .3},
+    # Bảng lồng bảng
+    'nested_tables': {'nested_tables': 40, 'depth': 3, 'dot_density': .3},
+    # Nhiều ảnh nhúng
+    'images': {'paragraphs': 20, 'images': 60, 'image_size': 48},
+    # Tổng hợp
+    'mixed': {'paragraphs': 300, 'runs': 8, 'dot_density': .3, 'tables': 3, 'rows': 20, 'cols': 6,
+              'nested_tables': 5, 'depth': 2, 'images': 10},
+}
+
+
+def build_corpus(scale: float = 1.0, names=None, seed: int = 0) -> dict:
+    """{tên trường hợp: bytes DOCX} cho các trường hợp được chọn (mặc định tất cả)."""
+    return {
+        name: build_document(scaled(spec, scale), seed)
+        for name, spec in CASES.items()
+        if not names or name in names
+    }